@@ -1,6 +1,6 @@
 {
     "name": "Supplier Pricelist Sync v3.1 (Hub Integration)",
-    "version": "19.0.3.1.8",
+    "version": "19.0.3.1.9",
     "summary": "Direct supplier pricelist import with DBW Base v2 integration",
     "description": """
 Direct Supplier Pricelist Import System:
@@ -29,6 +29,7 @@ Built for Odoo 19 Community Edition
         "views/import_history_views.xml",
         "views/import_schedule_views.xml",
         "views/import_queue_views.xml",
+        "views/missing_product_views.xml",
         "views/supplier_mapping_template_views.xml",
         "views/product_supplierinfo_views.xml",
         "views/product_template_views.xml",
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+19.0.3.1.9: queue cron elke minuut (dead-worker detectie binnen een minuut)
+data/import_queue_cron.xml staat in noupdate: bestaande installaties houden anders het oude interval
+"""
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    cr.execute("""
+        UPDATE ir_cron
+        SET interval_number = 1, interval_type = 'minutes'
+        WHERE id IN (
+            SELECT res_id FROM ir_model_data
+            WHERE module = 'product_supplier_sync' AND model = 'ir.cron'
+            AND name = 'ir_cron_process_import_queue'
+        )
+    """)
@@ -1,7 +1,10 @@
 from . import import_error_extend
 from . import import_history_extend
+from . import import_payload
+from . import missing_product
 from . import brand_mapping
 from . import dashboard
+from . import import_engine
 from . import direct_import
 from . import supplier_mapping_template
 from . import product_supplierinfo
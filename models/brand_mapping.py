@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 
 class SupplierBrandMapping(models.Model):
     _name = 'supplier.brand.mapping'
@@ -39,6 +39,40 @@ class SupplierBrandMapping(models.Model):
          'Deze CSV merk naam bestaat al voor deze leverancier!')
     ]
     
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return records
+    
+    def write(self, vals):
+        result = super().write(vals)
+        self.env.registry.clear_cache()
+        return result
+    
+    def unlink(self):
+        result = super().unlink()
+        self.env.registry.clear_cache()
+        return result
+    
+    @api.model
+    def _normalize_brand_name(self, csv_brand_name):
+        """Normaliseer CSV merk naam voor case-insensitive lookup (zelfde als =ilike)"""
+        return (csv_brand_name or '').strip().lower()
+    
+    @api.model
+    @tools.ormcache('supplier_id')
+    def _get_supplier_brand_map(self, supplier_id):
+        """
+        {genormaliseerde CSV merk naam: product.brand id} voor één leverancier
+        Gecached per leverancier, geleegd bij create/write/unlink van mappings
+        """
+        mappings = self.sudo().search_read([('supplier_id', '=', supplier_id)], ['csv_brand_name', 'odoo_brand_id'])
+        brand_map = {}
+        for mapping in mappings:
+            brand_map.setdefault(self._normalize_brand_name(mapping['csv_brand_name']), mapping['odoo_brand_id'][0])
+        return tools.frozendict(brand_map)
+    
     @api.model
     def get_mapped_brand(self, supplier_id, csv_brand_name):
         """
@@ -47,10 +81,22 @@ class SupplierBrandMapping(models.Model):
         """
         if not csv_brand_name:
             return False
-            
-        mapping = self.search([
-            ('supplier_id', '=', supplier_id),
-            ('csv_brand_name', '=ilike', csv_brand_name.strip())
-        ], limit=1)
         
-        return mapping.odoo_brand_id if mapping else False
+        brand_id = self._get_supplier_brand_map(supplier_id).get(self._normalize_brand_name(csv_brand_name))
+        return self.env['product.brand'].browse(brand_id) if brand_id else False
+    
+    @api.model
+    def get_mapped_brands(self, supplier_id, csv_brand_names):
+        """
+        Bulk variant van get_mapped_brand: één query (of geen, uit cache) voor alle namen
+        Returns: {csv_brand_name: product.brand record of False}
+        """
+        brand_map = self._get_supplier_brand_map(supplier_id)
+        Brand = self.env['product.brand']
+        result = {}
+        for csv_brand_name in csv_brand_names:
+            if not csv_brand_name or csv_brand_name in result:
+                continue
+            brand_id = brand_map.get(self._normalize_brand_name(csv_brand_name))
+            result[csv_brand_name] = Brand.browse(brand_id) if brand_id else False
+        return result
@@ -86,14 +86,13 @@ class SupplierPricelistDashboard(models.Model):
         }
     
     def action_view_import_errors(self):
-        """View products that were NOT found during imports"""
+        """View products that were NOT found during imports (deduplicated per supplier)"""
         return {
             'name': 'Import Errors - Products Not Found',
             'type': 'ir.actions.act_window',
-            'res_model': 'supplier.import.error',
+            'res_model': 'supplier.missing.product',
             'view_mode': 'list,form',
-            'domain': [('error_type', '=', 'product_not_found'), ('resolved', '=', False)],
-            'context': {'default_error_type': 'product_not_found'}
+            'domain': [('resolved', '=', False)],
         }
     
     def action_manage_suppliers(self):
@@ -0,0 +1,1496 @@
+# -*- coding: utf-8 -*-
+"""
+Import Engine - Bulk import pipeline voor leveranciers CSV's
+Prescan → Bulk Update → Bulk Create → Cleanup → Post-process, los van de UI.
+De wizard (directe imports) en de import queue (achtergrond, chunks) gebruiken
+dezelfde engine; geen tijdelijke wizard of tweede kopie van de payload nodig
+"""
+
+from odoo import models, fields, api
+import io
+import json
+import logging
+import time
+
+from .import_stream import count_lines, iter_csv_rows, iter_windows
+from .mapping_plan import apply_mapping_plan, cell, compile_mapping_plan, prefetch_mapping_plan, row_fingerprint
+
+_logger = logging.getLogger(__name__)
+
+# Rijen per prescan window (product lookup + classificatie per window)
+PRESCAN_WINDOW_SIZE = 5000
+
+# Rijen per staging batch voor de SQL upsert engine
+SQL_UPSERT_BATCH_SIZE = 5000
+
+# CSV rijen per checkpoint window van step 3/4 (na elk window: commit + last_processed_row)
+CHECKPOINT_WINDOW_ROWS = 2500
+
+# Supplierinfo regels per last_sync_date touch van ongewijzigde rijen
+UNCHANGED_TOUCH_BATCH_SIZE = 10000
+
+# Verouderde supplierinfo regels per delete batch van de cleanup (commit per batch)
+CLEANUP_BATCH_SIZE = 5000
+
+# Templates per archiveer batch van de post-process stap (één query + write + commit)
+ARCHIVE_BATCH_SIZE = 1000
+
+# Error regels per COPY batch naar supplier.import.error (commit per batch)
+ERROR_BATCH_SIZE = 5000
+
+# Velden die de SQL upsert engine zelf zet (nooit uit de CSV)
+SQL_UPSERT_RESERVED_FIELDS = {
+    'id', 'partner_id', 'product_tmpl_id', 'product_id', 'previous_price', 'last_sync_date',
+    'create_uid', 'create_date', 'write_uid', 'write_date',
+}
+SQL_UPSERT_FIELD_TYPES = {
+    'char', 'text', 'float', 'monetary', 'integer', 'boolean', 'selection', 'date', 'datetime', 'many2one',
+}
+
+
+def copy_csv(rows):
+    """
+    StringIO with rows for COPY ... FROM STDIN WITH (FORMAT csv)
+    None wordt een onquoted leeg veld (= NULL), strings worden altijd gequote
+    (csv.QUOTE_NONNUMERIC schrijft None als "" en dat leest PostgreSQL als lege string)
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(_copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+def _copy_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class SupplierImportEngine(models.AbstractModel):
+    """
+    Import engine mixin: de record die importeert levert payload en opties
+    Verwacht velden: supplier_id, csv_filename, encoding, csv_separator, min_stock_qty,
+    min_price, skip_discontinued, cleanup_old_supplierinfo, use_sql_upsert
+    en een _open_csv_stream() implementatie
+    """
+    _name = 'supplier.import.engine'
+    _description = 'Supplier Import Engine'
+
+    # =========================================================================
+    # PAYLOAD & ORCHESTRATIE
+    # =========================================================================
+    
+    def _open_csv_stream(self):
+        """Binary stream of the CSV payload (implemented by the importing model)"""
+        raise NotImplementedError()
+    
+    def _import_heartbeat(self):
+        """Called at batch boundaries of long running steps (no-op, queue jobs override)"""
+        return
+    
+    def _load_prescan_cache(self):
+        """Prescan state of an earlier slice of this import (None = geen cache, queue jobs override)"""
+        return None
+    
+    def _store_prescan_cache(self, prescan_data):
+        """Keep the prescan state for the next slice (no-op, queue jobs override)"""
+        return
+    
+    @staticmethod
+    def _prescan_total(prescan_data):
+        """Total CSV rows seen by the prescan"""
+        return len(prescan_data['update_codes']) + len(prescan_data['create_codes']) + \
+            len(prescan_data['unchanged']) + len(prescan_data['filtered']) + len(prescan_data['error_rows'])
+    
+    def _run_bulk_import(self, mapping, history, resume_row=0, deadline=None):
+        """
+        Step 1-5 for the whole payload; history.id is de run stamp van deze import
+        resume_row: hervatten na een checkpoint (de counters van de history tellen mee)
+        deadline: time.time() waarde waarna step 3/4 pauzeren (zie _run_write_steps)
+        Returns (stats, cleanup_stats, archived_ids), None als de deadline verstreken is
+        """
+        _logger.info("=== STEP 1: PRE-SCAN CSV ===")
+        prescan_data = self._prescan_csv_and_prepare(mapping, run_id=history.id, deadline=deadline)
+        if prescan_data.get('prescan_pending'):
+            return None
+        total_rows = self._prescan_total(prescan_data)
+        _logger.info(f"Pre-scan complete: {total_rows} rows ({len(prescan_data['update_codes'])} updates, {len(prescan_data['create_codes'])} creates, {len(prescan_data['unchanged'])} unchanged)")
+        
+        # STEP 3 + 4: BULK UPDATE / BULK CREATE (checkpointed per window)
+        base_updated = history.updated_count if resume_row else 0
+        base_created = history.created_count if resume_row else 0
+        
+        def checkpoint(row, updated, created):
+            history.write({
+                'last_processed_row': row,
+                'updated_count': base_updated + updated,
+                'created_count': base_created + created,
+            })
+        
+        _logger.info("=== STEP 3 + 4: BULK UPDATE / CREATE ===")
+        updated_count, created_count = self._run_write_steps(prescan_data, mapping, resume_row, checkpoint, deadline)
+        if prescan_data.get('interrupted_row'):
+            return None
+        
+        # STEP 5a: CLEANUP (supplierinfo zonder stempel van deze run, ook na hervatten)
+        cleanup_stats = {'removed': 0, 'template_ids': []}
+        archived_ids = []
+        if self.cleanup_old_supplierinfo:
+            _logger.info("=== STEP 5a: CLEANUP ===")
+            cleanup_stats = self._cleanup_stale_supplierinfo(history.id)
+            
+            # STEP 5b: POST-PROCESS (archive products left without suppliers by this cleanup)
+            _logger.info("=== STEP 5b: POST-PROCESS ===")
+            archived_ids = self._archive_products_without_suppliers(cleanup_stats['template_ids'])
+        
+        stats = {
+            'total': total_rows,
+            'created': base_created + created_count,
+            'updated': base_updated + updated_count,
+            'unchanged': self._resumed_unchanged(prescan_data, resume_row, base_updated + base_created),
+            'skipped': len(prescan_data['filtered']),
+            'errors': prescan_data['error_rows'],
+        }
+        return stats, cleanup_stats, archived_ids
+    
+    @staticmethod
+    def _resumed_unchanged(prescan_data, resume_row, written_before=None):
+        """
+        Unchanged count of a (resumed) run
+        Rijen t/m resume_row die een vorige slice schreef hebben nu dezelfde fingerprint en
+        staan al in updated/created: die worden afgetrokken (max. written_before), zonder
+        written_before worden alle unchanged rijen t/m resume_row overgeslagen.
+        Een prescan uit de cache is van vóór de writes en telt niets dubbel
+        """
+        if prescan_data.get('from_cache'):
+            return len(prescan_data['unchanged'])
+        resumed = sum(1 for row_data in prescan_data['unchanged'].values() if row_data['_row_num'] <= resume_row)
+        if written_before is not None:
+            resumed = min(resumed, written_before)
+        return len(prescan_data['unchanged']) - resumed
+    
+    def _finish_import(self, history, mapping, stats, cleanup_stats, archived_ids, duration, notes=''):
+        """
+        History summary, error persistence, supplier sync date and template auto-save
+        Returns the summary text
+        """
+        error_rows = stats['errors']
+        
+        summary = self._create_import_summary(stats)
+        if self.cleanup_old_supplierinfo:
+            summary += f"\n\nCleanup:\n" \
+                      f"- Verwijderd: {cleanup_stats['removed']} oude leverancier regels\n" \
+                      f"- Gearchiveerd: {len(archived_ids)} producten"
+        if notes:
+            summary += f"\n\n{notes}"
+        
+        # Update history record
+        history.write({
+            'total_rows': stats['total'],
+            'created_count': stats['created'],
+            'updated_count': stats['updated'],
+            'skipped_count': stats['skipped'],
+            'error_count': len(error_rows),
+            'duration': duration,
+            'summary': summary,
+            'state': 'completed_with_errors' if error_rows or notes else 'completed',
+            'mapping_data': json.dumps(mapping),  # Archive mapping
+            'archived_template_ids': json.dumps(archived_ids) if archived_ids else False,
+        })
+        
+        self._import_heartbeat()
+        
+        # Create error records in database for missende producten
+        if error_rows:
+            error_count = self._create_error_records(history.id, error_rows)
+            _logger.info(f"Created {error_count} error records in database")
+            self._import_heartbeat()
+        
+        # Update supplier's last sync date
+        try:
+            self.supplier_id.write({'last_sync_date': fields.Datetime.now()})
+        except Exception as e:
+            _logger.warning(f"Could not update supplier last_sync_date: {e}")
+        
+        # AUTO-SAVE mapping as template for this supplier
+        try:
+            self._auto_save_mapping_template(mapping)
+        except Exception as e:
+            _logger.warning(f"Could not auto-save mapping template: {e}")
+        
+        rows_per_sec = stats['total'] / duration if duration else 0
+        _logger.info(f"=== IMPORT COMPLETE: {duration:.1f}s, {rows_per_sec:.0f} rows/sec ===")
+        return summary
+    
+    # =========================================================================
+    # NIEUWE BULK PROCESSING METHODS - 15x sneller
+    # =========================================================================
+    
+    def _count_csv_rows(self):
+        """Count data rows (newlines minus header) without decoding the file"""
+        with self._open_csv_stream() as stream:
+            return count_lines(stream)
+    
+    def _prescan_csv_and_prepare(self, mapping, key_range=None, run_id=None, deadline=None):
+        """
+        Step 1: Prescan CSV (streaming) and categorize rows
+        CSV wordt in chunks gelezen en per window van PRESCAN_WINDOW_SIZE rijen
+        geclassificeerd; alleen de velden die latere stappen nodig hebben blijven bewaard.
+        De mapping wordt één keer gecompileerd (zie _compile_mapping_plan).
+        Bestaande producten waarvan de fingerprint gelijk is aan de vorige import
+        komen in unchanged en worden niet opnieuw geschreven.
+        key_range: optioneel (key_from, key_to) - alleen rijen met key_from <= chunk key < key_to
+        (key_to None = onbegrensd, zie _chunk_keys), voor chunk jobs van de import queue
+        run_id: history id waarmee de write steps elke geraakte supplierinfo stempelen
+        deadline (time.time() waarde): prescan stopt voor het volgende window als die verstreken is,
+        zet prescan_data['prescan_pending'] en bewaart de stand (_store_prescan_cache);
+        de volgende slice gaat verder na prescanned_row en leest eerdere rijen alleen door.
+        Een complete prescan uit de cache wordt niet opnieuw gedaan (from_cache)
+        Returns dict with: update_codes, create_codes, unchanged, filtered, error_rows,
+        run_id, supplierinfo_map, prescanned_row
+        """
+        cached = self._load_prescan_cache()
+        if cached:
+            prescan_data = dict(cached, run_id=run_id, from_cache=True)
+        else:
+            prescan_data = {
+                'update_codes': {},  # {product_code: row_data}
+                'create_codes': {},  # {product_code: row_data}
+                'unchanged': {},      # {product_code: row_data} - same fingerprint as last import
+                'filtered': [],       # Filtered out rows
+                'error_rows': [],     # Rows with errors
+                'headers': [],        # CSV header (csv_data van error rows)
+                'prescanned_row': 0,  # Laatste geclassificeerde rij (hervatten na een slice)
+                'prescan_complete': False,
+                'run_id': run_id,     # Stamp for every supplierinfo written/touched (cleanup)
+            }
+        # Existing supplierinfo of this supplier, shared by prescan/cleanup/update/create
+        prescan_data['supplierinfo_map'] = self._load_supplierinfo_map()
+        if prescan_data['prescan_complete']:
+            _logger.info(f"Pre-scan loaded from cache ({self._prescan_total(prescan_data)} rows)")
+            return prescan_data
+        
+        start_row = prescan_data['prescanned_row']
+        with self._open_csv_stream() as stream:
+            headers, rows = iter_csv_rows(stream, self.encoding, self.csv_separator)
+            prescan_data['headers'] = headers
+            plan = self._compile_mapping_plan(mapping, headers)
+            columns = self._prescan_columns(mapping, headers)
+            for window in iter_windows(rows, PRESCAN_WINDOW_SIZE):
+                last_row = window[-1][0]
+                if last_row <= start_row:
+                    continue  # Vorige slice: al geclassificeerd
+                if prescan_data['prescanned_row'] > start_row and deadline and time.time() >= deadline:
+                    # Minstens één window per slice, het laatste window nooit uitstellen
+                    prescan_data['prescan_pending'] = True
+                    break
+                window = [(row_num, row) for row_num, row in window if row_num > start_row]
+                if key_range:
+                    window = self._filter_key_range(window, columns, key_range)
+                self._prescan_window(window, plan, headers, columns, prescan_data)
+                prescan_data['prescanned_row'] = last_row
+                self._import_heartbeat()
+        
+        prescan_data['prescan_complete'] = not prescan_data.get('prescan_pending')
+        self._store_prescan_cache(prescan_data)
+        if prescan_data.get('prescan_pending'):
+            _logger.info(f"Time budget used up during pre-scan, stopped after row {prescan_data['prescanned_row']}")
+            return prescan_data
+        
+        if prescan_data['unchanged']:
+            _logger.info(f"Pre-scan: {len(prescan_data['unchanged'])} rows unchanged since last import")
+        
+        return prescan_data
+    
+    @staticmethod
+    def _row_product_key(row, columns):
+        """Product key of a CSV row: barcode, anders product code ('' als beide leeg)"""
+        return cell(row, columns['barcode']) or cell(row, columns['code'])
+    
+    def _chunk_keys(self, window, columns):
+        """
+        Chunk key per (row_num, row): 'template:<id>' als het product bestaat (barcode eerst,
+        dan product code, ook archived), anders de product key zelf.
+        Varianten van één template vallen zo altijd in dezelfde chunk job; parallelle chunks
+        maken nooit allebei een template-level supplierinfo voor hetzelfde template
+        Returns list of (chunk_key, row_num, row)
+        """
+        barcode_idx = columns['barcode']
+        code_idx = columns['code']
+        by_barcode, by_code = self._match_products(
+            {cell(row, barcode_idx) for _row_num, row in window} - {''},
+            {cell(row, code_idx) for _row_num, row in window} - {''},
+        )
+        keyed = []
+        for row_num, row in window:
+            info = by_barcode.get(cell(row, barcode_idx)) or by_code.get(cell(row, code_idx))
+            key = f"template:{info['product_tmpl_id']}" if info else self._row_product_key(row, columns)
+            keyed.append((key, row_num, row))
+        return keyed
+    
+    def _filter_key_range(self, window, columns, key_range):
+        """Keep the (row_num, row) tuples whose chunk key falls in [key_from, key_to)"""
+        key_from, key_to = key_range
+        return [
+            (row_num, row) for key, row_num, row in self._chunk_keys(window, columns)
+            if key_from <= key and (key_to is None or key < key_to)
+        ]
+    
+    def _scan_chunk_keys(self, mapping):
+        """
+        Sorted distinct chunk keys of the CSV (streaming, één product lookup per window)
+        Gebruikt door de import queue om chunk grenzen te bepalen
+        """
+        keys = set()
+        with self._open_csv_stream() as stream:
+            headers, rows = iter_csv_rows(stream, self.encoding, self.csv_separator)
+            columns = self._prescan_columns(mapping, headers)
+            for window in iter_windows(rows, PRESCAN_WINDOW_SIZE):
+                keys.update(key for key, _row_num, _row in self._chunk_keys(window, columns))
+                self._import_heartbeat()
+        return sorted(keys)
+    
+    def _compile_mapping_plan(self, mapping, headers):
+        """
+        Compile mapping once per import: [(column_index, bucket, field_name, converter), ...]
+        Herbruikbaar vanuit queue en smart import (zie models/mapping_plan.py)
+        """
+        return compile_mapping_plan(self.env, mapping, headers, supplier_id=self.supplier_id.id)
+    
+    @staticmethod
+    def _prescan_columns(mapping, headers):
+        """Column indexes of the identification / error logging columns"""
+        column_index = {header: idx for idx, header in enumerate(headers)}
+        
+        def mapped(predicate):
+            csv_col = next((k for k, v in mapping.items() if v and predicate(v)), None)
+            return column_index.get(csv_col) if csv_col else None
+        
+        return {
+            'barcode': mapped(lambda v: v == 'product.barcode'),
+            'code': mapped(lambda v: v == 'product.default_code'),
+            'name': mapped(lambda v: v == 'product.name'),
+            'brand': mapped(lambda v: any(term in v.lower() for term in ['brand', 'merk'])),
+            # FALLBACK: common column names if not found in mapping
+            'name_fallback': [column_index[c] for c in ['name', 'product_name', 'description', 'omschrijving', 'productnaam', 'Name', 'Description', 'Omschrijving'] if c in column_index],
+            'brand_fallback': [column_index[c] for c in ['brand', 'merk', 'fabrikant', 'manufacturer', 'Brand', 'Merk', 'Fabrikant', 'Manufacturer'] if c in column_index],
+        }
+    
+    def _prescan_window(self, window, plan, headers, columns, prescan_data):
+        """Classify one window of (row_num, row) tuples into prescan_data"""
+        Product = self.env['product.product'].with_context(active_test=False)
+        si_map = self._get_supplierinfo_map(prescan_data)
+        barcode_idx = columns['barcode']
+        code_idx = columns['code']
+        
+        # Collect barcodes and codes of this window only
+        window_barcodes = set()
+        window_codes = set()
+        for row_num, row in window:
+            barcode = cell(row, barcode_idx)
+            if barcode:
+                window_barcodes.add(barcode)
+            product_code = cell(row, code_idx)
+            if product_code:
+                window_codes.add(product_code)
+        
+        # Bulk fetch existing products for this window
+        existing_by_barcode = {}
+        existing_by_code = {}
+        
+        if window_barcodes:
+            products_by_barcode = Product.search([('barcode', 'in', list(window_barcodes))])
+            existing_by_barcode = {p.barcode: p for p in products_by_barcode if p.barcode}
+        
+        if window_codes:
+            products_by_code = Product.search([('default_code', 'in', list(window_codes))])
+            existing_by_code = {p.default_code: p for p in products_by_code if p.default_code}
+        
+        # Resolve distinct many2one values (e.g. brand) of this window in one query per column
+        prefetch_mapping_plan(plan, [row for _row_num, row in window])
+        
+        for row_num, row in window:
+            try:
+                # Extract product identification
+                barcode = cell(row, barcode_idx)
+                product_code = cell(row, code_idx)
+                
+                if not barcode and not product_code:
+                    prescan_data['error_rows'].append({
+                        'row': row_num,
+                        'barcode': '',
+                        'product_code': '',
+                        'product_name': '',
+                        'brand': '',
+                        'row_data': dict(zip(headers, row)),
+                        'error': 'No barcode or product code',
+                        'error_type': 'invalid_data',
+                    })
+                    continue
+                
+                # Parse all fields for this row (compiled plan, no per-cell lookups)
+                row_data = apply_mapping_plan(plan, row)
+                
+                # Apply filters
+                if self._should_filter_row(row_data):
+                    prescan_data['filtered'].append(row_num)
+                    continue
+                
+                # Check if product exists
+                product = existing_by_barcode.get(barcode) or existing_by_code.get(product_code)
+                
+                product_key = barcode or product_code
+                row_data['_barcode'] = barcode
+                row_data['_product_code'] = product_code
+                row_data['_product_id'] = product.id if product else None
+                row_data['_product_tmpl_id'] = product.product_tmpl_id.id if product else None
+                row_data['_row_num'] = row_num
+                row_data['_fingerprint'] = row_fingerprint(row_data)
+                
+                # Keep brand, product_name and the raw cells for error logging (only for unknown products)
+                if not product:
+                    product_name = cell(row, columns['name'])
+                    brand = cell(row, columns['brand'])
+                    
+                    if not product_name:
+                        product_name = next(filter(None, (cell(row, idx) for idx in columns['name_fallback'])), '')
+                    if not brand:
+                        brand = next(filter(None, (cell(row, idx) for idx in columns['brand_fallback'])), '')
+                    
+                    row_data['_csv_brand'] = brand
+                    row_data['_csv_product_name'] = product_name
+                    row_data['_csv_row'] = row
+                
+                if product:
+                    # Same values as last import and nothing to reactivate: skip the write steps
+                    entry = si_map.get(row_data['_product_tmpl_id'])
+                    if product.active and entry and entry['id'] and entry['fingerprint'] == row_data['_fingerprint']:
+                        prescan_data['unchanged'][product_key] = row_data
+                    else:
+                        prescan_data['update_codes'][product_key] = row_data
+                else:
+                    prescan_data['create_codes'][product_key] = row_data
+                
+            except Exception as e:
+                prescan_data['error_rows'].append({
+                    'row': row_num,
+                    'barcode': cell(row, barcode_idx),
+                    'product_code': cell(row, code_idx),
+                    'product_name': '',
+                    'brand': '',
+                    'row_data': dict(zip(headers, row)),
+                    'error': str(e),
+                    'error_type': 'system_error',
+                })
+                _logger.warning(f"Error pre-scanning row {row_num}: {e}")
+    
+    def _parse_row_data(self, row, mapping):
+        """Parse CSV row (dict) into structured data dict - prescan uses the compiled plan directly"""
+        plan = self._compile_mapping_plan(mapping, list(row))
+        return apply_mapping_plan(plan, [value or '' for value in row.values()])
+    
+    def _should_filter_row(self, row_data):
+        """Check if row should be filtered out based on skip conditions"""
+        supplierinfo_fields = row_data.get('supplierinfo_fields', {})
+        product_fields = row_data.get('product_fields', {})
+        
+        # Stock filters
+        if self.min_stock_qty > 0:
+            stock_qty = supplierinfo_fields.get('supplier_stock', 0)
+            if stock_qty < self.min_stock_qty:
+                return True
+        
+        # Price filters
+        if self.min_price > 0.0:
+            price = supplierinfo_fields.get('price', 0.0)
+            if price < self.min_price:
+                return True
+        
+        # Discontinued filter
+        if self.skip_discontinued:
+            if product_fields.get('discontinued') or product_fields.get('is_discontinued'):
+                return True
+        
+        return False
+    
+    def _cleanup_stale_supplierinfo(self, run_id):
+        """
+        Step 5a: Remove supplierinfo of this supplier that import run run_id did not touch
+        Eén geïndexeerd predicaat (partner + run stamp) i.p.v. een lijst geïmporteerde
+        templates; overige regels van een template dat deze run gestempeld heeft blijven staan.
+        Returns {'removed': count, 'template_ids': templates die regels verloren (voor step 5b)}
+        """
+        cleanup_stats = {'removed': 0, 'template_ids': []}
+        partner_id = self.supplier_id.id
+        
+        Supplierinfo = self.env['product.supplierinfo']
+        Supplierinfo.flush_model(['partner_id', 'product_tmpl_id', 'import_history_id'])
+        # Run heeft niets gestempeld (bijv. alleen fouten): niet alles van de leverancier weggooien
+        self.env.cr.execute("""
+            SELECT 1 FROM product_supplierinfo
+            WHERE partner_id = %s AND import_history_id = %s
+            LIMIT 1
+        """, (partner_id, run_id))
+        if not run_id or not self.env.cr.fetchone():
+            return cleanup_stats
+        
+        # OLD supplierinfo for this supplier NOT in current import
+        self.env.cr.execute("""
+            SELECT si.id, si.product_tmpl_id
+            FROM product_supplierinfo si
+            WHERE si.partner_id = %s
+            AND si.import_history_id IS DISTINCT FROM %s
+            AND NOT EXISTS (
+                SELECT 1 FROM product_supplierinfo cur
+                WHERE cur.partner_id = si.partner_id
+                AND cur.product_tmpl_id = si.product_tmpl_id
+                AND cur.import_history_id = %s
+            )
+        """, (partner_id, run_id, run_id))
+        stale = self.env.cr.fetchall()
+        if not stale:
+            return cleanup_stats
+        stale_ids = [si_id for si_id, _tmpl_id in stale]
+        stale_templates = {tmpl_id for _si_id, tmpl_id in stale}
+        
+        total_to_delete = len(stale_ids)
+        _logger.info(f"Cleanup: Removing {total_to_delete} old supplierinfo records for this supplier")
+        for batch_start in range(0, total_to_delete, CLEANUP_BATCH_SIZE):
+            Supplierinfo.browse(stale_ids[batch_start:batch_start + CLEANUP_BATCH_SIZE]).unlink()
+            self.env.cr.commit()
+            self._import_heartbeat()
+            deleted_count = min(batch_start + CLEANUP_BATCH_SIZE, total_to_delete)
+            _logger.info(f"Cleanup progress: {deleted_count}/{total_to_delete} ({deleted_count / total_to_delete * 100:.1f}%) deleted")
+        cleanup_stats['removed'] = total_to_delete
+        cleanup_stats['template_ids'] = sorted(stale_templates)
+        
+        return cleanup_stats
+    
+    def _templates_without_suppliers(self, template_ids):
+        """Active templates among template_ids that have no supplierinfo left (one indexed query per call)"""
+        if not template_ids:
+            return []
+        self.env['product.supplierinfo'].flush_model(['product_tmpl_id'])
+        self.env['product.template'].flush_model(['active'])
+        self.env.cr.execute("""
+            SELECT pt.id
+            FROM product_template pt
+            WHERE pt.id = ANY(%s)
+            AND pt.active = true
+            AND NOT EXISTS (
+                SELECT 1 FROM product_supplierinfo si
+                WHERE si.product_tmpl_id = pt.id
+            )
+        """, (list(template_ids),))
+        return [row[0] for row in self.env.cr.fetchall()]
+    
+    def _run_write_steps(self, prescan_data, mapping, resume_row=0, on_checkpoint=None, deadline=None):
+        """
+        Step 3 (update + touch unchanged) and step 4 (create) per window of CSV rows
+        Na elk window is alles gecommit en wordt on_checkpoint(last_row, updated, created)
+        aangeroepen (gevolgd door een commit). Met resume_row worden rijen t/m die rij
+        overgeslagen; overgeslagen create rijen worden alleen opnieuw opgezocht (zonder
+        schrijven) zodat hun 'product not found' errors in het resultaat blijven.
+        deadline (time.time() waarde): na het checkpoint waarop die verstreken is stopt de run
+        en staat de laatste gecommitte rij in prescan_data['interrupted_row']
+        Returns (updated_count, created_count) van deze run
+        """
+        codes_keys = ('update_codes', 'unchanged', 'create_codes')
+        pending = {}
+        skipped_creates = []
+        for codes_key in codes_keys:
+            items = sorted(prescan_data[codes_key].items(), key=lambda item: item[1]['_row_num'])
+            if codes_key == 'create_codes':
+                skipped_creates = [item for item in items if item[1]['_row_num'] <= resume_row]
+            pending[codes_key] = [item for item in items if item[1]['_row_num'] > resume_row]
+        
+        if resume_row:
+            _logger.info(f"Resuming write steps after row {resume_row} "
+                         f"({sum(len(items) for items in pending.values())} rows left)")
+            for batch in iter_windows(skipped_creates, SQL_UPSERT_BATCH_SIZE):
+                self._resolve_create_batch(batch, prescan_data, mapping)
+        
+        first_row = min((items[0][1]['_row_num'] for items in pending.values() if items), default=resume_row + 1)
+        last_row = max((items[-1][1]['_row_num'] for items in pending.values() if items), default=resume_row)
+        updated_count = 0
+        created_count = 0
+        window_start = max(resume_row, first_row - 1)
+        while window_start < last_row:
+            window_end = min(window_start + CHECKPOINT_WINDOW_ROWS, last_row)
+            window_data = dict(prescan_data)
+            for codes_key in codes_keys:
+                items = pending[codes_key]
+                split = next((idx for idx, item in enumerate(items) if item[1]['_row_num'] > window_end), len(items))
+                window_data[codes_key] = dict(items[:split])
+                pending[codes_key] = items[split:]
+            
+            if window_data['update_codes']:
+                updated_count += self._bulk_update_supplierinfo(window_data, mapping)
+            if window_data['unchanged']:
+                self._touch_unchanged_supplierinfo(window_data)
+            if window_data['create_codes']:
+                created_count += self._bulk_create_supplierinfo(window_data, mapping)
+            
+            if on_checkpoint:
+                on_checkpoint(window_end, updated_count, created_count)
+            self.env.cr.commit()
+            self._import_heartbeat()
+            _logger.info(f"Checkpoint: rows up to {window_end} of {last_row} committed")
+            window_start = window_end
+            
+            if deadline and window_start < last_row and time.time() >= deadline:
+                prescan_data['interrupted_row'] = window_start
+                _logger.info(f"Time budget used up, stopping after row {window_start} of {last_row}")
+                break
+        
+        return updated_count, created_count
+    
+    def _bulk_update_supplierinfo(self, prescan_data, mapping):
+        """
+        Step 3: Bulk update existing supplierinfo via SQL (in batches of 250)
+        """
+        if not prescan_data['update_codes']:
+            return 0
+        
+        if self.use_sql_upsert:
+            return self._sql_upsert_supplierinfo(prescan_data, mapping, 'update_codes')
+        
+        BATCH_SIZE = 250
+        updated_count = 0
+        update_items = list(prescan_data['update_codes'].items())
+        total_items = len(update_items)
+        si_map = self._get_supplierinfo_map(prescan_data)
+        
+        _logger.info(f"Processing {total_items} updates in batches of {BATCH_SIZE}")
+        
+        # Process in batches to avoid timeout
+        for batch_start in range(0, total_items, BATCH_SIZE):
+            batch_end = min(batch_start + BATCH_SIZE, total_items)
+            batch = update_items[batch_start:batch_end]
+            pending_creates = {}
+            
+            staged_rows = {}  # {tmpl_id: [row_data]} - pas geteld na een geslaagde flush
+            
+            _logger.info(f"Batch {batch_start//BATCH_SIZE + 1}: Processing items {batch_start+1} to {batch_end} of {total_items}")
+            
+            # Reactivate archived products of this batch in one write
+            products = self.env['product.product'].with_context(active_test=False).browse(
+                [row_data['_product_id'] for _key, row_data in batch if row_data.get('_product_id')]
+            )
+            inactive_products = products.filtered(lambda p: not p.active)
+            if inactive_products:
+                inactive_products.write({'active': True})
+                _logger.info(f"Reactivated {len(inactive_products)} products")
+            
+            for product_key, row_data in batch:
+                try:
+                    product_id = row_data.get('_product_id')
+                    if not product_id:
+                        continue
+                    
+                    tmpl_id = row_data.get('_product_tmpl_id') or \
+                        self.env['product.product'].browse(product_id).product_tmpl_id.id
+                    
+                    # Write existing or stage create - resolved against the map, no search
+                    written = self._apply_supplierinfo_vals(
+                        si_map, tmpl_id, row_data['supplierinfo_fields'], pending_creates,
+                        row_data.get('_fingerprint'), prescan_data.get('run_id'),
+                    )
+                    
+                    # Update product fields if any
+                    if row_data['product_fields']:
+                        self.env['product.product'].browse(product_id).write(row_data['product_fields'])
+                    
+                except Exception as e:
+                    _logger.error(f"Error updating {product_key}: {e}")
+                    continue
+                
+                if written:
+                    updated_count += 1
+                else:
+                    staged_rows.setdefault(tmpl_id, []).append(row_data)
+            
+            failed = self._flush_supplierinfo_creates(si_map, pending_creates)
+            updated_count += self._count_flushed_rows(staged_rows, failed, prescan_data)
+            
+            # Commit after each batch to avoid timeout
+            self.env.cr.commit()
+            _logger.info(f"Batch committed: {updated_count} records updated so far")
+        
+        _logger.info(f"Bulk update complete: {updated_count} supplier records updated")
+        return updated_count
+    
+    def _touch_unchanged_supplierinfo(self, prescan_data):
+        """
+        Step 3b: Ongewijzigde rijen alleen last_sync_date en run stamp geven (set-based, geen ORM write)
+        previous_price volgt de prijs zoals een gewone update dat zou doen,
+        zodat prijsdaling detectie niet blijft hangen op een oude wijziging
+        """
+        si_map = self._get_supplierinfo_map(prescan_data)
+        touch_ids = set()
+        priced_ids = set()
+        for row_data in prescan_data.get('unchanged', {}).values():
+            entry = si_map.get(row_data.get('_product_tmpl_id'))
+            if not entry or not entry['id']:
+                continue
+            touch_ids.add(entry['id'])
+            if 'price' in row_data['supplierinfo_fields']:
+                priced_ids.add(entry['id'])
+        
+        if not touch_ids:
+            return 0
+        
+        Supplierinfo = self.env['product.supplierinfo']
+        Supplierinfo.flush_model(['price', 'previous_price', 'last_sync_date', 'import_history_id'])
+        now = fields.Datetime.now()
+        run_id = prescan_data.get('run_id') or None
+        for batch in iter_windows(sorted(touch_ids), UNCHANGED_TOUCH_BATCH_SIZE):
+            batch_priced = tuple(si_id for si_id in batch if si_id in priced_ids) or (0,)
+            self.env.cr.execute("""
+                UPDATE product_supplierinfo
+                SET last_sync_date = %s,
+                    import_history_id = %s,
+                    previous_price = CASE WHEN id IN %s AND price > 0 THEN price ELSE previous_price END
+                WHERE id IN %s
+            """, (now, run_id, batch_priced, tuple(batch)))
+            records = Supplierinfo.browse(batch)
+            records.invalidate_recordset(['last_sync_date', 'previous_price', 'import_history_id'])
+            records.modified(['last_sync_date', 'previous_price', 'import_history_id'])
+            self.env.cr.commit()
+            self._import_heartbeat()
+        
+        _logger.info(f"Touched {len(touch_ids)} unchanged supplier records (last_sync_date only)")
+        return len(touch_ids)
+    
+    # =========================================================================
+    # SUPPLIERINFO LOOKUP MAP (één query per import)
+    # =========================================================================
+    
+    def _load_supplierinfo_map(self):
+        """
+        Load every supplierinfo of self.supplier_id with one query
+        Returns {product_tmpl_id: {'id', 'price', 'supplier_stock', 'fingerprint', 'ids'}}
+        'id' is de template-level regel (product_id leeg) die update/create gebruiken,
+        'ids' zijn alle regels van deze leverancier voor het template (voor cleanup)
+        """
+        Supplierinfo = self.env['product.supplierinfo']
+        Supplierinfo.flush_model(['partner_id', 'product_tmpl_id', 'product_id', 'price', 'supplier_stock', 'import_fingerprint'])
+        self.env.cr.execute("""
+            SELECT id, product_tmpl_id, product_id, price, supplier_stock, import_fingerprint
+            FROM product_supplierinfo
+            WHERE partner_id = %s
+            ORDER BY product_tmpl_id, sequence, min_qty DESC, price, id
+        """, (self.supplier_id.id,))
+        
+        si_map = {}
+        for si_id, tmpl_id, product_id, price, supplier_stock, fingerprint in self.env.cr.fetchall():
+            entry = si_map.setdefault(tmpl_id, {'id': None, 'price': 0.0, 'supplier_stock': 0.0, 'fingerprint': None, 'ids': []})
+            entry['ids'].append(si_id)
+            if not product_id and not entry['id']:
+                entry.update({
+                    'id': si_id,
+                    'price': price or 0.0,
+                    'supplier_stock': supplier_stock or 0.0,
+                    'fingerprint': fingerprint or None,
+                })
+        
+        _logger.info(f"Loaded {len(si_map)} existing supplierinfo templates for {self.supplier_id.name}")
+        return si_map
+    
+    def _get_supplierinfo_map(self, prescan_data):
+        """Return the per-import supplierinfo map, loading it when prescan did not"""
+        if prescan_data.get('supplierinfo_map') is None:
+            prescan_data['supplierinfo_map'] = self._load_supplierinfo_map()
+        return prescan_data['supplierinfo_map']
+    
+    @staticmethod
+    def _remember_supplierinfo(si_map, tmpl_id, si_id, vals):
+        """Keep the map in sync after a write/create"""
+        entry = si_map.setdefault(tmpl_id, {'id': None, 'price': 0.0, 'supplier_stock': 0.0, 'fingerprint': None, 'ids': []})
+        if si_id not in entry['ids']:
+            entry['ids'].append(si_id)
+        entry['id'] = si_id
+        entry['price'] = vals.get('price', entry['price'])
+        entry['supplier_stock'] = vals.get('supplier_stock', entry['supplier_stock'])
+        entry['fingerprint'] = vals.get('import_fingerprint') or None
+    
+    def _apply_supplierinfo_vals(self, si_map, tmpl_id, supplierinfo_fields, pending_creates, fingerprint=None, run_id=None):
+        """
+        Write supplierinfo_fields for one template, resolved against the map
+        Bestaande template-level regel → write (met previous_price), anders create klaarzetten
+        fingerprint wordt opgeslagen voor change detection bij de volgende import,
+        run_id als stempel voor de cleanup
+        Returns True als de regel geschreven is, False als de create klaarstaat voor de flush
+        """
+        vals = dict(
+            supplierinfo_fields, last_sync_date=fields.Datetime.now(),
+            import_fingerprint=fingerprint or False, import_history_id=run_id or False,
+        )
+        entry = si_map.get(tmpl_id)
+        
+        if entry and entry['id']:
+            # Bewaar oude prijs VOOR update (voor autopublisher prijsdaling detectie)
+            if 'price' in vals and entry['price'] > 0:
+                vals['previous_price'] = entry['price']
+            self.env['product.supplierinfo'].browse(entry['id']).write(vals)
+            self._remember_supplierinfo(si_map, tmpl_id, entry['id'], vals)
+            return True
+        if tmpl_id in pending_creates:
+            # Same template twice in one batch: last row wins, like sequential writes
+            pending_creates[tmpl_id].update(vals)
+        else:
+            vals.update({
+                'partner_id': self.supplier_id.id,
+                'product_tmpl_id': tmpl_id,
+                'product_id': False,
+            })
+            pending_creates[tmpl_id] = vals
+        return False
+    
+    def _flush_supplierinfo_creates(self, si_map, pending_creates):
+        """
+        Create the staged supplierinfo of one batch with a single multi-create
+        Returns {tmpl_id: foutmelding} van de templates waarvan de create mislukte
+        """
+        failed = {}
+        if not pending_creates:
+            return failed
+        Supplierinfo = self.env['product.supplierinfo']
+        try:
+            with self.env.cr.savepoint():
+                records = Supplierinfo.create(list(pending_creates.values()))
+            for record, (tmpl_id, vals) in zip(records, pending_creates.items()):
+                self._remember_supplierinfo(si_map, tmpl_id, record.id, vals)
+        except Exception as e:
+            _logger.warning(f"Batch create failed ({e}), retrying row by row")
+            for tmpl_id, vals in pending_creates.items():
+                try:
+                    with self.env.cr.savepoint():
+                        record = Supplierinfo.create(vals)
+                    self._remember_supplierinfo(si_map, tmpl_id, record.id, vals)
+                except Exception as row_error:
+                    _logger.error(f"Error creating supplierinfo for template {tmpl_id}: {row_error}")
+                    failed[tmpl_id] = str(row_error)
+        pending_creates.clear()
+        return failed
+    
+    def _count_flushed_rows(self, staged_rows, failed, prescan_data):
+        """
+        Count the staged rows whose supplierinfo create succeeded
+        Rijen van een mislukte create tellen alleen als error row, niet als created/updated
+        """
+        count = 0
+        for tmpl_id, rows in staged_rows.items():
+            if tmpl_id not in failed:
+                count += len(rows)
+                continue
+            for row_data in rows:
+                prescan_data['error_rows'].append({
+                    'row': row_data.get('_row_num'),
+                    'barcode': row_data.get('_barcode') or '',
+                    'product_code': row_data.get('_product_code') or '',
+                    'error': failed[tmpl_id],
+                    'error_type': 'system_error',
+                })
+        return count
+    
+    def _extract_brand_from_row(self, row_data, mapping):
+        """Extract brand value from row data (prescan keeps the CSV brand in _csv_brand)"""
+        brand = row_data.get('_csv_brand', '')
+        if brand:
+            return str(brand).strip()
+        
+        # Fallback: try various possible field names in product_fields
+        product_fields = row_data.get('product_fields', {})
+        brand = (
+            product_fields.get('brand', '') or 
+            product_fields.get('x_studio_merk', '') or 
+            product_fields.get('product_brand_id', '')
+        )
+        return str(brand).strip() if brand else ''
+    
+    def _bulk_create_supplierinfo(self, prescan_data, mapping):
+        """
+        Step 4: Bulk create new supplierinfo records (in batches of 250)
+        NOTE: Products must exist - log errors for missing products
+        """
+        if not prescan_data['create_codes']:
+            return 0
+        
+        if self.use_sql_upsert:
+            return self._sql_upsert_supplierinfo(prescan_data, mapping, 'create_codes')
+        
+        BATCH_SIZE = 250
+        created_count = 0
+        create_items = list(prescan_data['create_codes'].items())
+        total_items = len(create_items)
+        si_map = self._get_supplierinfo_map(prescan_data)
+        
+        _logger.info(f"Processing {total_items} creates in batches of {BATCH_SIZE}")
+        
+        # Process in batches to avoid timeout
+        for batch_start in range(0, total_items, BATCH_SIZE):
+            batch_end = min(batch_start + BATCH_SIZE, total_items)
+            batch = create_items[batch_start:batch_end]
+            pending_creates = {}
+            
+            staged_rows = {}  # {tmpl_id: [row_data]} - pas geteld na een geslaagde flush
+            
+            _logger.info(f"Batch {batch_start//BATCH_SIZE + 1}: Creating items {batch_start+1} to {batch_end} of {total_items}")
+            
+            # Re-resolve products for the whole batch (one IN query per key type)
+            errors_before = len(prescan_data['error_rows'])
+            resolved = self._resolve_create_batch(batch, prescan_data, mapping)
+            missing_count = len(prescan_data['error_rows']) - errors_before
+            if missing_count:
+                _logger.warning(f"Cannot create supplierinfo - {missing_count} products not found in this batch")
+            
+            for info, row_data in resolved:
+                if not info:
+                    continue
+                try:
+                    # Create supplierinfo (or write it when the map already has one for this template)
+                    written = self._apply_supplierinfo_vals(
+                        si_map, info['product_tmpl_id'], row_data['supplierinfo_fields'], pending_creates,
+                        row_data.get('_fingerprint'), prescan_data.get('run_id'),
+                    )
+                    
+                    # Update product fields if any
+                    if row_data['product_fields']:
+                        self.env['product.product'].browse(info['id']).write(row_data['product_fields'])
+                    
+                except Exception as e:
+                    _logger.error(f"Error creating supplierinfo for {row_data.get('_barcode') or row_data.get('_product_code')}: {e}")
+                    prescan_data['error_rows'].append({
+                        'row': row_data.get('_row_num'),
+                        'barcode': row_data.get('_barcode') or '',
+                        'product_code': row_data.get('_product_code') or '',
+                        'error': str(e),
+                        'error_type': 'system_error',
+                    })
+                    continue
+                
+                if written:
+                    created_count += 1
+                else:
+                    staged_rows.setdefault(info['product_tmpl_id'], []).append(row_data)
+            
+            failed = self._flush_supplierinfo_creates(si_map, pending_creates)
+            created_count += self._count_flushed_rows(staged_rows, failed, prescan_data)
+            
+            # Commit after each batch to avoid timeout
+            self.env.cr.commit()
+            _logger.info(f"Batch committed: {created_count} records created so far")
+        
+        self.env.cr.commit()
+        _logger.info(f"Bulk created {created_count} supplier records")
+        return created_count
+    
+    # =========================================================================
+    # SQL UPSERT ENGINE (opt-in via use_sql_upsert)
+    # =========================================================================
+    
+    def _sql_upsert_supplierinfo(self, prescan_data, mapping, codes_key):
+        """
+        Set-based variant van step 3/4: per batch COPY naar een staging tabel,
+        daarna één UPDATE ... FROM en één INSERT ... SELECT.
+        codes_key: 'update_codes' (step 3) of 'create_codes' (step 4)
+        Returns aantal verwerkte rijen (zelfde telling als het ORM pad)
+        """
+        is_update_step = codes_key == 'update_codes'
+        si_map = self._get_supplierinfo_map(prescan_data)
+        items = list(prescan_data[codes_key].items())
+        total_items = len(items)
+        applied_count = 0
+        
+        _logger.info(f"SQL upsert: {total_items} rows ({codes_key}) in batches of {SQL_UPSERT_BATCH_SIZE}")
+        
+        for batch_num, batch in enumerate(iter_windows(items, SQL_UPSERT_BATCH_SIZE), start=1):
+            if is_update_step:
+                product_info = self._fetch_product_info([row_data.get('_product_id') for _key, row_data in batch])
+                resolved = [(product_info.get(row_data.get('_product_id')), row_data) for _key, row_data in batch]
+            else:
+                resolved = self._resolve_create_batch(batch, prescan_data, mapping)
+            resolved = [(info, row_data) for info, row_data in resolved if info]
+            if not resolved:
+                continue
+            
+            try:
+                with self.env.cr.savepoint():
+                    if is_update_step:
+                        # Reactivate archived products in one write
+                        inactive_ids = [info['id'] for info, _row_data in resolved if not info['active']]
+                        if inactive_ids:
+                            self.env['product.product'].browse(inactive_ids).write({'active': True})
+                            _logger.info(f"Reactivated {len(inactive_ids)} products")
+                    
+                    rows_by_tmpl, touched = self._sql_apply_staging(resolved, prescan_data.get('run_id'))
+                    for si_id, tmpl_id in touched:
+                        self._remember_supplierinfo(si_map, tmpl_id, si_id, rows_by_tmpl[tmpl_id])
+                    
+                    # Product fields stay on the ORM (no generic set-based write for product.product)
+                    for info, row_data in resolved:
+                        if row_data['product_fields']:
+                            self.env['product.product'].browse(info['id']).write(row_data['product_fields'])
+                
+                applied_count += len(resolved)
+            except Exception as e:
+                _logger.error(f"SQL upsert batch {batch_num} failed: {e}", exc_info=True)
+            
+            self.env.cr.commit()
+            _logger.info(f"Batch {batch_num} committed: {applied_count}/{total_items} rows applied")
+        
+        return applied_count
+    
+    def _fetch_product_info(self, product_ids):
+        """Return {product_id: {'id', 'product_tmpl_id', 'active'}} with one query (archived included)"""
+        product_ids = tuple({pid for pid in product_ids if pid})
+        if not product_ids:
+            return {}
+        self.env['product.product'].flush_model(['product_tmpl_id', 'active'])
+        self.env.cr.execute("""
+            SELECT id, product_tmpl_id, active
+            FROM product_product
+            WHERE id IN %s
+        """, (product_ids,))
+        return {
+            pid: {'id': pid, 'product_tmpl_id': tmpl_id, 'active': active}
+            for pid, tmpl_id, active in self.env.cr.fetchall()
+        }
+    
+    def _resolve_create_batch(self, batch, prescan_data, mapping):
+        """
+        Re-resolve products for a batch of create candidates (barcode first, then default_code)
+        Eén IN query per sleutel type i.p.v. twee searches per rij (ook archived producten)
+        Onbekende producten worden als error row gelogd
+        Returns list of (product_info or None, row_data)
+        """
+        by_barcode, by_code = self._match_products(
+            {row_data['_barcode'] for _key, row_data in batch if row_data.get('_barcode')},
+            {row_data['_product_code'] for _key, row_data in batch if row_data.get('_product_code')},
+        )
+        
+        resolved = []
+        for _key, row_data in batch:
+            barcode = row_data.get('_barcode')
+            product_code = row_data.get('_product_code')
+            info = (barcode and by_barcode.get(barcode)) or (product_code and by_code.get(product_code)) or None
+            if not info:
+                brand_str = self._extract_brand_from_row(row_data, mapping)
+                product_name = row_data.get('product_fields', {}).get('name', '') or row_data.get('_csv_product_name', '')
+                prescan_data['error_rows'].append({
+                    'row': row_data.get('_row_num'),
+                    'barcode': barcode or '',
+                    'product_code': product_code or '',
+                    'product_name': product_name,
+                    'brand': brand_str,
+                    'row_data': dict(zip(prescan_data['headers'], row_data.get('_csv_row') or [])),
+                    'error': f'Product not found: {barcode or product_code}'
+                })
+            resolved.append((info, row_data))
+        return resolved
+    
+    @api.model
+    def _match_products(self, barcodes, codes):
+        """
+        Products by barcode and by default_code, one IN query per key type (archived included)
+        Returns (by_barcode, by_code) with {key: {'id', 'product_tmpl_id', 'active'}}, laagste id wint
+        """
+        by_barcode = {}
+        by_code = {}
+        self.env['product.product'].flush_model(['product_tmpl_id', 'active', 'barcode', 'default_code'])
+        if barcodes:
+            self.env.cr.execute("""
+                SELECT id, product_tmpl_id, active, barcode
+                FROM product_product
+                WHERE barcode IN %s
+                ORDER BY id
+            """, (tuple(barcodes),))
+            for pid, tmpl_id, active, barcode in self.env.cr.fetchall():
+                by_barcode.setdefault(barcode, {'id': pid, 'product_tmpl_id': tmpl_id, 'active': active})
+        if codes:
+            self.env.cr.execute("""
+                SELECT id, product_tmpl_id, active, default_code
+                FROM product_product
+                WHERE default_code IN %s
+                ORDER BY id
+            """, (tuple(codes),))
+            for pid, tmpl_id, active, code in self.env.cr.fetchall():
+                by_code.setdefault(code, {'id': pid, 'product_tmpl_id': tmpl_id, 'active': active})
+        return by_barcode, by_code
+    
+    def _sql_apply_staging(self, resolved, run_id=None):
+        """Staging upsert of resolved rows for the supplier of this import"""
+        return self._sql_stage_supplierinfo(self.supplier_id.id, resolved, run_id=run_id)
+    
+    @api.model
+    def _sql_stage_supplierinfo(self, partner_id, resolved, run_id=None, insert_only=False):
+        """
+        COPY resolved rows into a temporary staging table and apply them with
+        one UPDATE ... FROM and one INSERT ... SELECT (template-level supplierinfo)
+        Los van een import record aan te roepen (self.env['supplier.import.engine']),
+        bijv. door de missing product cron (insert_only: bestaande regels niet bijwerken)
+        Returns (rows_by_tmpl, [(supplierinfo_id, product_tmpl_id), ...]) of touched rows
+        """
+        Supplierinfo = self.env['product.supplierinfo']
+        cr = self.env.cr
+        now = fields.Datetime.now()
+        
+        # Last row per template wins (same as sequential ORM writes)
+        rows_by_tmpl = {}
+        for info, row_data in resolved:
+            rows_by_tmpl[info['product_tmpl_id']] = dict(
+                row_data['supplierinfo_fields'],
+                import_fingerprint=row_data.get('_fingerprint') or False,
+                import_history_id=run_id or False,
+            )
+        
+        # Staging columns: mapped supplierinfo fields that are plain table columns
+        field_names = {'price'}
+        for values in rows_by_tmpl.values():
+            field_names.update(values)
+        columns = []
+        orm_fields = set()
+        for fname in sorted(field_names):
+            field = Supplierinfo._fields.get(fname)
+            if not field or fname in SQL_UPSERT_RESERVED_FIELDS:
+                continue
+            if field.store and field.column_type and not field.translate and field.type in SQL_UPSERT_FIELD_TYPES:
+                columns.append((fname, field))
+            else:
+                orm_fields.add(fname)
+        
+        Supplierinfo.flush_model()
+        cr.execute("DROP TABLE IF EXISTS supplier_import_staging")
+        cr.execute("CREATE TEMP TABLE supplier_import_staging (product_tmpl_id integer PRIMARY KEY%s) ON COMMIT DROP" % ''.join(
+            f', "{fname}" {field.column_type[1]}' for fname, field in columns
+        ))
+        
+        lines = []
+        for tmpl_id, values in rows_by_tmpl.items():
+            line = [tmpl_id]
+            for fname, field in columns:
+                value = values.get(fname)
+                if value is False and field.type != 'boolean':
+                    value = None
+                line.append(value)
+            lines.append(line)
+        buffer = copy_csv(lines)
+        column_list = ', '.join(['product_tmpl_id'] + [f'"{fname}"' for fname, _field in columns])
+        cr.copy_expert(f"COPY supplier_import_staging ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cr.execute("ANALYZE supplier_import_staging")
+        
+        # UPDATE: one template-level supplierinfo per template (same order as ORM search limit=1)
+        updated = []
+        if not insert_only:
+            set_clause = ''.join(f', "{fname}" = COALESCE(st."{fname}", si."{fname}")' for fname, _field in columns)
+            cr.execute(f"""
+                WITH target AS (
+                    SELECT DISTINCT ON (si.product_tmpl_id) si.id, si.product_tmpl_id
+                    FROM product_supplierinfo si
+                    JOIN supplier_import_staging st ON st.product_tmpl_id = si.product_tmpl_id
+                    WHERE si.partner_id = %(partner_id)s AND si.product_id IS NULL
+                    ORDER BY si.product_tmpl_id, si.sequence, si.min_qty DESC, si.price, si.id
+                )
+                UPDATE product_supplierinfo si
+                SET previous_price = CASE WHEN st.price IS NOT NULL AND si.price > 0
+                                          THEN si.price ELSE si.previous_price END,
+                    last_sync_date = %(now)s,
+                    write_uid = %(uid)s,
+                    write_date = %(now)s
+                    {set_clause}
+                FROM target t
+                JOIN supplier_import_staging st ON st.product_tmpl_id = t.product_tmpl_id
+                WHERE si.id = t.id
+                RETURNING si.id, si.product_tmpl_id
+            """, {'partner_id': partner_id, 'now': now, 'uid': self.env.uid})
+            updated = cr.fetchall()
+        
+        # INSERT: templates without supplierinfo for this supplier (defaults from the ORM)
+        staged = {fname for fname, _field in columns}
+        defaults = self._sql_column_defaults(Supplierinfo, staged | SQL_UPSERT_RESERVED_FIELDS)
+        insert_columns = ['partner_id', 'product_tmpl_id', 'last_sync_date',
+                          'create_uid', 'create_date', 'write_uid', 'write_date']
+        select_values = ['%(partner_id)s', 'st.product_tmpl_id', '%(now)s',
+                         '%(uid)s', '%(now)s', '%(uid)s', '%(now)s']
+        params = {'partner_id': partner_id, 'now': now, 'uid': self.env.uid}
+        for fname, field in columns:
+            insert_columns.append(f'"{fname}"')
+            if fname == 'price':
+                select_values.append(f'COALESCE(st."{fname}", 0)')
+            else:
+                select_values.append(f'st."{fname}"')
+        for fname, value in defaults.items():
+            insert_columns.append(f'"{fname}"')
+            select_values.append(f'%(default_{fname})s')
+            params[f'default_{fname}'] = value
+        cr.execute(f"""
+            INSERT INTO product_supplierinfo ({', '.join(insert_columns)})
+            SELECT {', '.join(select_values)}
+            FROM supplier_import_staging st
+            WHERE NOT EXISTS (
+                SELECT 1 FROM product_supplierinfo si
+                WHERE si.partner_id = %(partner_id)s
+                AND si.product_id IS NULL
+                AND si.product_tmpl_id = st.product_tmpl_id
+            )
+            RETURNING id, product_tmpl_id
+        """, params)
+        inserted = cr.fetchall()
+        
+        # Keep the ORM cache and stored computed fields consistent with the raw SQL
+        Supplierinfo.invalidate_model()
+        written_fields = ['previous_price', 'last_sync_date'] + [fname for fname, _field in columns]
+        if updated:
+            Supplierinfo.browse([row[0] for row in updated]).modified(written_fields)
+        if inserted:
+            new_records = Supplierinfo.browse([row[0] for row in inserted])
+            for field in Supplierinfo._fields.values():
+                if field.store and field.compute:
+                    self.env.add_to_compute(field, new_records)
+            new_records.modified(['partner_id', 'product_tmpl_id'] + written_fields)
+        
+        # Non-column fields (e.g. related fields) are written through the ORM
+        if orm_fields:
+            si_by_tmpl = {tmpl_id: si_id for si_id, tmpl_id in updated + inserted}
+            for tmpl_id, values in rows_by_tmpl.items():
+                orm_vals = {k: v for k, v in values.items() if k in orm_fields}
+                if orm_vals and tmpl_id in si_by_tmpl:
+                    # Fingerprint meesturen, anders maakt de write override hem leeg
+                    orm_vals['import_fingerprint'] = values['import_fingerprint']
+                    Supplierinfo.browse(si_by_tmpl[tmpl_id]).write(orm_vals)
+        
+        self.env.flush_all()
+        return rows_by_tmpl, updated + inserted
+    
+    @api.model
+    def _sql_column_defaults(self, model, skip):
+        """
+        ORM defaults (default_get) for the plain columns a raw INSERT does not write
+        False van niet-boolean velden is NULL en wordt weggelaten
+        Returns {field_name: value}
+        """
+        default_names = [
+            fname for fname, field in model._fields.items()
+            if field.store and field.column_type and not field.compute and not field.translate
+            and field.type in SQL_UPSERT_FIELD_TYPES and fname not in skip
+        ]
+        return {
+            fname: value for fname, value in model.default_get(default_names).items()
+            if value is not None and not isinstance(value, (dict, list, tuple))
+            and (value is not False or model._fields[fname].type == 'boolean')
+        }
+    
+    def _create_error_records(self, history_id, error_rows):
+        """
+        Create database records for all import errors
+        Allows viewing/exporting missende producten via UI
+        Per ERROR_BATCH_SIZE rijen één COPY naar een staging tabel en één INSERT ... SELECT,
+        csv_data = compacte JSON van de volledige CSV rij (voor product aanmaak)
+        Niet gevonden producten gaan in dezelfde batch naar de missing product index
+        Returns number of error records created
+        """
+        Error = self.env['supplier.import.error']
+        cr = self.env.cr
+        now = fields.Datetime.now()
+        columns = ['row_number', 'error_type', 'barcode', 'product_code',
+                   'product_name', 'brand', 'csv_data', 'error_message']
+        # name e.d. berekent de ORM (add_to_compute), overige kolommen krijgen hun default
+        computed = [
+            field for fname, field in Error._fields.items()
+            if field.store and field.compute and fname not in columns
+        ]
+        defaults = self._sql_column_defaults(Error, set(columns) | {
+            'id', 'history_id', 'create_uid', 'create_date', 'write_uid', 'write_date',
+        })
+        insert_columns = ['history_id'] + columns + list(defaults) + ['create_uid', 'create_date', 'write_uid', 'write_date']
+        select_values = (['%(history_id)s'] + [f'st.{fname}' for fname in columns]
+                         + [f'%(default_{fname})s' for fname in defaults]
+                         + ['%(uid)s', '%(now)s', '%(uid)s', '%(now)s'])
+        params = dict({'history_id': history_id, 'uid': self.env.uid, 'now': now},
+                      **{f'default_{fname}': value for fname, value in defaults.items()})
+        
+        created = 0
+        for batch in iter_windows((err for err in error_rows if isinstance(err, dict)), ERROR_BATCH_SIZE):
+            lines = []
+            for err in batch:
+                message = err.get('error') or 'Product not found'
+                csv_data = err.get('row_data') or {'error': message}
+                lines.append([
+                    err.get('row') or 0,
+                    err.get('error_type') or 'product_not_found',
+                    err.get('barcode') or None,
+                    err.get('product_code') or None,
+                    err.get('product_name') or None,
+                    err.get('brand') or None,
+                    json.dumps(csv_data, ensure_ascii=False, separators=(',', ':'), default=str),
+                    message,
+                ])
+            buffer = copy_csv(lines)
+            
+            Error.flush_model()
+            cr.execute("DROP TABLE IF EXISTS supplier_import_error_staging")
+            cr.execute("""
+                CREATE TEMP TABLE supplier_import_error_staging (
+                    row_number integer, error_type varchar, barcode varchar,
+                    product_code varchar, product_name varchar, brand varchar,
+                    csv_data text, error_message text
+                ) ON COMMIT DROP
+            """)
+            cr.copy_expert(
+                f"COPY supplier_import_error_staging ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+            cr.execute(f"""
+                INSERT INTO supplier_import_error ({', '.join(f'"{fname}"' for fname in insert_columns)})
+                SELECT {', '.join(select_values)}
+                FROM supplier_import_error_staging st
+                RETURNING id
+            """, params)
+            new_records = Error.browse([row[0] for row in cr.fetchall()])
+            self._upsert_missing_products(history_id, now)
+            
+            # ORM cache en stored computed fields bijwerken na de raw SQL
+            Error.invalidate_model()
+            for field in computed:
+                self.env.add_to_compute(field, new_records)
+            new_records.modified(['history_id'] + columns + list(defaults))
+            Error.flush_model()
+            self.env.cr.commit()
+            self._import_heartbeat()
+            created += len(new_records)
+        
+        self.env['supplier.import.history'].browse(history_id).invalidate_recordset(['error_line_ids'])
+        return created
+    
+    def _upsert_missing_products(self, history_id, now):
+        """
+        Upsert the product_not_found rows of the current error staging batch into
+        supplier.missing.product: één regel per (leverancier, product key) met first/last seen,
+        aantal imports en de laatste CSV rij. Een key die terugkomt is weer unresolved
+        """
+        if not self.supplier_id:
+            return
+        MissingProduct = self.env['supplier.missing.product']
+        MissingProduct.flush_model()
+        self.env.cr.execute("""
+            INSERT INTO supplier_missing_product AS mp (
+                supplier_id, product_key, barcode, product_code, product_name, brand, csv_data,
+                first_seen, last_seen, occurrence_count, last_history_id, resolved,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT DISTINCT ON (st.product_key)
+                   %(supplier_id)s, st.product_key, st.barcode, st.product_code, st.product_name, st.brand,
+                   st.csv_data, %(now)s, %(now)s, 1, %(history_id)s, FALSE,
+                   %(uid)s, %(now)s, %(uid)s, %(now)s
+            FROM (
+                SELECT COALESCE(NULLIF(barcode, ''), NULLIF(product_code, '')) AS product_key, *
+                FROM supplier_import_error_staging
+                WHERE error_type = 'product_not_found'
+            ) st
+            WHERE st.product_key IS NOT NULL
+            ORDER BY st.product_key, st.row_number DESC
+            ON CONFLICT (supplier_id, product_key) DO UPDATE
+            SET barcode = EXCLUDED.barcode,
+                product_code = EXCLUDED.product_code,
+                product_name = COALESCE(NULLIF(EXCLUDED.product_name, ''), mp.product_name),
+                brand = COALESCE(NULLIF(EXCLUDED.brand, ''), mp.brand),
+                csv_data = EXCLUDED.csv_data,
+                last_seen = EXCLUDED.last_seen,
+                occurrence_count = mp.occurrence_count
+                    + CASE WHEN mp.last_history_id IS DISTINCT FROM EXCLUDED.last_history_id THEN 1 ELSE 0 END,
+                last_history_id = EXCLUDED.last_history_id,
+                resolved = FALSE,
+                resolved_date = NULL,
+                resolved_by = NULL,
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+        """, {'supplier_id': self.supplier_id.id, 'history_id': history_id, 'uid': self.env.uid, 'now': now})
+        MissingProduct.invalidate_model()
+    
+    def _archive_products_without_suppliers(self, template_ids):
+        """
+        Step 5: Post-process - Archive the given templates when they have no supplier left
+        Alleen templates die deze import ontkoppeld heeft, niet de hele catalogus:
+        per batch één geïndexeerde query, één write en een commit
+        Returns list of archived template ids (voor de history)
+        """
+        archived_ids = []
+        for batch in iter_windows(sorted(set(template_ids)), ARCHIVE_BATCH_SIZE):
+            orphan_ids = self._templates_without_suppliers(batch)
+            if orphan_ids:
+                self.env['product.template'].browse(orphan_ids).write({'active': False})
+                archived_ids.extend(orphan_ids)
+            self.env.cr.commit()
+            self._import_heartbeat()
+        
+        if archived_ids:
+            _logger.info(f"Archived {len(archived_ids)} products without suppliers")
+        return archived_ids
+    
+    # =========================================================================
+    # SUMMARY & TEMPLATE
+    # =========================================================================
+    
+    def _create_import_summary(self, stats):
+        """Create human-readable import summary"""
+        summary_lines = [
+            f"Import voor leverancier: {self.supplier_id.name}",
+            f"",
+            f"📊 Statistieken:",
+            f"  Totaal rijen: {stats['total']}",
+            f"  ✅ Aangemaakt: {stats['created']}",
+            f"  🔄 Bijgewerkt: {stats['updated']}",
+            f"  💤 Ongewijzigd: {stats.get('unchanged', 0)}",
+            f"  ⏭️  Overgeslagen: {stats['skipped']}",
+        ]
+        
+        if stats['errors']:
+            summary_lines.append(f"")
+            summary_lines.append(f"⚠️  Errors ({len(stats['errors'])}):")
+            for error in stats['errors'][:10]:  # Max 10 errors
+                summary_lines.append(f"  - {error}")
+            if len(stats['errors']) > 10:
+                summary_lines.append(f"  ... en {len(stats['errors']) - 10} meer")
+        
+        return '\n'.join(summary_lines)
+    
+    def _auto_save_mapping_template(self, mapping):
+        """
+        Automatically save/update mapping template after successful import
+        Called at end of import to preserve mapping for next time
+        """
+        if not self.supplier_id or not mapping:
+            return
+        
+        # Check if template exists
+        template = self.env['supplier.mapping.template'].search([
+            ('supplier_id', '=', self.supplier_id.id)
+        ], limit=1)
+        
+        # Prepare mapping lines
+        line_vals = [(0, 0, {
+            'csv_column': csv_col,
+            'odoo_field': odoo_field,
+            'sequence': idx * 10,
+        }) for idx, (csv_col, odoo_field) in enumerate(mapping.items()) if odoo_field]
+        
+        if template:
+            # Update existing
+            template.write({
+                'mapping_line_ids': [(5, 0, 0)] + line_vals  # Clear + recreate
+            })
+            _logger.info(f"Auto-saved mapping template for {self.supplier_id.name}")
+        else:
+            # Create new
+            self.env['supplier.mapping.template'].create({
+                'supplier_id': self.supplier_id.id,
+                'name': f"Auto-saved for {self.supplier_id.name}",
+                'mapping_line_ids': line_vals
+            })
+            _logger.info(f"Created auto-save mapping template for {self.supplier_id.name}")
@@ -5,6 +5,16 @@ Add product_supplier_sync specific fields for product matching errors
 """
 
 from odoo import models, fields
+import json
+import logging
+
+from .import_stream import iter_windows
+from .mapping_plan import apply_mapping_plan, compile_mapping_plan, prefetch_mapping_plan, row_fingerprint
+
+_logger = logging.getLogger(__name__)
+
+# Producten per create batch (één product create, één supplierinfo create, commit)
+PRODUCT_CREATE_BATCH_SIZE = 1000
 
 
 class ImportErrorExtend(models.Model):
@@ -28,6 +38,7 @@ class ImportErrorExtend(models.Model):
     ], string='Error Type', required=True)
     
     # Resolution tracking
+    product_id = fields.Many2one('product.product', string='Product', help='Product dat de fout oploste (automatische resolutie)')
     resolved = fields.Boolean('Resolved', default=False)
     resolved_date = fields.Datetime('Resolved Date')
     resolved_by = fields.Many2one('res.users', string='Resolved By')
@@ -43,3 +54,198 @@ class ImportErrorExtend(models.Model):
             'resolved_date': fields.Datetime.now(),
             'resolved_by': self.env.user.id
         })
+
+    def action_create_products(self):
+        """Create the missing products of the selected errors (bulk)"""
+        result = self._create_products_bulk()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Producten aangemaakt',
+                'message': f"{result['created']} producten aangemaakt, {result['linked']} bestonden al, "
+                           f"{result['skipped']} overgeslagen, {result['failed']} mislukt (zie log)",
+                'type': 'success' if (result['created'] or result['linked']) and not result['failed'] else 'warning',
+                'sticky': False,
+            }
+        }
+
+    def _create_products_bulk(self):
+        """
+        Create product.product (+ template) and supplierinfo for unresolved product_not_found errors
+        Per import: mapping uit history.mapping_data, csv_data door het gecompileerde mapping plan
+        (many2one/merk via supplier.brand.mapping), per PRODUCT_CREATE_BATCH_SIZE keys één product
+        create, één supplierinfo create en een commit. Dubbele keys (zelfde EAN in meerdere runs)
+        geven één product; bestaande producten worden alleen gekoppeld.
+        Elke batch draait in een savepoint; een mislukte batch wordt per key herhaald en
+        keys die dan nog falen blijven open (failed = aantal error regels)
+        Returns dict with created, linked, skipped, failed
+        """
+        errors = self.filtered(lambda e: not e.resolved and e.error_type == 'product_not_found')
+        result = {'created': 0, 'linked': 0, 'skipped': len(self) - len(errors), 'failed': 0}
+        
+        # Elke (leverancier, product key) één keer, bij de meest recente import die hem meldde
+        by_history = {}   # history -> {product key: [error ids]}
+        owner = {}
+        for error in errors.sorted(lambda e: (e.history_id.id, e.id), reverse=True):
+            key = error.barcode or error.product_code
+            if not key or not error.history_id.supplier_id:
+                result['skipped'] += 1
+                continue
+            history = owner.setdefault((error.history_id.supplier_id.id, key), error.history_id)
+            by_history.setdefault(history, {}).setdefault(key, []).append(error.id)
+        
+        for history, keys in by_history.items():
+            try:
+                mapping = json.loads(history.mapping_data or '{}')
+            except ValueError:
+                mapping = {}
+            for batch in iter_windows(sorted(keys), PRODUCT_CREATE_BATCH_SIZE):
+                try:
+                    with self.env.cr.savepoint():
+                        created, linked = self._create_products_batch(history, mapping, {key: keys[key] for key in batch})
+                    result['created'] += created
+                    result['linked'] += linked
+                except Exception as e:
+                    _logger.warning(f"Product create batch failed ({history.name}), retrying per key: {e}")
+                    for key in batch:
+                        try:
+                            with self.env.cr.savepoint():
+                                created, linked = self._create_products_batch(history, mapping, {key: keys[key]})
+                            result['created'] += created
+                            result['linked'] += linked
+                        except Exception as key_error:
+                            result['failed'] += len(keys[key])
+                            _logger.error(f"Product {key} not created (errors {keys[key]}): {key_error}")
+                self.env.cr.commit()
+        
+        _logger.info(f"Bulk product creation: {result['created']} created, {result['linked']} linked, "
+                     f"{result['skipped']} skipped, {result['failed']} failed")
+        return result
+
+    def _create_products_batch(self, history, mapping, keys):
+        """
+        Create the products of one batch of product keys of one import
+        keys: {product key: [error ids]}, eerste error = meest recente CSV rij
+        Returns (created, linked)
+        """
+        supplier = history.supplier_id
+        Product = self.env['product.product'].with_context(active_test=False)
+        latest = {key: self.browse(error_ids[0]) for key, error_ids in keys.items()}
+        
+        # Producten die intussen bestaan: koppelen i.p.v. dubbel aanmaken (één IN query per sleutel type)
+        barcodes = [error.barcode for error in latest.values() if error.barcode]
+        codes = [error.product_code for error in latest.values() if error.product_code]
+        by_barcode = {p.barcode: p for p in Product.search([('barcode', 'in', barcodes)])} if barcodes else {}
+        by_code = {}
+        if codes:
+            for product in Product.search([('default_code', 'in', codes)]):
+                by_code.setdefault(product.default_code, product)
+        products = {}
+        for key, error in latest.items():
+            product = (error.barcode and by_barcode.get(error.barcode)) or (error.product_code and by_code.get(error.product_code))
+            if product:
+                products[key] = product
+        linked = len(products)
+        
+        # csv_data door het mapping plan (één plan per header set, many2one waarden per batch)
+        csv_rows = {}
+        for key, error in latest.items():
+            try:
+                csv_row = json.loads(error.csv_data or '{}')
+            except ValueError:
+                csv_row = {}
+            if not isinstance(csv_row, dict) or set(csv_row) == {'error'}:
+                csv_row = {}
+            csv_rows[key] = csv_row
+        keys_by_headers = {}
+        for key, csv_row in csv_rows.items():
+            keys_by_headers.setdefault(tuple(csv_row), []).append(key)
+        row_data = {}
+        for headers, header_keys in keys_by_headers.items():
+            plan = compile_mapping_plan(self.env, mapping, list(headers), supplier_id=supplier.id) if headers else []
+            rows = [['' if value is None else str(value) for value in csv_rows[key].values()] for key in header_keys]
+            prefetch_mapping_plan(plan, rows)
+            for key, row in zip(header_keys, rows):
+                row_data[key] = apply_mapping_plan(plan, row)
+        
+        # Merk via supplier.brand.mapping als de mapping zelf geen merk kolom heeft
+        brand_field = 'product_brand_id' if 'product_brand_id' in Product._fields else None
+        brands = {}
+        if brand_field and 'supplier.brand.mapping' in self.env:
+            names = {
+                error.brand for key, error in latest.items()
+                if error.brand and key not in products and not row_data[key]['product_fields'].get(brand_field)
+            }
+            if names:
+                brands = self.env['supplier.brand.mapping'].get_mapped_brands(supplier.id, names)
+        
+        create_keys = [key for key in keys if key not in products]
+        vals_list = []
+        for key in create_keys:
+            error = latest[key]
+            vals = dict(row_data[key]['product_fields'])
+            vals['name'] = vals.get('name') or error.product_name or key
+            if error.barcode:
+                vals.setdefault('barcode', error.barcode)
+            if error.product_code:
+                vals.setdefault('default_code', error.product_code)
+            brand = brands.get(error.brand)
+            if brand and not vals.get(brand_field):
+                vals[brand_field] = brand.id
+            vals_list.append(vals)
+        if vals_list:
+            products.update(zip(create_keys, Product.create(vals_list)))
+        
+        # Supplierinfo in dezelfde pass (niet dubbel voor gekoppelde producten die al een regel hebben,
+        # niet zonder gemapte prijs: anders een leverancier met prijs 0)
+        Supplierinfo = self.env['product.supplierinfo']
+        has_seller = set(Supplierinfo.search([
+            ('partner_id', '=', supplier.id),
+            ('product_tmpl_id', 'in', [product.product_tmpl_id.id for product in products.values()]),
+        ]).mapped('product_tmpl_id').ids)
+        now = fields.Datetime.now()
+        si_vals = []
+        for key, product in products.items():
+            if product.product_tmpl_id.id in has_seller or 'price' not in row_data[key]['supplierinfo_fields']:
+                continue
+            has_seller.add(product.product_tmpl_id.id)
+            si_vals.append(dict(
+                row_data[key]['supplierinfo_fields'],
+                partner_id=supplier.id,
+                product_tmpl_id=product.product_tmpl_id.id,
+                last_sync_date=now,
+                import_history_id=history.id,
+                import_fingerprint=row_fingerprint(row_data[key]),
+            ))
+        if si_vals:
+            Supplierinfo.create(si_vals)
+        
+        # Errors en missing product index in één UPDATE per tabel als opgelost markeren
+        error_ids, error_products = [], []
+        for key, ids in keys.items():
+            error_ids.extend(ids)
+            error_products.extend([products[key].id] * len(ids))
+        self.flush_model()
+        self.env.cr.execute("""
+            UPDATE supplier_import_error e
+            SET resolved = TRUE, resolved_date = %(now)s, resolved_by = %(uid)s, product_id = v.product_id,
+                write_uid = %(uid)s, write_date = %(now)s
+            FROM unnest(%(ids)s::int[], %(product_ids)s::int[]) AS v(id, product_id)
+            WHERE e.id = v.id
+        """, {'ids': error_ids, 'product_ids': error_products, 'now': now, 'uid': self.env.uid})
+        MissingProduct = self.env['supplier.missing.product']
+        MissingProduct.flush_model()
+        self.env.cr.execute("""
+            UPDATE supplier_missing_product mp
+            SET resolved = TRUE, resolved_date = %(now)s, resolved_by = %(uid)s, product_id = v.product_id,
+                write_uid = %(uid)s, write_date = %(now)s
+            FROM unnest(%(keys)s::varchar[], %(product_ids)s::int[]) AS v(product_key, product_id)
+            WHERE mp.supplier_id = %(supplier_id)s AND mp.product_key = v.product_key AND NOT mp.resolved
+        """, {
+            'keys': list(products), 'product_ids': [product.id for product in products.values()],
+            'supplier_id': supplier.id, 'now': now, 'uid': self.env.uid,
+        })
+        self.invalidate_model()
+        MissingProduct.invalidate_model()
+        return len(vals_list), linked
@@ -20,7 +20,7 @@ class ImportHistoryExtend(models.Model):
     - schedule_id, user_id
     - file_size
     - created_count, updated_count  
-    - retry_count, last_processed_row, processed_product_ids
+    - retry_count, last_processed_row, processed_product_ids, archived_template_ids
     - mapping_data, summary
     - error_line_ids (One2many)
     - name (computed), action methods
@@ -37,12 +37,14 @@ class ImportHistoryExtend(models.Model):
             ('running', 'Running'),
             ('completed', 'Completed'),
             ('completed_with_errors', 'Completed with Errors'),
+            ('superseded', 'Vervangen'),
         ],
         ondelete={
             'queued': 'set default',
             'running': 'set default',
             'completed': 'set default',
             'completed_with_errors': 'set default',
+            'superseded': 'set default',
         }
     )
     
@@ -58,6 +60,7 @@ class ImportHistoryExtend(models.Model):
     
     # Extra file info (base module heeft al import_file_name)
     file_size = fields.Integer('File Size (bytes)')
+    payload_id = fields.Many2one('supplier.import.payload', string='Payload', readonly=True, ondelete='set null', help='Gecomprimeerde CSV van deze import (zolang de payload store hem bewaart)')
     
     # Extra import statistieken (hub heeft total_rows, error_count, skipped_count, success_count, warning_count)
     created_count = fields.Integer('Aangemaakt', default=0)
@@ -67,6 +70,7 @@ class ImportHistoryExtend(models.Model):
     retry_count = fields.Integer('Aantal Retries', default=0, help='Aantal keren dat import opnieuw is gestart na timeout/server restart')
     last_processed_row = fields.Integer('Laatst Verwerkte Rij', default=0, help='Voor resume functionaliteit bij server restart')
     processed_product_ids = fields.Text('Verwerkte Product IDs (JSON)', help='Lijst van product template IDs die succesvol geïmporteerd zijn (voor cleanup)')
+    archived_template_ids = fields.Text('Gearchiveerde Product IDs (JSON)', help='Product templates die deze import gearchiveerd heeft (geen leveranciers meer na cleanup)')
     
     # Mapping archiving (voor traceability en herhaling)
     mapping_data = fields.Text('Mapping Data (JSON)', help='Column mapping gebruikt voor deze import (voor audit trail en herhaling)')
@@ -100,6 +104,15 @@ class ImportHistoryExtend(models.Model):
                 queue_item.write({'state': 'failed'})
         return {'type': 'ir.actions.client', 'tag': 'reload'}
     
+    def action_create_missing_products(self):
+        """Create the products of all unresolved 'product not found' errors of this import (bulk)"""
+        errors = self.env['supplier.import.error'].search([
+            ('history_id', 'in', self.ids),
+            ('error_type', '=', 'product_not_found'),
+            ('resolved', '=', False),
+        ])
+        return errors.action_create_products()
+    
     def action_set_completed(self):
         """Manually mark import as completed"""
         for record in self:
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Import Payload - Content-addressed opslag van CSV payloads
+Eén gzip gecomprimeerde filestore attachment per sha256, gedeeld door queue
+jobs en import history. Queue jobs laten hun referentie los zodra ze klaar zijn;
+payloads zonder queue referentie worden na de bewaartermijn opgeruimd
+"""
+
+from odoo import models, fields, api
+from datetime import timedelta
+import gzip
+import hashlib
+import io
+import logging
+
+import psycopg2
+
+from .import_stream import STREAM_CHUNK_SIZE
+
+_logger = logging.getLogger(__name__)
+
+# Payloads zonder queue jobs blijven zo lang bewaard voor de history (audit / opnieuw importeren)
+PAYLOAD_RETENTION_DAYS = 30
+
+
+class SupplierImportPayload(models.Model):
+    """Compressed CSV payload, stored once per content hash"""
+    _name = 'supplier.import.payload'
+    _description = 'Supplier Import Payload'
+    _rec_name = 'sha256'
+    _order = 'last_used desc'
+
+    sha256 = fields.Char(string='SHA256', required=True, readonly=True, index=True)
+    attachment_id = fields.Many2one('ir.attachment', string='Bestand (gzip)', readonly=True, ondelete='restrict')
+    size = fields.Integer(string='Grootte (bytes)', readonly=True)
+    compressed_size = fields.Integer(string='Gecomprimeerd (bytes)', readonly=True)
+    last_used = fields.Datetime(string='Laatst Gebruikt', readonly=True, default=fields.Datetime.now)
+    queue_ids = fields.One2many('supplier.import.queue', 'payload_id', string='Queue Jobs')
+    history_ids = fields.One2many('supplier.import.history', 'payload_id', string='Import History')
+
+    # Odoo 19: models.Constraint (_sql_constraints wordt genegeerd); _store_stream leunt op deze index
+    _sha256_unique = models.Constraint(
+        'UNIQUE(sha256)',
+        'Er bestaat al een payload met deze inhoud',
+    )
+
+    @api.model
+    def _store_stream(self, binary_stream):
+        """
+        Store the content of a binary stream and return its payload record
+        Hash en gzip compressie in één streaming pass; bestaande inhoud wordt hergebruikt
+        """
+        digest = hashlib.sha256()
+        size = 0
+        compressed = io.BytesIO()
+        # mtime=0: zelfde inhoud geeft dezelfde gzip bytes
+        with gzip.GzipFile(fileobj=compressed, mode='wb', mtime=0) as gz:
+            while True:
+                chunk = binary_stream.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                gz.write(chunk)
+        sha256 = digest.hexdigest()
+
+        payload = self.search([('sha256', '=', sha256)], limit=1)
+        if payload:
+            payload.last_used = fields.Datetime.now()
+            return payload
+
+        raw = compressed.getvalue()
+        try:
+            with self.env.cr.savepoint():
+                payload = self.create({'sha256': sha256, 'size': size, 'compressed_size': len(raw)})
+        except psycopg2.IntegrityError:
+            # Zelfde bestand tegelijk door een andere transactie opgeslagen
+            return self.search([('sha256', '=', sha256)], limit=1)
+        payload.attachment_id = self.env['ir.attachment'].sudo().create({
+            'name': f'{sha256}.csv.gz',
+            'raw': raw,
+            'mimetype': 'application/gzip',
+            'res_model': self._name,
+            'res_id': payload.id,
+        })
+        _logger.info(f"Payload {sha256[:12]} stored: {size} bytes, {len(raw)} compressed")
+        return payload
+
+    def _open(self):
+        """Binary stream of the decompressed content, read from the filestore"""
+        self.ensure_one()
+        attachment = self.attachment_id.sudo()
+        if attachment.store_fname:
+            return gzip.open(attachment._full_path(attachment.store_fname), 'rb')
+        return gzip.GzipFile(fileobj=io.BytesIO(attachment.raw), mode='rb')
+
+    def unlink(self):
+        attachments = self.attachment_id
+        result = super().unlink()
+        attachments.sudo().unlink()
+        return result
+
+    @api.model
+    def _gc_unreferenced_payloads(self):
+        """Remove payloads without queue jobs that were not used within the retention period"""
+        cutoff = fields.Datetime.now() - timedelta(days=PAYLOAD_RETENTION_DAYS)
+        payloads = self.search([
+            ('queue_ids', '=', False),
+            ('last_used', '<', cutoff),
+        ])
+        if payloads:
+            _logger.info(f"Cleanup: Verwijderen {len(payloads)} ongebruikte import payloads")
+            payloads.unlink()
+        return len(payloads)
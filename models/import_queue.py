@@ -4,25 +4,81 @@ Import Queue - Background processing for large imports
 """
 
 from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools import config
 import base64
 import csv
+import gzip
 import io
+import json
+import os
+import socket
 import time
 import logging
 import ast
 
+from .import_stream import Base64ChunkReader
+
 _logger = logging.getLogger(__name__)
 
+# {queue_id: time.time() van de laatste heartbeat} per worker proces
+_last_heartbeat = {}
+
+# Maximaal aantal imports dat tegelijk draait (over alle cron workers heen)
+QUEUE_CONCURRENCY_PARAM = 'product_supplier_sync.queue_max_concurrency'
+QUEUE_DEFAULT_CONCURRENCY = 4
+
+# Fast lane: imports tot dit aantal rijen (history.total_rows) en gereserveerde slots daarvoor
+QUEUE_FAST_LANE_ROWS_PARAM = 'product_supplier_sync.queue_fast_lane_rows'
+QUEUE_DEFAULT_FAST_LANE_ROWS = 25000
+QUEUE_FAST_LANE_SLOTS_PARAM = 'product_supplier_sync.queue_fast_lane_slots'
+QUEUE_DEFAULT_FAST_LANE_SLOTS = 1
+
+# Heartbeat: hoogstens één write per interval; zonder heartbeat binnen de timeout is de worker weg
+QUEUE_HEARTBEAT_INTERVAL = 10
+QUEUE_HEARTBEAT_TIMEOUT_PARAM = 'product_supplier_sync.queue_heartbeat_timeout'
+QUEUE_DEFAULT_HEARTBEAT_TIMEOUT = 60
+
+# Zo vaak wordt een job na een dode worker hervat; daarna failed (een crashende job loopt niet eeuwig)
+QUEUE_MAX_RECOVERIES_PARAM = 'product_supplier_sync.queue_max_recoveries'
+QUEUE_DEFAULT_MAX_RECOVERIES = 3
+
+# Jobs van vóór de heartbeat: oude regel (geen history voortgang in 1 uur)
+QUEUE_LEGACY_STUCK_SECONDS = 3600
+
+# Deel van de worker time limit (limit_time_real_cron / limit_time_real) dat een slice mag gebruiken
+QUEUE_TIME_BUDGET_PARAM = 'product_supplier_sync.queue_time_budget_fraction'
+QUEUE_DEFAULT_TIME_BUDGET = 0.6
+
+# Cron slots die _process_queue draaien (allemaal getriggerd bij een wake-up)
+QUEUE_CRON_XMLIDS = (
+    'product_supplier_sync.ir_cron_process_import_queue',
+    'product_supplier_sync.ir_cron_process_import_queue_2',
+    'product_supplier_sync.ir_cron_process_import_queue_3',
+    'product_supplier_sync.ir_cron_process_import_queue_4',
+)
+
+# Imports met meer rijen worden opgesplitst in chunk jobs van dit aantal product keys
+QUEUE_CHUNK_ROWS = 50000
+
+# Advisory lock die alleen het claimen serialiseert, niet de import zelf
+QUEUE_CLAIM_LOCK_KEY = 0x5350_5131
+
 
 class SupplierImportQueue(models.Model):
     """Queue model for background import processing"""
     _name = 'supplier.import.queue'
+    _inherit = ['supplier.import.engine']
     _description = 'Supplier Import Queue'
     _order = 'create_date desc'
     
     history_id = fields.Many2one('supplier.import.history', string='Import History', required=True, ondelete='cascade')
     supplier_id = fields.Many2one('res.partner', string='Supplier', required=True)
-    csv_file = fields.Binary(string='CSV File', required=True)
+    payload_id = fields.Many2one(
+        'supplier.import.payload', string='Payload', readonly=True, index=True, ondelete='restrict',
+        help='Gecomprimeerde CSV (content-addressed); leeg bij chunk/finalize jobs en na afronden',
+    )
+    csv_file = fields.Binary(string='CSV File', help='Alleen voor jobs van vóór de payload store; nieuwe jobs gebruiken payload_id')
     csv_filename = fields.Char(string='Filename')
     encoding = fields.Char(string='Encoding', default='utf-8')
     csv_separator = fields.Char(string='Separator', default=';')
@@ -33,14 +89,133 @@ class SupplierImportQueue(models.Model):
     min_price = fields.Float(string='Minimum Price', default=0.0)
     skip_discontinued = fields.Boolean(string='Skip Discontinued', default=False)
     cleanup_old_supplierinfo = fields.Boolean(string='Cleanup Old Supplierinfo', default=False)
+    use_sql_upsert = fields.Boolean(string='SQL Bulk Upsert', default=False)
     
     state = fields.Selection([
         ('queued', 'In Wachtrij'),
         ('processing', 'Bezig'),
+        ('split', 'Opgesplitst'),
         ('done', 'Voltooid'),
         ('failed', 'Mislukt'),
+        ('superseded', 'Vervangen'),
     ], string='Status', default='queued', required=True)
     
+    # Coalescing: sha256 van de CSV inhoud, nieuwere/identieke feeds vervangen wachtende jobs
+    payload_hash = fields.Char(string='Payload SHA256', readonly=True, index=True)
+    superseded_by_id = fields.Many2one('supplier.import.queue', string='Vervangen Door', readonly=True)
+    
+    # Chunked imports: parent (job_type import) → chunk jobs per key range + finalize job
+    job_type = fields.Selection([
+        ('import', 'Import'),
+        ('chunk', 'Chunk'),
+        ('finalize', 'Finalize'),
+    ], string='Job Type', default='import', required=True)
+    parent_id = fields.Many2one('supplier.import.queue', string='Parent Import', ondelete='cascade', index=True)
+    chunk_ids = fields.One2many('supplier.import.queue', 'parent_id', string='Chunk Jobs')
+    key_from = fields.Char(string='Key Van', help='Eerste chunk key van deze chunk (template:<id> of barcode/code)')
+    key_to = fields.Char(string='Key Tot', help='Chunk key waar de volgende chunk begint (leeg = einde)')
+    chunk_result = fields.Text(string='Chunk Resultaat (JSON)')
+    last_processed_row = fields.Integer(string='Laatst Verwerkte Rij', default=0, help='Checkpoint van een chunk job (imports gebruiken de history)')
+    prescan_cache = fields.Binary(
+        string='Prescan Cache', attachment=True, readonly=True,
+        help='Gzip JSON van de (deels) afgeronde prescan; volgende slices scannen de payload niet opnieuw',
+    )
+    
+    # Scheduling: lane op basis van geschatte grootte, wachttijd voor SLA rapportage
+    lane = fields.Selection([
+        ('fast', 'Fast Lane'),
+        ('bulk', 'Bulk'),
+    ], string='Lane', compute='_compute_lane', store=True, index=True)
+    started_at = fields.Datetime(string='Gestart Op', readonly=True, help='Eerste keer dat een worker deze job claimde')
+    
+    # Heartbeat van de worker die de job draait (dead-worker detectie)
+    heartbeat_at = fields.Datetime(string='Heartbeat', readonly=True)
+    worker_pid = fields.Integer(string='Worker PID', readonly=True)
+    worker_host = fields.Char(string='Worker Host', readonly=True)
+    recovery_count = fields.Integer(string='Hervat na Dode Worker', readonly=True, default=0)
+    wait_seconds = fields.Float(
+        string='Wachttijd (s)', compute='_compute_wait_seconds', store=True, aggregator='avg',
+        help='Tijd tussen in wachtrij plaatsen en eerste start',
+    )
+    
+    @api.depends('job_type', 'history_id.total_rows')
+    def _compute_lane(self):
+        """Kleine imports en finalize jobs in de fast lane, grote imports en chunks in bulk"""
+        fast_lane_rows = self._get_int_param(QUEUE_FAST_LANE_ROWS_PARAM, QUEUE_DEFAULT_FAST_LANE_ROWS)
+        for record in self:
+            if record.job_type == 'finalize':
+                record.lane = 'fast'
+            elif record.job_type == 'chunk':
+                record.lane = 'bulk'
+            else:
+                record.lane = 'fast' if (record.history_id.total_rows or 0) <= fast_lane_rows else 'bulk'
+    
+    @api.depends('create_date', 'started_at')
+    def _compute_wait_seconds(self):
+        for record in self:
+            if record.create_date and record.started_at:
+                record.wait_seconds = (record.started_at - record.create_date).total_seconds()
+            else:
+                record.wait_seconds = 0.0
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        """
+        Enqueue: oudere wachtende feeds van dezelfde leverancier worden vervangen en de
+        queue cron wordt direct gewekt (polling blijft alleen als vangnet)
+        """
+        Payload = self.env['supplier.import.payload']
+        for vals in vals_list:
+            if vals.get('csv_file'):
+                # Eén keer opslaan in de payload store, niet als base64 op de queue regel
+                vals['payload_id'] = Payload._store_stream(Base64ChunkReader(vals.pop('csv_file'))).id
+            if vals.get('payload_id') and not vals.get('payload_hash'):
+                vals['payload_hash'] = Payload.browse(vals['payload_id']).sha256
+        records = super().create(vals_list)
+        for record in records.filtered(lambda r: r.payload_id and not r.history_id.payload_id):
+            record.history_id.payload_id = record.payload_id
+        records._coalesce_superseded()
+        if any(record.state == 'queued' for record in records):
+            self._trigger_queue_processing()
+        return records
+    
+    def _coalesce_superseded(self):
+        """
+        Only the newest payload per supplier + mapping runs:
+        - oudere, nog niet gestarte imports van dezelfde leverancier en mapping worden vervangen
+        - een payload gelijk aan de laatste succesvolle import wordt zelf overgeslagen
+        """
+        for record in self.filtered(lambda r: r.job_type == 'import' and r.state == 'queued'):
+            older = self.search([
+                ('id', '<', record.id),
+                ('supplier_id', '=', record.supplier_id.id),
+                ('job_type', '=', 'import'),
+                ('state', '=', 'queued'),
+                ('started_at', '=', False),
+                ('mapping', '=', record.mapping),
+            ])
+            older._mark_superseded(record, f"Vervangen door nieuwere feed (queue {record.id})")
+            
+            if not record.payload_hash:
+                continue
+            last_done = self.search([
+                ('id', '!=', record.id),
+                ('supplier_id', '=', record.supplier_id.id),
+                ('job_type', '=', 'import'),
+                ('state', '=', 'done'),
+            ], order='id desc', limit=1)
+            if last_done.payload_hash == record.payload_hash and last_done.mapping == record.mapping:
+                record._mark_superseded(last_done, f"Identiek aan laatste succesvolle import (queue {last_done.id})")
+    
+    def _mark_superseded(self, superseded_by, reason):
+        """Skip these queued jobs; their payload is no longer needed"""
+        if not self:
+            return
+        _logger.info(f"Coalescing: queue {self.ids} superseded by {superseded_by.id} ({reason})")
+        self.write({'state': 'superseded', 'superseded_by_id': superseded_by.id})
+        self._release_payload()
+        self.history_id.write({'state': 'superseded', 'summary': reason})
+    
     @api.model
     def _cleanup_old_queue_records(self):
         """
@@ -51,208 +226,555 @@ class SupplierImportQueue(models.Model):
         cleanup_date = fields.Datetime.now() - timedelta(days=30)
         
         old_records = self.search([
-            ('state', 'in', ['done', 'failed']),
+            ('state', 'in', ['done', 'failed', 'superseded']),
             ('create_date', '<', cleanup_date)
         ])
         
         if old_records:
             _logger.info(f"Cleanup: Verwijderen {len(old_records)} oude queue records (>30 dagen)")
             old_records.unlink()
+        self.env['supplier.import.payload']._gc_unreferenced_payloads()
+        
+        # Dagelijkse wachttijd rapportage per leverancier/lane in de log
+        self._get_wait_time_report(days=1)
         
         return True
     
     @api.model
     def _process_queue(self):
         """
-        Cron job method: Process queued imports one by one
-        This method is called by the scheduled action
+        Cron job method: claim and process one queued import
+        Meerdere cron slots (zie data/import_queue_cron.xml) draaien deze methode
+        parallel; _claim_next_queue_item bewaakt de globale concurrency en
+        maximaal één lopende import per leverancier.
+        Een import werkt tot het time budget op is, zet zichzelf dan terug in de
+        wachtrij (checkpoint) en triggert de cron direct voor de volgende slice
         """
-        # Check if there's already an import being processed
-        processing_items = self.search([('state', '=', 'processing')])
-        
-        # Check for stuck imports (no batch progress for more than 1 hour)
-        # Uses history write_date which is updated every batch (500 rows)
-        if processing_items:
-            from datetime import datetime, timedelta
-            one_hour_ago = fields.Datetime.now() - timedelta(hours=1)
-            stuck_items = processing_items.filtered(
-                lambda i: i.history_id and i.history_id.write_date and i.history_id.write_date < one_hour_ago
-            )
-            
-            if stuck_items:
-                _logger.warning(f'Found {len(stuck_items)} stuck import(s) (no batch progress >1h), marking as failed: {stuck_items.ids}')
-                for item in stuck_items:
-                    item.write({'state': 'failed'})
-                    item.history_id.write({
-                        'state': 'failed',
-                        'summary': 'Import timeout: No batch progress for more than 1 hour (mogelijk vastgelopen)'
-                    })
-                # Refresh processing_items list
-                processing_items = self.search([('state', '=', 'processing')])
-        
-        if processing_items:
-            _logger.info(f'{len(processing_items)} import(s) already processing, waiting... Import IDs: {processing_items.ids}')
-            return
+        time_budget = self._get_time_budget()
+        deadline = time.time() + time_budget if time_budget else None
         
-        # Find next queued import
-        queue_item = self.search([('state', '=', 'queued')], limit=1, order='create_date asc')
+        # Jobs whose worker died are put back in the queue (resume from checkpoint)
+        self._recover_dead_jobs()
         
+        queue_item = self._claim_next_queue_item()
         if not queue_item:
-            _logger.info("No queued imports to process")
             return
         
         _logger.info(f"Processing queued import {queue_item.id} for supplier {queue_item.supplier_id.name}")
         
         try:
-            # Mark as processing
-            queue_item.state = 'processing'
-            queue_item.history_id.state = 'running'
-            self.env.cr.commit()
-            
-            # Execute import
-            queue_item._execute_queued_import()
+            # Execute import (until the time budget is used up)
+            queue_item._execute_queued_import(deadline=deadline)
             
-            # Mark as done
-            queue_item.state = 'done'
+            # Mark as done (a split parent waits for its finalize job)
+            if queue_item.state == 'processing':
+                queue_item.state = 'done'
+                queue_item._release_payload()
             self.env.cr.commit()
             
+            # Jobs die op deze slot/leverancier/chunks wachtten direct laten starten
+            if self.search_count([('state', '=', 'queued')], limit=1):
+                self._trigger_queue_processing()
+            
         except Exception as e:
             _logger.error(f"Failed to process queued import {queue_item.id}: {e}", exc_info=True)
-            queue_item.state = 'failed'
-            queue_item.history_id.write({
-                'state': 'failed',
-                'summary': f"Background import failed: {str(e)}",
-            })
+            # Aborted transactie opruimen voordat de status geschreven wordt
+            self.env.cr.rollback()
+            queue_item._mark_failed(f"Background import failed: {str(e)}")
             self.env.cr.commit()
     
-    def _execute_queued_import(self):
-        """Execute the import from queue data - NIEUWE BULK ARCHITECTUUR"""
+    def _mark_failed(self, summary):
+        """Job failed; a chunk leaves its history running (the finalize job reports failed chunks)"""
+        for job in self:
+            job.state = 'failed'
+            if job.job_type == 'chunk':
+                _logger.warning(f"Chunk {job.id} of import {job.parent_id.id} failed")
+                continue
+            if job.job_type == 'finalize':
+                job.parent_id.state = 'failed'
+            job.history_id.write({'state': 'failed', 'summary': summary})
+    
+    @api.model
+    def _get_int_param(self, key, default):
+        """Integer ir.config_parameter (default bij ontbrekende of ongeldige waarde)"""
+        value = self.env['ir.config_parameter'].sudo().get_param(key, default)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+    
+    @api.model
+    def _get_max_concurrency(self):
+        """Globale concurrency uit ir.config_parameter (minimaal 1)"""
+        return max(1, self._get_int_param(QUEUE_CONCURRENCY_PARAM, QUEUE_DEFAULT_CONCURRENCY))
+    
+    def _heartbeat(self, force=False):
+        """
+        Record that this worker is still alive (batch boundaries)
+        Eigen cursor: de heartbeat is direct zichtbaar zonder de import transactie te committen
+        """
+        now = time.time()
+        if not force and now - _last_heartbeat.get(self.id, 0) < QUEUE_HEARTBEAT_INTERVAL:
+            return
+        _last_heartbeat[self.id] = now
+        try:
+            with self.env.registry.cursor() as cr:
+                # Nooit blijven wachten op een lock van de eigen (nog open) import transactie
+                cr.execute("SET LOCAL lock_timeout = '2s'")
+                cr.execute("""
+                    UPDATE supplier_import_queue
+                    SET heartbeat_at = NOW() AT TIME ZONE 'UTC', worker_pid = %s, worker_host = %s
+                    WHERE id = %s
+                """, (os.getpid(), socket.gethostname(), self.id))
+        except Exception as e:
+            _logger.warning(f"Could not write heartbeat for import {self.id}: {e}")
+        self.invalidate_recordset(['heartbeat_at', 'worker_pid', 'worker_host'])
+    
+    def _is_worker_alive(self, now):
+        """
+        Dead when the heartbeat is older than the timeout, or - on this host - when the
+        worker process no longer exists (direct na een kill/restart herkend)
+        """
+        self.ensure_one()
+        if not self.heartbeat_at:
+            # Geclaimd vóór de heartbeat bestond: oude regel op history voortgang
+            last_progress = self.history_id.write_date or self.write_date
+            return bool(last_progress) and (now - last_progress).total_seconds() < QUEUE_LEGACY_STUCK_SECONDS
+        timeout = self._get_int_param(QUEUE_HEARTBEAT_TIMEOUT_PARAM, QUEUE_DEFAULT_HEARTBEAT_TIMEOUT)
+        if (now - self.heartbeat_at).total_seconds() > timeout:
+            return False
+        if self.worker_host == socket.gethostname() and self.worker_pid and self.worker_pid != os.getpid():
+            try:
+                os.kill(self.worker_pid, 0)
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                return True
+        return True
+    
+    @api.model
+    def _recover_dead_jobs(self):
+        """
+        Processing jobs whose worker is gone go back to 'queued' (checkpoint kept, retry_count +1)
+        Vervangt de oude regel die na een uur zonder voortgang de import als mislukt markeerde.
+        Onder hetzelfde advisory lock als de claim: parallelle cron slots herstellen een job maar één keer.
+        Na QUEUE_MAX_RECOVERIES_PARAM herstarts wordt de job failed (bijv. een job die de worker laat crashen)
+        """
+        cr = self.env.cr
+        cr.execute("SELECT pg_advisory_xact_lock(%s)", (QUEUE_CLAIM_LOCK_KEY,))
+        # State van na het lock lezen, niet uit de cache
+        self.invalidate_model(['state', 'heartbeat_at', 'worker_pid', 'worker_host'])
+        now = fields.Datetime.now()
+        dead_jobs = self.search([('state', '=', 'processing')]).filtered(lambda job: not job._is_worker_alive(now))
+        if not dead_jobs:
+            cr.commit()
+            return
+        max_recoveries = max(0, self._get_int_param(QUEUE_MAX_RECOVERIES_PARAM, QUEUE_DEFAULT_MAX_RECOVERIES))
+        for job in dead_jobs:
+            job.write({'heartbeat_at': False, 'worker_pid': 0, 'worker_host': False})
+            if job.recovery_count >= max_recoveries:
+                _logger.error(f"Import {job.id}: worker gone again after {job.recovery_count} recoveries, giving up")
+                job._mark_failed(f"Worker {job.recovery_count + 1}x weggevallen tijdens de import, gestopt")
+                continue
+            _logger.warning(f"Import {job.id}: worker is gone (recovery {job.recovery_count + 1}/{max_recoveries}), "
+                            f"resuming from checkpoint")
+            job.write({'state': 'queued', 'recovery_count': job.recovery_count + 1})
+            job.history_id.retry_count += 1
+        self.env.cr.commit()
+        self._trigger_queue_processing()
+    
+    @api.model
+    def _get_time_budget(self):
+        """
+        Seconds one cron slice may spend on an import (None = no limit)
+        Gebaseerd op de worker time limit: limit_time_real_cron (-1 = limit_time_real, 0 = geen limiet)
+        """
+        limit = config.get('limit_time_real_cron', -1)
+        if limit is None or limit < 0:
+            limit = config.get('limit_time_real', 0)
+        if not limit or limit <= 0:
+            return None
+        value = self.env['ir.config_parameter'].sudo().get_param(QUEUE_TIME_BUDGET_PARAM, QUEUE_DEFAULT_TIME_BUDGET)
+        try:
+            fraction = float(value)
+        except (TypeError, ValueError):
+            fraction = QUEUE_DEFAULT_TIME_BUDGET
+        return limit * min(max(fraction, 0.05), 0.95)
+    
+    @api.model
+    def _trigger_queue_processing(self):
+        """Wake the queue cron slots up now instead of waiting for the next interval"""
+        for xmlid in QUEUE_CRON_XMLIDS:
+            cron = self.env.ref(xmlid, raise_if_not_found=False)
+            if cron and cron.active:
+                cron.sudo()._trigger()
+    
+    def _yield_slice(self):
+        """
+        Time budget used up: put the job back in the queue (state queued, checkpoint kept)
+        and trigger the cron right away so the next slice starts without idle gap
+        """
+        self.state = 'queued'
+        self.env.cr.commit()
+        self._trigger_queue_processing()
+        _logger.info(f"Import {self.id} paused after its time slice, requeued for the next slice")
+    
+    @api.model
+    def _claim_next_queue_item(self):
+        """
+        Claim the next queued item whose supplier has no unfinished import
+        (processing, split of gepauzeerd na een slice)
+        Volgorde: fast lane eerst, dan de leverancier die het langst niet aan de beurt
+        was, dan de oudste job. Bulk jobs laten de gereserveerde fast lane slots vrij.
+        Rijen worden gelockt met FOR UPDATE SKIP LOCKED, zodat parallelle workers
+        nooit hetzelfde item pakken; het advisory lock houdt de concurrency telling
+        en de claim atomair. Het item staat na de commit op 'processing'.
+        Returns queue record (leeg als er niets te doen is)
+        """
+        cr = self.env.cr
+        self.flush_model(['state', 'supplier_id', 'parent_id', 'job_type', 'lane', 'started_at'])
+        max_concurrency = self._get_max_concurrency()
+        fast_lane_slots = min(
+            max(0, self._get_int_param(QUEUE_FAST_LANE_SLOTS_PARAM, QUEUE_DEFAULT_FAST_LANE_SLOTS)),
+            max_concurrency - 1,
+        )
+        
+        # Transaction-level lock: vrijgegeven bij de commit hieronder
+        cr.execute("SELECT pg_advisory_xact_lock(%s)", (QUEUE_CLAIM_LOCK_KEY,))
+        cr.execute("SELECT lane, COUNT(*) FROM supplier_import_queue WHERE state = 'processing' GROUP BY lane")
+        running_by_lane = dict(cr.fetchall())
+        running = sum(running_by_lane.values())
+        if running >= max_concurrency:
+            _logger.info(f"{running} import(s) already processing (max {max_concurrency}), waiting...")
+            cr.commit()
+            return self.browse()
+        bulk_allowed = running_by_lane.get('bulk', 0) < max_concurrency - fast_lane_slots
+        
+        cr.execute("""
+            SELECT q.id
+            FROM supplier_import_queue q
+            LEFT JOIN (
+                SELECT supplier_id, MAX(started_at) AS last_started
+                FROM supplier_import_queue
+                WHERE started_at IS NOT NULL
+                GROUP BY supplier_id
+            ) served ON served.supplier_id = q.supplier_id
+            WHERE q.state = 'queued'
+            AND NOT EXISTS (
+                -- Eén onafgemaakte import per leverancier (chunks van dezelfde import mogen parallel):
+                -- lopend, opgesplitst, of gepauzeerd na een slice (terug op queued, started_at gezet).
+                -- Anders ruimt een nieuwere import de regels van de gepauzeerde run op via zijn stempel
+                SELECT 1 FROM supplier_import_queue p
+                WHERE p.supplier_id = q.supplier_id
+                AND COALESCE(p.parent_id, p.id) != COALESCE(q.parent_id, q.id)
+                AND (p.state IN ('processing', 'split')
+                     OR (p.state = 'queued' AND p.started_at IS NOT NULL))
+            )
+            AND (q.job_type != 'finalize' OR NOT EXISTS (
+                -- Finalize pas als alle chunks klaar (of mislukt) zijn
+                SELECT 1 FROM supplier_import_queue c
+                WHERE c.parent_id = q.parent_id
+                AND c.job_type = 'chunk'
+                AND c.state IN ('queued', 'processing')
+            ))
+            AND (%(bulk_allowed)s OR q.lane = 'fast')
+            ORDER BY CASE WHEN q.lane = 'fast' THEN 0 ELSE 1 END,
+                     served.last_started NULLS FIRST,
+                     q.create_date, q.id
+            LIMIT 1
+            FOR UPDATE OF q SKIP LOCKED
+        """, {'bulk_allowed': bulk_allowed})
+        row = cr.fetchone()
+        if not row:
+            _logger.info("No claimable queued imports")
+            cr.commit()
+            return self.browse()
+        
+        queue_item = self.browse(row[0])
+        queue_item.write({
+            'state': 'processing',
+            'heartbeat_at': fields.Datetime.now(),
+            'worker_pid': os.getpid(),
+            'worker_host': socket.gethostname(),
+        })
+        if not queue_item.started_at:
+            queue_item.started_at = fields.Datetime.now()
+        queue_item.history_id.state = 'running'
+        cr.commit()
+        return queue_item
+    
+    def _execute_queued_import(self, deadline=None):
+        """
+        Execute the import from queue data - NIEUWE BULK ARCHITECTUUR
+        Grote imports worden na de key scan opgesplitst in chunk jobs + een finalize job
+        deadline: time.time() waarde waarna import/chunk jobs pauzeren (zie _yield_slice)
+        """
         self.ensure_one()
         
+        if self.job_type == 'chunk':
+            return self._execute_chunk(deadline)
+        if self.job_type == 'finalize':
+            return self._execute_finalize()
+        if (self.history_id.total_rows or 0) > QUEUE_CHUNK_ROWS and self._split_into_chunks():
+            # De chunk jobs zijn bij create al aan de cron slots gemeld
+            return
+        return self._execute_full_import(deadline)
+    
+    def _get_payload_item(self):
+        """Queue record that holds the CSV payload (chunks/finalize use their parent)"""
+        return self.parent_id or self
+    
+    def _release_payload(self):
+        """Drop the payload reference and prescan cache of finished jobs (de store ruimt ongebruikte payloads op)"""
+        self.filtered(lambda r: r.payload_id or r.csv_file).write({'payload_id': False, 'csv_file': False})
+        self.with_context(bin_size=True).filtered('prescan_cache').write({'prescan_cache': False})
+    
+    def _open_csv_stream(self):
+        """Payload uit de store (chunks/finalize lezen die van hun parent), legacy jobs uit csv_file"""
+        payload_item = self._get_payload_item()
+        if payload_item.payload_id:
+            return payload_item.payload_id._open()
+        return Base64ChunkReader(payload_item.with_context(bin_size=False).csv_file)
+    
+    def _import_heartbeat(self):
+        """The import engine signals batch boundaries: this worker is still alive"""
+        self._heartbeat()
+    
+    def _load_prescan_cache(self):
+        """Prescan state stored by an earlier slice of this job (supplierinfo_map wordt opnieuw geladen)"""
+        cache = self.with_context(bin_size=False).prescan_cache
+        if not cache:
+            return None
+        return json.loads(gzip.decompress(base64.b64decode(cache)))
+    
+    def _store_prescan_cache(self, prescan_data):
+        """Keep the prescan state for the next slice; commit zodat een yield of dode worker hem niet kwijtraakt"""
+        skip = {'supplierinfo_map', 'run_id', 'prescan_pending', 'from_cache'}
+        state = {key: value for key, value in prescan_data.items() if key not in skip}
+        payload = gzip.compress(json.dumps(state, default=str).encode('utf-8'), mtime=0)
+        self.prescan_cache = base64.b64encode(payload)
+        self.env.cr.commit()
+    
+    def _execute_full_import(self, deadline=None):
+        """Run all five bulk steps in this job (kleine en middelgrote imports)"""
         # Parse mapping from string
         mapping = ast.literal_eval(self.mapping)
         
         _logger.info(f"Starting background import with NEW BULK architecture for supplier {self.supplier_id.name}")
         
         try:
-            # Create temporary wizard instance to use the new bulk import methods
-            DirectImport = self.env['supplier.direct.import']
-            temp_wizard = DirectImport.create({
-                'supplier_id': self.supplier_id.id,
-                'csv_file': self.csv_file,
-                'csv_filename': self.csv_filename,
-                'encoding': self.encoding,
-                'csv_separator': self.csv_separator,
-                'min_stock_qty': self.min_stock_qty,
-                'min_price': self.min_price,
-                'skip_discontinued': self.skip_discontinued,
-                'cleanup_old_supplierinfo': self.cleanup_old_supplierinfo,
-            })
-            
-            # Save the original history reference
-            original_history = self.history_id
-            
-            # Call the NEW bulk _execute_import method
-            import json
             start_time = time.time()
-            
-            # STEP 1: PRE-SCAN CSV
-            _logger.info("=== BACKGROUND IMPORT: STEP 1 PRE-SCAN ===")
-            prescan_data = temp_wizard._prescan_csv_and_prepare(mapping)
-            
-            total_rows = len(prescan_data['update_codes']) + len(prescan_data['create_codes']) + \
-                        len(prescan_data['filtered']) + len(prescan_data['error_rows'])
-            
-            _logger.info(f"Pre-scan: {total_rows} rows ({len(prescan_data['update_codes'])} updates, {len(prescan_data['create_codes'])} creates)")
-            
-            # STEP 2: PRE-CLEANUP
-            cleanup_stats = {'removed': 0, 'archived': 0}
-            if self.cleanup_old_supplierinfo:
-                _logger.info("=== BACKGROUND IMPORT: STEP 2 PRE-CLEANUP ===")
-                cleanup_stats = temp_wizard._cleanup_old_supplierinfo(prescan_data, original_history.id)
-            
-            # STEP 3: BULK UPDATE
-            updated_count = 0
-            if prescan_data['update_codes']:
-                _logger.info("=== BACKGROUND IMPORT: STEP 3 BULK UPDATE ===")
-                updated_count = temp_wizard._bulk_update_supplierinfo(prescan_data, mapping)
-            
-            # STEP 4: BULK CREATE
-            created_count = 0
-            if prescan_data['create_codes']:
-                _logger.info("=== BACKGROUND IMPORT: STEP 4 BULK CREATE ===")
-                created_count = temp_wizard._bulk_create_supplierinfo(prescan_data, mapping)
-            
-            # STEP 5: POST-PROCESS
-            archived_count = 0
-            if self.cleanup_old_supplierinfo:
-                _logger.info("=== BACKGROUND IMPORT: STEP 5 POST-PROCESS ===")
-                archived_count = temp_wizard._archive_products_without_suppliers()
-            
-            # Calculate duration
-            duration = time.time() - start_time
-            
-            # Build summary
-            stats = {
-                'total': total_rows,
-                'created': created_count,
-                'updated': updated_count,
-                'skipped': len(prescan_data['filtered']),
-                'errors': prescan_data['error_rows'],
-            }
-            summary = temp_wizard._create_import_summary(stats)
-            
-            if self.cleanup_old_supplierinfo:
-                summary += f"\n\nCleanup:\n" \
-                          f"- Verwijderd: {cleanup_stats['removed']} oude leverancier regels\n" \
-                          f"- Gearchiveerd: {cleanup_stats['archived']} + {archived_count} producten"
-            
-            # Update history record
-            original_history.write({
-                'total_rows': total_rows,
-                'created_count': created_count,
-                'updated_count': updated_count,
-                'skipped_count': len(prescan_data['filtered']),
-                'error_count': len(prescan_data['error_rows']),
-                'duration': duration,
-                'summary': summary,
-                'state': 'completed_with_errors' if prescan_data['error_rows'] else 'completed',
-                'mapping_data': json.dumps(mapping),  # Archive mapping
-            })
-            
-            # Create error records in database for missende producten
-            if prescan_data['error_rows']:
-                temp_wizard._create_error_records(original_history.id, prescan_data['error_rows'])
-                _logger.info(f"Created {len(prescan_data['error_rows'])} error records in database")
-            
-            # Update supplier's last sync date
-            try:
-                self.supplier_id.write({'last_sync_date': fields.Datetime.now()})
-            except Exception as e:
-                _logger.warning(f"Could not update supplier last_sync_date: {e}")
-            
-            # AUTO-SAVE mapping template
-            temp_wizard._auto_save_mapping_template(mapping)
-            
-            # Clean up temp wizard
-            temp_wizard.unlink()
-            
-            _logger.info(f"=== BACKGROUND IMPORT COMPLETE: {duration:.1f}s, {total_rows/duration:.0f} rows/sec ===")
+            history = self.history_id
+            # Resumes after last_processed_row (vorige slice of dode worker)
+            result = self._run_bulk_import(mapping, history, history.last_processed_row or 0, deadline)
+            if result is None:
+                return self._yield_slice()
+            stats, cleanup_stats, archived_ids = result
+            self._finish_import(history, mapping, stats, cleanup_stats, archived_ids, time.time() - start_time)
             
         except Exception as e:
             _logger.error(f"Background import failed: {e}", exc_info=True)
             raise
-        except Exception as e:
-            _logger.error(f"Background import failed: {e}", exc_info=True)
-            raise
+    
+    # =========================================================================
+    # CHUNKED IMPORTS (grote bestanden: chunk jobs per key range + finalize)
+    # =========================================================================
+    
+    def _split_into_chunks(self):
+        """
+        Split a large import into chunk jobs per chunk key range plus one finalize job
+        Chunk key = product template als het product bestaat (zie _chunk_keys), zodat
+        varianten van één template nooit in parallelle chunks terechtkomen
+        Chunks kunnen door verschillende workers tegelijk verwerkt worden; de finalize
+        job wordt pas geclaimd als alle chunks klaar zijn.
+        Returns True als er gesplitst is (anders draait de import als één job)
+        """
+        mapping = ast.literal_eval(self.mapping)
+        keys = self._scan_chunk_keys(mapping)
+        
+        # Chunk grenzen op distinct keys: dezelfde key (template) valt altijd in dezelfde chunk
+        boundaries = keys[QUEUE_CHUNK_ROWS::QUEUE_CHUNK_ROWS]
+        if not boundaries:
+            return False
+        ranges = list(zip([''] + boundaries, boundaries + [False]))
+        
+        base_vals = {
+            'history_id': self.history_id.id,
+            'supplier_id': self.supplier_id.id,
+            'parent_id': self.id,
+            'csv_filename': self.csv_filename,
+            'encoding': self.encoding,
+            'csv_separator': self.csv_separator,
+            'mapping': self.mapping,
+            'min_stock_qty': self.min_stock_qty,
+            'min_price': self.min_price,
+            'skip_discontinued': self.skip_discontinued,
+            'cleanup_old_supplierinfo': self.cleanup_old_supplierinfo,
+            'use_sql_upsert': self.use_sql_upsert,
+        }
+        self.create([
+            dict(base_vals, job_type='chunk', key_from=key_from, key_to=key_to)
+            for key_from, key_to in ranges
+        ] + [dict(base_vals, job_type='finalize')])
+        
+        self.state = 'split'
+        self.history_id.write({'created_count': 0, 'updated_count': 0, 'skipped_count': 0, 'error_count': 0})
+        _logger.info(f"Import {self.id} split into {len(ranges)} chunk jobs ({len(keys)} chunk keys)")
+        return True
+    
+    def _execute_chunk(self, deadline=None):
+        """
+        Prescan + update + create for the rows of one key range; result kept for finalize
+        Counters gaan per checkpoint naar de history; een hervatte chunk begint na last_processed_row
+        """
+        mapping = ast.literal_eval(self.mapping)
+        start_time = time.time()
+        
+        prescan_data = self._prescan_csv_and_prepare(
+            mapping, key_range=(self.key_from or '', self.key_to or None), run_id=self.history_id.id, deadline=deadline,
+        )
+        if prescan_data.get('prescan_pending'):
+            return self._yield_slice()
+        progress = {'updated': 0, 'created': 0}
+        
+        def checkpoint(row, updated, created):
+            self._add_history_progress(created=created - progress['created'], updated=updated - progress['updated'])
+            progress.update(updated=updated, created=created)
+            self.last_processed_row = row
+        
+        resume_row = self.last_processed_row or 0
+        updated_count, created_count = self._run_write_steps(prescan_data, mapping, resume_row, checkpoint, deadline)
+        if prescan_data.get('interrupted_row'):
+            return self._yield_slice()
+        
+        result = {
+            'total': self._prescan_total(prescan_data),
+            'created': created_count,
+            'updated': updated_count,
+            # Eerdere slices van deze chunk staan alleen in de gedeelde history: rijen t/m resume_row overslaan
+            'unchanged': self._resumed_unchanged(prescan_data, resume_row),
+            'skipped': len(prescan_data['filtered']),
+            'errors': prescan_data['error_rows'],
+            'duration': time.time() - start_time,
+        }
+        
+        self.chunk_result = json.dumps(result, default=str)
+        self._release_payload()
+        self._add_history_progress(skipped=result['skipped'], errors=len(result['errors']))
+        _logger.info(f"Chunk {self.id} [{self.key_from!r}, {self.key_to or 'end'!r}) done: "
+                     f"{updated_count} updated, {created_count} created, {result['unchanged']} unchanged")
+    
+    def _add_history_progress(self, created=0, updated=0, skipped=0, errors=0):
+        """Add chunk counters to the shared history (atomic increment, chunks run in parallel)"""
+        history = self.history_id
+        history.flush_recordset(['created_count', 'updated_count', 'skipped_count', 'error_count'])
+        self.env.cr.execute("""
+            UPDATE supplier_import_history
+            SET created_count = COALESCE(created_count, 0) + %s,
+                updated_count = COALESCE(updated_count, 0) + %s,
+                skipped_count = COALESCE(skipped_count, 0) + %s,
+                error_count = COALESCE(error_count, 0) + %s
+            WHERE id = %s
+        """, (created, updated, skipped, errors, history.id))
+        history.invalidate_recordset(['created_count', 'updated_count', 'skipped_count', 'error_count'])
+    
+    def _execute_finalize(self):
+        """Cleanup, archive, error persistence and history summary once all chunks are finished"""
+        mapping = ast.literal_eval(self.mapping)
+        start_time = time.time()
+        parent = self.parent_id
+        chunks = parent.chunk_ids.filtered(lambda c: c.job_type == 'chunk')
+        failed_chunks = chunks.filtered(lambda c: c.state != 'done')
+        results = [json.loads(chunk.chunk_result) for chunk in chunks if chunk.chunk_result]
+        
+        # created/updated uit de history: die bevat ook het werk van chunks die hervat zijn
+        self.history_id.invalidate_recordset(['created_count', 'updated_count'])
+        stats = {
+            'total': sum(r['total'] for r in results),
+            'created': self.history_id.created_count,
+            'updated': self.history_id.updated_count,
+            'unchanged': sum(r['unchanged'] for r in results),
+            'skipped': sum(r['skipped'] for r in results),
+            'errors': [error for r in results for error in r['errors']],
+        }
+        
+        cleanup_stats = {'removed': 0, 'template_ids': []}
+        archived_ids = []
+        notes = ''
+        if failed_chunks:
+            # Geen cleanup op een onvolledige import: die zou regels van mislukte chunks verwijderen
+            notes = f"⚠️ {len(failed_chunks)} van {len(chunks)} chunks mislukt - cleanup overgeslagen"
+            _logger.warning(f"Finalize {self.id}: {notes} (chunks {failed_chunks.ids})")
+        elif self.cleanup_old_supplierinfo:
+            _logger.info("=== BACKGROUND IMPORT: FINALIZE CLEANUP ===")
+            # Alle chunks stempelen met dezelfde history: één cleanup voor de hele import
+            cleanup_stats = self._cleanup_stale_supplierinfo(self.history_id.id)
+            archived_ids = self._archive_products_without_suppliers(cleanup_stats['template_ids'])
+        
+        duration = sum(r['duration'] for r in results) + time.time() - start_time
+        self._finish_import(self.history_id, mapping, stats, cleanup_stats, archived_ids, duration, notes)
+        parent.state = 'done'
+        parent._release_payload()
+    
+    @api.model
+    def _get_wait_time_report(self, days=7):
+        """
+        Wachttijden per leverancier en lane over de laatste `days` dagen (SLA controle)
+        Returns list of dicts: supplier_id, supplier, lane, jobs, avg_wait, p95_wait, max_wait (seconden)
+        """
+        self.flush_model(['supplier_id', 'lane', 'started_at', 'wait_seconds'])
+        self.env.cr.execute("""
+            SELECT q.supplier_id, p.name, q.lane, COUNT(*),
+                   AVG(q.wait_seconds),
+                   PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY q.wait_seconds),
+                   MAX(q.wait_seconds)
+            FROM supplier_import_queue q
+            JOIN res_partner p ON p.id = q.supplier_id
+            WHERE q.started_at IS NOT NULL
+            AND q.create_date >= NOW() at time zone 'UTC' - make_interval(days => %s)
+            GROUP BY q.supplier_id, p.name, q.lane
+            ORDER BY q.lane, MAX(q.wait_seconds) DESC
+        """, (days,))
+        report = [{
+            'supplier_id': supplier_id,
+            'supplier': name,
+            'lane': lane,
+            'jobs': jobs,
+            'avg_wait': avg_wait or 0.0,
+            'p95_wait': p95_wait or 0.0,
+            'max_wait': max_wait or 0.0,
+        } for supplier_id, name, lane, jobs, avg_wait, p95_wait, max_wait in self.env.cr.fetchall()]
+        for line in report:
+            _logger.info(f"Queue wait [{line['lane']}] {line['supplier']}: {line['jobs']} jobs, "
+                         f"avg {line['avg_wait']:.0f}s, p95 {line['p95_wait']:.0f}s, max {line['max_wait']:.0f}s")
+        return report
     
     def action_requeue(self):
-        """Requeue failed or processing imports"""
+        """
+        Requeue failed or processing imports
+        De import hervat na het laatste checkpoint (last_processed_row), retry_count wordt opgehoogd.
+        Een processing job waarvan de worker nog leeft wordt niet teruggezet (anders twee workers op één job)
+        """
+        now = fields.Datetime.now()
+        alive = self.filtered(lambda record: record.state == 'processing' and record._is_worker_alive(now))
+        if alive:
+            raise UserError(
+                f"Import(s) {', '.join(str(record.id) for record in alive)} worden nog verwerkt door een actieve worker "
+                f"en kunnen niet worden teruggezet"
+            )
         for record in self:
             if record.state in ['failed', 'processing']:
-                record.write({'state': 'queued'})
+                # Handmatige requeue: opnieuw het volle aantal herstarts na een dode worker
+                record.write({'state': 'queued', 'recovery_count': 0})
                 if record.history_id:
-                    record.history_id.write({'state': 'pending'})
+                    history_vals = {'retry_count': record.history_id.retry_count + 1}
+                    if record.job_type != 'chunk':
+                        history_vals['state'] = 'pending'
+                    record.history_id.write(history_vals)
+                    _logger.info(f"Requeued import {record.id} (retry {history_vals['retry_count']}), "
+                                 f"resume after row {record.last_processed_row if record.job_type == 'chunk' else record.history_id.last_processed_row}")
+        if any(record.state == 'queued' for record in self):
+            self._trigger_queue_processing()
     
     def action_mark_failed(self):
         """Manually mark queued/processing imports as failed"""
@@ -488,9 +488,9 @@ class SupplierImportSchedule(models.Model):
         # TODO: Implement actual import logic in Fase 2
         # Steps:
         # 1. Download file (via FTP/API/Email depending on method)
-        # 2. Create supplier.direct.import wizard record
+        # 2. Queue a supplier.import.queue job (payload_id via supplier.import.payload._store_stream)
         # 3. Load mapping from template
-        # 4. Process import
+        # 4. Process import (queue job runs the supplier.import.engine pipeline)
         # 5. Log results
         
         raise UserError(
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Import Stream helpers - CSV payloads chunk voor chunk lezen
+Voorkomt dat een volledige leveranciersfeed (base64 + gedecodeerde string +
+rij dicts) tegelijk in het geheugen staat
+"""
+
+import base64
+import csv
+import io
+import itertools
+
+# Bytes per leesactie (decoded payload)
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Whitespace die in base64 payloads kan voorkomen (bijv. encodebytes output)
+_B64_WHITESPACE = b' \t\r\n'
+
+
+class Base64ChunkReader(io.RawIOBase):
+    """
+    Raw stream die een base64 payload lazy decodeert, chunk voor chunk
+    Het geheugengebruik is begrensd door chunk_size, niet door de payload
+    """
+
+    def __init__(self, payload, chunk_size=STREAM_CHUNK_SIZE):
+        super().__init__()
+        if isinstance(payload, str):
+            payload = payload.encode('ascii')
+        self._payload = memoryview(payload or b'')
+        self._pos = 0
+        # 4 base64 tekens = 3 bytes
+        self._encoded_chunk = max(4, (chunk_size // 3) * 4)
+        self._pending = b''
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def _fill_buffer(self):
+        while not self._buffer and self._pos < len(self._payload):
+            end = min(self._pos + self._encoded_chunk, len(self._payload))
+            encoded = self._pending + bytes(self._payload[self._pos:end]).translate(None, _B64_WHITESPACE)
+            self._pos = end
+            if self._pos < len(self._payload):
+                # Alleen volledige 4-tekens groepen decoderen, rest bewaren
+                usable = len(encoded) - len(encoded) % 4
+                encoded, self._pending = encoded[:usable], encoded[usable:]
+            else:
+                self._pending = b''
+            self._buffer = base64.b64decode(encoded)
+
+    def readinto(self, b):
+        self._fill_buffer()
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def open_text_stream(binary_stream, encoding):
+    """Wrap a binary stream as text stream suitable for the csv module"""
+    if not isinstance(binary_stream, io.BufferedIOBase):
+        binary_stream = io.BufferedReader(binary_stream, STREAM_CHUNK_SIZE)
+    return io.TextIOWrapper(binary_stream, encoding=encoding, newline='')
+
+
+def iter_csv_dicts(binary_stream, encoding, delimiter):
+    """
+    Yield (row_num, row_dict) tuples from a binary CSV stream
+    row_num telt zoals in de editor: header = rij 1, eerste data rij = rij 2
+    """
+    reader = csv.DictReader(open_text_stream(binary_stream, encoding), delimiter=delimiter)
+    return enumerate(reader, start=2)
+
+
+def iter_csv_rows(binary_stream, encoding, delimiter):
+    """
+    Read the header of a binary CSV stream
+    Returns (headers, iterator of (row_num, row_list)); lege regels worden
+    overgeslagen en niet meegeteld, net als bij csv.DictReader
+    """
+    reader = csv.reader(open_text_stream(binary_stream, encoding), delimiter=delimiter)
+    headers = next(reader, [])
+    rows = (row for row in reader if row)
+    return headers, enumerate(rows, start=2)
+
+
+def iter_windows(iterable, size):
+    """Split an iterable in lists of at most `size` items, without materialising it"""
+    iterator = iter(iterable)
+    while True:
+        window = list(itertools.islice(iterator, size))
+        if not window:
+            return
+        yield window
+
+
+def count_lines(binary_stream, chunk_size=STREAM_CHUNK_SIZE):
+    """Count newline characters in a binary stream without decoding it"""
+    count = 0
+    while True:
+        chunk = binary_stream.read(chunk_size)
+        if not chunk:
+            return count
+        count += chunk.count(b'\n')
+
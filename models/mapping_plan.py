@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Mapping Plan - Kolom mapping één keer per import compileren
+{csv_column: 'model.field'} wordt een lijst van
+(column_index, bucket, field_name, converter) tuples, zodat rijen zonder
+per-cel field lookups of logging geconverteerd worden
+"""
+
+import hashlib
+import json
+
+# model prefix in mapping -> (Odoo model, row_data bucket)
+PLAN_BUCKETS = {
+    'product': ('product.product', 'product_fields'),
+    'supplierinfo': ('product.supplierinfo', 'supplierinfo_fields'),
+}
+
+TRUE_VALUES = frozenset(['true', '1', 'yes', 'ja', 'y'])
+
+
+def to_float(value):
+    """Float met komma of punt als decimaal scheidingsteken (ongeldig = None, veld wordt overgeslagen)"""
+    try:
+        return float(value.replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def to_integer(value):
+    return int(value) if value.isdigit() else None
+
+
+def to_boolean(value):
+    return value.lower() in TRUE_VALUES
+
+
+def to_string(value):
+    return value
+
+
+class Many2oneResolver:
+    """
+    Per-import memo voor many2one kolommen: celwaarde -> record id
+    prefetch() lost alle nieuwe waarden van een window op met één query;
+    voor merken wordt eerst supplier.brand.mapping van de leverancier geraadpleegd
+    """
+
+    def __init__(self, env, field, supplier_id=None):
+        self.env = env
+        self.comodel_name = field.comodel_name
+        self.supplier_id = supplier_id
+        self.cache = {}
+
+    def prefetch(self, values):
+        """Resolve every not yet known value with one name IN query"""
+        missing = {value for value in values if value and not value.isdigit() and value not in self.cache}
+        if not missing:
+            return
+        if self.supplier_id and self.comodel_name == 'product.brand' and 'supplier.brand.mapping' in self.env:
+            mapped = self.env['supplier.brand.mapping'].get_mapped_brands(self.supplier_id, missing)
+            for value, brand in mapped.items():
+                if brand:
+                    self.cache[value] = brand.id
+                    missing.discard(value)
+        Model = self.env[self.comodel_name]
+        if missing and 'name' in Model._fields:
+            for record in Model.search([('name', 'in', list(missing))]):
+                self.cache.setdefault(record.name, record.id)
+            for value in missing:
+                self.cache.setdefault(value, False)
+
+    def __call__(self, value):
+        if value.isdigit():
+            return int(value)
+        if value not in self.cache:
+            self.prefetch([value])
+        return self.cache[value]
+
+
+def field_converter(env, field, supplier_id=None):
+    """Return the converter for an Odoo field (string passthrough when unknown)"""
+    if not field:
+        return to_string
+    if field.type in ('float', 'monetary'):
+        return to_float
+    if field.type == 'integer':
+        return to_integer
+    if field.type == 'boolean':
+        return to_boolean
+    if field.type == 'many2one':
+        return Many2oneResolver(env, field, supplier_id)
+    # char, text, selection, date, datetime
+    return to_string
+
+
+def compile_mapping_plan(env, mapping, headers, supplier_id=None):
+    """
+    Compile a {csv_column: 'model.field'} mapping against the CSV headers
+    Kolommen die niet in de headers staan of geen product/supplierinfo veld zijn vallen weg
+    Many2one kolommen krijgen een Many2oneResolver (memo per import)
+    Returns list of (column_index, bucket, field_name, converter)
+    """
+    # Dubbele header: laatste kolom wint (zelfde gedrag als csv.DictReader)
+    column_index = {header: idx for idx, header in enumerate(headers)}
+    plan = []
+    for csv_col, odoo_field in mapping.items():
+        if not odoo_field or '.' not in odoo_field or csv_col not in column_index:
+            continue
+        model, field_name = odoo_field.split('.', 1)
+        if model not in PLAN_BUCKETS:
+            continue
+        model_name, bucket = PLAN_BUCKETS[model]
+        field = env[model_name]._fields.get(field_name)
+        plan.append((column_index[csv_col], bucket, field_name, field_converter(env, field, supplier_id)))
+    return plan
+
+
+def prefetch_mapping_plan(plan, rows):
+    """Resolve the distinct relational values of a window of rows up front"""
+    for index, _bucket, _field_name, convert in plan:
+        if isinstance(convert, Many2oneResolver):
+            convert.prefetch({cell(row, index) for row in rows})
+
+
+def apply_mapping_plan(plan, row):
+    """
+    Run one CSV row (list of cells) through a compiled plan
+    Lege cellen en ongeldige getallen (converter geeft None) worden overgeslagen,
+    zodat een bestaande prijs nooit met 0 overschreven wordt
+    """
+    row_data = {
+        'product_fields': {},
+        'supplierinfo_fields': {},
+    }
+    row_len = len(row)
+    for index, bucket, field_name, convert in plan:
+        if index >= row_len:
+            continue
+        value = row[index].strip()
+        if not value:
+            continue
+        converted = convert(value)
+        if converted is not None:
+            row_data[bucket][field_name] = converted
+    return row_data
+
+
+def cell(row, index):
+    """Stripped cell value, '' when the column is unmapped or missing in this row"""
+    if index is None or index >= len(row):
+        return ''
+    return row[index].strip()
+
+
+def row_fingerprint(row_data):
+    """
+    Hash of the mapped values of one row (product + supplierinfo buckets)
+    Zelfde waarden + zelfde gemapte velden = zelfde fingerprint
+    """
+    payload = json.dumps(
+        [row_data.get('product_fields', {}), row_data.get('supplierinfo_fields', {})],
+        sort_keys=True, default=str, separators=(',', ':'),
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Missing Product Index - Eén regel per (leverancier, product key) die niet gevonden werd
+Imports upserten hier in bulk (zie _upsert_missing_products in de import engine);
+supplier.import.error blijft het log per run, UI en dashboards lezen deze compacte set.
+Een cron lost regels op zodra het product bestaat en speelt de laatste CSV rij af
+als supplierinfo upsert (SQL upsert van de engine)
+"""
+
+from odoo import models, fields, api
+import json
+import logging
+
+from .import_stream import iter_windows
+from .mapping_plan import apply_mapping_plan, compile_mapping_plan, row_fingerprint
+
+_logger = logging.getLogger(__name__)
+
+# Opgeloste regels opnieuw afspelen als supplierinfo (0 = alleen markeren als resolved)
+MISSING_PRODUCT_REPLAY_PARAM = 'product_supplier_sync.missing_product_replay'
+
+# Regels per staging batch bij het afspelen (commit per batch)
+MISSING_PRODUCT_REPLAY_BATCH_SIZE = 5000
+
+# Eén set-based match voor een tabel met barcode/product_code/resolved kolommen:
+# barcode eerst, dan product code, alleen actieve producten
+_MATCH_PRODUCTS_CTE = """
+    WITH candidates AS (
+        SELECT t.id, p.id AS product_id, p.product_tmpl_id, 1 AS priority
+        FROM {table} t
+        JOIN product_product p ON p.barcode = t.barcode AND p.active
+        WHERE NOT t.resolved AND t.barcode <> '' {where}
+        UNION ALL
+        SELECT t.id, p.id, p.product_tmpl_id, 2
+        FROM {table} t
+        JOIN product_product p ON p.default_code = t.product_code AND p.active
+        WHERE NOT t.resolved AND t.product_code <> '' {where}
+    ), matched AS (
+        SELECT DISTINCT ON (id) id, product_id, product_tmpl_id
+        FROM candidates
+        ORDER BY id, priority, product_id
+    )
+"""
+
+# Import errors: direct markeren als resolved (niets af te spelen)
+_RESOLVE_ERRORS_SQL = _MATCH_PRODUCTS_CTE.format(
+    table='supplier_import_error', where="AND t.error_type = 'product_not_found'",
+) + """
+    UPDATE supplier_import_error t
+    SET resolved = TRUE,
+        resolved_date = %(now)s,
+        resolved_by = %(uid)s,
+        product_id = m.product_id,
+        notes = COALESCE(t.notes, 'Automatisch opgelost: product gevonden'),
+        write_uid = %(uid)s,
+        write_date = %(now)s
+    FROM matched m
+    WHERE t.id = m.id
+"""
+
+# Index regels: eerst selecteren, pas als resolved markeren na een geslaagde replay
+_MATCH_MISSING_PRODUCTS_SQL = _MATCH_PRODUCTS_CTE.format(table='supplier_missing_product', where='') + """
+    SELECT t.id, t.supplier_id, m.product_id, m.product_tmpl_id, t.csv_data, t.last_history_id
+    FROM supplier_missing_product t
+    JOIN matched m ON m.id = t.id
+    ORDER BY t.id
+"""
+
+
+class SupplierMissingProduct(models.Model):
+    """Product key of a supplier feed without matching product, deduplicated across imports"""
+    _name = 'supplier.missing.product'
+    _description = 'Supplier Missing Product'
+    _rec_name = 'product_key'
+    _order = 'last_seen desc, id desc'
+
+    supplier_id = fields.Many2one('res.partner', string='Leverancier', required=True, index=True, ondelete='cascade')
+    product_key = fields.Char(string='Product Key', required=True, help='Barcode, anders product code (zelfde sleutel als de prescan)')
+    barcode = fields.Char('EAN/Barcode')
+    product_code = fields.Char('SKU/Product Code')
+    product_name = fields.Char('Product Naam')
+    brand = fields.Char('Merk/Brand')
+    csv_data = fields.Text('CSV Data', help='Laatste CSV rij (JSON) voor product aanmaak')
+
+    first_seen = fields.Datetime('Eerst Gezien', readonly=True)
+    last_seen = fields.Datetime('Laatst Gezien', readonly=True, index=True)
+    occurrence_count = fields.Integer('Aantal Imports', readonly=True, default=1)
+    last_history_id = fields.Many2one('supplier.import.history', string='Laatste Import', readonly=True, ondelete='set null')
+
+    # Status
+    product_id = fields.Many2one('product.product', string='Gevonden Product', readonly=True, ondelete='set null')
+    resolved = fields.Boolean('Resolved', default=False, index=True)
+    resolved_date = fields.Datetime('Resolved Date')
+    resolved_by = fields.Many2one('res.users', string='Resolved By')
+    notes = fields.Text('Resolution Notes')
+
+    # Odoo 19: models.Constraint (_sql_constraints wordt genegeerd); nodig voor ON CONFLICT in de import upsert
+    _supplier_key_unique = models.Constraint(
+        'UNIQUE(supplier_id, product_key)',
+        'Dit product staat al in de lijst van deze leverancier',
+    )
+
+    def action_mark_resolved(self):
+        """Mark missing products as resolved"""
+        self.write({
+            'resolved': True,
+            'resolved_date': fields.Datetime.now(),
+            'resolved_by': self.env.user.id,
+        })
+        return True
+
+    @api.model
+    def _cron_resolve_missing_products(self):
+        """
+        Resolve missing products and import errors whose product exists by now
+        Eén set-based match per tabel (barcode/product_code join op product_product);
+        index regels worden afgespeeld als supplierinfo upsert wanneer
+        MISSING_PRODUCT_REPLAY_PARAM aan staat en pas daarna als resolved gemarkeerd
+        Returns dict with resolved, errors_resolved, replayed
+        """
+        now = fields.Datetime.now()
+        self.env['product.product'].flush_model(['barcode', 'default_code', 'active', 'product_tmpl_id'])
+        self.flush_model()
+        self.env['supplier.import.error'].flush_model()
+        cr = self.env.cr
+        
+        cr.execute(_MATCH_MISSING_PRODUCTS_SQL)
+        matches = cr.fetchall()
+        cr.execute(_RESOLVE_ERRORS_SQL, {'now': now, 'uid': self.env.uid})
+        errors_resolved = cr.rowcount
+        self.env['supplier.import.error'].invalidate_model()
+        cr.commit()
+        
+        replay = self.env['ir.config_parameter'].sudo().get_param(MISSING_PRODUCT_REPLAY_PARAM, '1')
+        if replay in ('0', 'False', 'false'):
+            resolved, replayed = self._mark_matches_resolved(matches), 0
+            cr.commit()
+        else:
+            resolved, replayed = self._replay_resolved(matches)
+        
+        if matches or errors_resolved:
+            _logger.info(f"Missing products: {resolved}/{len(matches)} resolved ({errors_resolved} import errors), "
+                         f"{replayed} replayed as supplierinfo")
+        return {'resolved': resolved, 'errors_resolved': errors_resolved, 'replayed': replayed}
+
+    @api.model
+    def _mark_matches_resolved(self, matches):
+        """Mark matched index rows resolved with their product (one UPDATE); returns the row count"""
+        if not matches:
+            return 0
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            UPDATE supplier_missing_product t
+            SET resolved = TRUE,
+                resolved_date = %(now)s,
+                resolved_by = %(uid)s,
+                product_id = m.product_id,
+                notes = COALESCE(t.notes, 'Automatisch opgelost: product gevonden'),
+                write_uid = %(uid)s,
+                write_date = %(now)s
+            FROM unnest(%(ids)s::int[], %(product_ids)s::int[]) AS m(id, product_id)
+            WHERE t.id = m.id AND NOT t.resolved
+        """, {
+            'now': now, 'uid': self.env.uid,
+            'ids': [match[0] for match in matches],
+            'product_ids': [match[2] for match in matches],
+        })
+        count = self.env.cr.rowcount
+        self.invalidate_model()
+        return count
+
+    @api.model
+    def _templates_with_seller(self, supplier_id, template_ids):
+        """Set of template ids that already have a template-level supplierinfo of this supplier"""
+        if not template_ids:
+            return set()
+        self.env['product.supplierinfo'].flush_model(['partner_id', 'product_tmpl_id', 'product_id'])
+        self.env.cr.execute("""
+            SELECT DISTINCT product_tmpl_id
+            FROM product_supplierinfo
+            WHERE partner_id = %s AND product_id IS NULL AND product_tmpl_id IN %s
+        """, (supplier_id, tuple(set(template_ids))))
+        return {row[0] for row in self.env.cr.fetchall()}
+
+    @api.model
+    def _replay_resolved(self, matches):
+        """
+        Upsert supplierinfo from the stored CSV rows of matched missing products
+        Mapping uit history.mapping_data van de import die de regel het laatst zag;
+        per (leverancier, import) één staging upsert per batch, gestempeld met die import.
+        Elke batch draait in een savepoint en markeert zijn regels pas na een geslaagde
+        replay als resolved; een mislukte batch wordt per regel herhaald, regels die dan
+        nog falen blijven open voor de volgende run.
+        Alleen inserts: heeft het template al een leveranciersregel (bijv. van een nieuwere
+        import), dan wordt de oude CSV rij niet afgespeeld. Regels zonder af te spelen data
+        (geen mapping/CSV rij, al een leveranciersregel) worden direct resolved.
+        Importfilters (min. voorraad/prijs) zijn niet gearchiveerd en worden niet toegepast
+        Returns (resolved, replayed)
+        """
+        Engine = self.env['supplier.import.engine']
+        groups = {}
+        for match in matches:
+            supplier_id, csv_data, history_id = match[1], match[4], match[5]
+            groups.setdefault((supplier_id, history_id if csv_data else False), []).append(match)
+        
+        histories = self.env['supplier.import.history'].browse([history_id for _supplier_id, history_id in groups if history_id])
+        mappings = {history.id: history.mapping_data for history in histories}
+        nothing_to_replay = []
+        to_replay = []
+        for (supplier_id, history_id), rows in groups.items():
+            try:
+                mapping = json.loads(mappings.get(history_id) or '{}')
+            except ValueError:
+                mapping = {}
+            if not mapping:
+                nothing_to_replay.extend(rows)
+                continue
+            plans = {}
+            items = []
+            for match in rows:
+                try:
+                    csv_row = json.loads(match[4])
+                except ValueError:
+                    csv_row = None
+                if not isinstance(csv_row, dict) or ('error' in csv_row and len(csv_row) == 1):
+                    nothing_to_replay.append(match)
+                    continue
+                headers = tuple(csv_row)
+                if headers not in plans:
+                    plans[headers] = compile_mapping_plan(self.env, mapping, list(headers), supplier_id=supplier_id)
+                row_data = apply_mapping_plan(plans[headers], [str(value or '') for value in csv_row.values()])
+                row_data['_fingerprint'] = row_fingerprint(row_data)
+                items.append((match, ({'id': match[2], 'product_tmpl_id': match[3]}, row_data)))
+            
+            # Alleen templates zonder leveranciersregel: een nieuwere import heeft anders al actuele data
+            has_seller = self._templates_with_seller(supplier_id, [match[3] for match, _item in items])
+            nothing_to_replay.extend(match for match, _item in items if match[3] in has_seller)
+            items = [(match, item) for match, item in items if match[3] not in has_seller]
+            if items:
+                to_replay.append((supplier_id, history_id, items))
+        
+        resolved = self._mark_matches_resolved(nothing_to_replay)
+        self.env.cr.commit()
+        
+        replayed = 0
+        for supplier_id, history_id, items in to_replay:
+            for batch in iter_windows(items, MISSING_PRODUCT_REPLAY_BATCH_SIZE):
+                try:
+                    with self.env.cr.savepoint():
+                        Engine._sql_stage_supplierinfo(
+                            supplier_id, [item for _match, item in batch], run_id=history_id, insert_only=True,
+                        )
+                        count = self._mark_matches_resolved([match for match, _item in batch])
+                    resolved += count
+                    replayed += len(batch)
+                except Exception as e:
+                    _logger.warning(f"Missing product replay batch failed (supplier {supplier_id}), retrying per row: {e}")
+                    for match, item in batch:
+                        try:
+                            with self.env.cr.savepoint():
+                                Engine._sql_stage_supplierinfo(supplier_id, [item], run_id=history_id, insert_only=True)
+                                count = self._mark_matches_resolved([match])
+                            resolved += count
+                            replayed += 1
+                        except Exception as row_error:
+                            _logger.error(f"Missing product {match[0]} not replayed, stays open: {row_error}")
+                self.env.cr.commit()
+        return resolved, replayed
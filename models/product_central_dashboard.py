@@ -155,11 +155,10 @@ class ProductCentralDashboard(models.Model):
             record.total_imports = len(history)
             record.last_import_date = history[0].import_date if history else False
             
-            # Import errors (unresolved)
-            errors = self.env['supplier.import.error'].search([
+            # Missing products (unresolved, één regel per leverancier + product key)
+            record.import_errors_count = self.env['supplier.missing.product'].search_count([
                 ('resolved', '=', False)
             ])
-            record.import_errors_count = len(errors)
             
             # Active suppliers (met mapping templates)
             templates = self.env['supplier.mapping.template'].search([])
@@ -303,11 +302,11 @@ class ProductCentralDashboard(models.Model):
         }
     
     def action_view_import_errors(self):
-        """Open import errors (unresolved)"""
+        """Open missing products (unresolved)"""
         return {
             'name': 'Import Errors - Products Not Found',
             'type': 'ir.actions.act_window',
-            'res_model': 'supplier.import.error',
+            'res_model': 'supplier.missing.product',
             'view_mode': 'list,form',
             'domain': [('resolved', '=', False)],
             'context': {'default_resolved': False}
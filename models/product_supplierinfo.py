@@ -19,6 +19,25 @@ class ProductSupplierinfo(models.Model):
         readonly=True
     )
     
+    # Change detection: hash van de gemapte CSV waarden van de laatste import
+    import_fingerprint = fields.Char(
+        'Import Fingerprint',
+        readonly=True,
+        copy=False,
+        help="Hash van de laatst geïmporteerde CSV waarden - ongewijzigde rijen worden overgeslagen"
+    )
+    
+    # Run stamp: de import (history) die deze regel het laatst geschreven/bevestigd heeft
+    import_history_id = fields.Many2one(
+        'supplier.import.history',
+        'Laatste Import Run',
+        readonly=True,
+        copy=False,
+        index=True,
+        ondelete='set null',
+        help="Import run die deze regel het laatst aangeraakt heeft - regels zonder stempel van de huidige run zijn verouderd"
+    )
+    
     # Price history voor autopublisher
     previous_price = fields.Float(
         'Vorige Prijs',
@@ -33,6 +52,12 @@ class ProductSupplierinfo(models.Model):
         help="Percentage wijziging t.o.v. vorige prijs (negatief = daling)"
     )
     
+    def write(self, vals):
+        # Handmatige wijziging → fingerprint ongeldig, volgende import schrijft de regel opnieuw
+        if 'import_fingerprint' not in vals:
+            vals = dict(vals, import_fingerprint=False)
+        return super().write(vals)
+    
     def _compute_price_change(self):
         """Bereken prijswijziging percentage voor autopublisher"""
         for record in self:
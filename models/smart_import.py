@@ -12,8 +12,13 @@ import io
 import json
 import logging
 
+from .mapping_plan import apply_mapping_plan, compile_mapping_plan
+
 _logger = logging.getLogger(__name__)
 
+# Supplierinfo velden die de smart import direct overneemt
+SMART_SUPPLIER_FIELDS = ('price', 'min_qty', 'delay', 'product_name', 'product_code')
+
 
 class SmartImport(models.TransientModel):
     """
@@ -363,6 +368,18 @@ class SmartImport(models.TransientModel):
             
             _logger.info(f"Starting import with mapping: {field_mapping}")
             
+            # Compile supplier field conversions once (shared mapping plan, no per-cell logging)
+            plan_headers = [str(idx) for idx in range(max(field_mapping) + 1)]
+            plan = compile_mapping_plan(self.env, {
+                str(csv_index): f'supplierinfo.{odoo_field}'
+                for csv_index, odoo_field in field_mapping.items()
+                if odoo_field in SMART_SUPPLIER_FIELDS
+            }, plan_headers)
+            product_mapping = {
+                csv_index: odoo_field for csv_index, odoo_field in field_mapping.items()
+                if odoo_field.startswith('product__')
+            }
+            
             # Process CSV rows
             imported_count = 0
             error_count = 0
@@ -375,22 +392,13 @@ class SmartImport(models.TransientModel):
                         'partner_id': self.supplier_id.id,  # Always set supplier
                     }
                     
-                    _logger.info(f"Processing row {row_num}: {row}")
-                    
-                    for csv_index, odoo_field in field_mapping.items():
+                    for csv_index, odoo_field in product_mapping.items():
                         if csv_index < len(row) and row[csv_index].strip():
-                            csv_value = row[csv_index].strip()
-                            _logger.info(f"Mapping CSV column {csv_index} ('{csv_value}') to field '{odoo_field}'")
-                            
-                            # Handle different field types
-                            if odoo_field.startswith('product__'):
-                                # Product field - we need to find/create product mapping
-                                self._handle_product_field(odoo_field, csv_value, values)
-                            else:
-                                # Direct supplier info field
-                                self._handle_supplier_field(odoo_field, csv_value, values)
+                            # Product field - we need to find/create product mapping
+                            self._handle_product_field(odoo_field, row[csv_index].strip(), values)
                     
-                    _logger.info(f"Final values for row {row_num}: {values}")
+                    # Direct supplier info fields
+                    values.update(apply_mapping_plan(plan, row)['supplierinfo_fields'])
                     
                     # Only create record if we have essential data
                     if 'product_tmpl_id' in values or 'product_id' in values:
@@ -483,26 +491,6 @@ class SmartImport(models.TransientModel):
             else:
                 _logger.warning(f"No product found with name: '{csv_value}'")
     
-    def _handle_supplier_field(self, odoo_field, csv_value, values):
-        """Handle supplier info fields"""
-        if odoo_field == 'price':
-            try:
-                values['price'] = float(csv_value.replace(',', '.'))
-            except ValueError:
-                pass  # Skip invalid price values
-        elif odoo_field == 'min_qty':
-            try:
-                values['min_qty'] = float(csv_value.replace(',', '.'))
-            except ValueError:
-                pass
-        elif odoo_field == 'delay':
-            try:
-                values['delay'] = int(csv_value)
-            except ValueError:
-                pass
-        elif odoo_field in ['product_name', 'product_code']:
-            values[odoo_field] = csv_value
-    
     def _old_import_method_backup(self):
         """OLD METHOD - NIET GEBRUIKEN! Backup only. Use action_import_data() instead."""
         if not self.mapping_data:
@@ -1,2 +1,4 @@
 # -*- coding: utf-8 -*-
 from . import test_basic
+from . import test_bulk_import
+from . import test_import_queue
@@ -4,7 +4,14 @@ Tests for Bulk Import Functionality
 Tests the new optimized import flow with pre-scan, bulk updates, and cleanup
 """
 from odoo.tests.common import TransactionCase
+from unittest.mock import patch
 import base64
+import json
+
+from odoo.addons.product_supplier_sync.models.import_stream import Base64ChunkReader, iter_csv_dicts
+from odoo.addons.product_supplier_sync.models.mapping_plan import (
+    Many2oneResolver, apply_mapping_plan, compile_mapping_plan, prefetch_mapping_plan,
+)
 
 
 class TestBulkImport(TransactionCase):
@@ -56,6 +63,11 @@ class TestBulkImport(TransactionCase):
         # Product 6-10 have NO supplierinfo from supplier A (for testing creates)
         # Product 11 will be created later (archived)
         # Product 12 will be in CSV but not in DB (for testing errors)
+        
+        # Commits in the import engine would end the test transaction
+        patcher = patch.object(self.env.cr, 'commit', lambda: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def _create_csv(self, rows):
         """Helper to create CSV file from row data"""
@@ -458,3 +470,589 @@ class TestBulkImport(TransactionCase):
             ('partner_id', '=', self.supplier_a.id)
         ])
         self.assertEqual(final_count, 6, "Should end with 6 supplierinfo (3 updated + 3 created)")
+
+    def _create_wizard(self, rows, **extra):
+        """Helper to create a direct import wizard for supplier A"""
+        vals = {
+            'supplier_id': self.supplier_a.id,
+            'csv_file': self._create_csv(rows),
+            'csv_filename': 'test.csv',
+            'csv_separator': ';',
+            'encoding': 'utf-8',
+        }
+        vals.update(extra)
+        return self.env['supplier.direct.import'].create(vals)
+
+    def _create_history(self, mapping=None):
+        """Helper to create the history record (run stamp) of an import for supplier A"""
+        vals = {
+            'supplier_id': self.supplier_a.id,
+            'import_file_name': 'test.csv',
+            'state': 'running',
+        }
+        if mapping:
+            # De resolve cron en product creatie lezen de mapping van de history
+            vals['mapping_data'] = json.dumps(mapping)
+        return self.env['supplier.import.history'].create(vals)
+
+    def _mapping(self):
+        return {
+            'EAN': 'product.barcode',
+            'Price': 'supplierinfo.price',
+            'Stock': 'supplierinfo.supplier_stock',
+        }
+
+    def _prescan(self, rows, mapping=None, history=None, **extra):
+        """Helper to create a wizard for the rows and prescan them; returns (wizard, prescan_data)"""
+        wizard = self._create_wizard(rows, **extra)
+        prescan_data = wizard._prescan_csv_and_prepare(mapping or self._mapping(), run_id=history.id if history else None)
+        return wizard, prescan_data
+
+    def _run_import(self, rows, mapping=None, history=None, **extra):
+        """Helper to run prescan and write steps; error records are written when a history is given"""
+        mapping = mapping or self._mapping()
+        wizard, prescan_data = self._prescan(rows, mapping, history, **extra)
+        wizard._run_write_steps(prescan_data, mapping)
+        if history:
+            wizard._create_error_records(history.id, prescan_data['error_rows'])
+        return wizard, prescan_data
+
+    def _template_supplierinfo(self, ean, price):
+        """Helper to create the template-level supplierinfo of supplier A (the line imports write)"""
+        return self.env['product.supplierinfo'].create({
+            'partner_id': self.supplier_a.id,
+            'product_tmpl_id': self.products[ean].product_tmpl_id.id,
+            'price': price,
+        })
+
+    def _find_supplierinfo(self, product):
+        """Helper to find the template-level supplierinfo of supplier A for a product"""
+        return self.env['product.supplierinfo'].search([
+            ('partner_id', '=', self.supplier_a.id),
+            ('product_tmpl_id', '=', product.product_tmpl_id.id),
+            ('product_id', '=', False),
+        ])
+
+    def test_11_base64_chunk_reader_streams_payload(self):
+        """Test that chunked base64 decoding yields the same rows as a full decode"""
+        content = 'EAN;Price\n' + ''.join(f'{i};{i}.5\n' for i in range(2000))
+        payload = base64.encodebytes(content.encode('utf-8'))  # with newlines
+        reader = Base64ChunkReader(payload, chunk_size=100)
+        self.assertEqual(reader.read(), content.encode('utf-8'))
+        
+        rows = list(iter_csv_dicts(Base64ChunkReader(payload, chunk_size=99), 'utf-8', ';'))
+        self.assertEqual(len(rows), 2000)
+        self.assertEqual(rows[0], (2, {'EAN': '0', 'Price': '0.5'}))
+
+    def test_12_streaming_prescan_classifies_rows(self):
+        """Test that the streaming prescan classifies updates, creates and errors"""
+        rows = [
+            {'ean': '5000000000001', 'price': 25.0, 'stock': 10},
+            {'ean': '5000000000006', 'price': 26.0, 'stock': 10},
+            {'ean': '9999999999999', 'price': 99.0, 'stock': 10, 'brand': 'NewBrand', 'name': 'Unknown'},
+            {'ean': '', 'price': 1.0, 'stock': 10},
+        ]
+        wizard, prescan_data = self._prescan(rows)
+        
+        self.assertIn('5000000000001', prescan_data['update_codes'])
+        self.assertIn('5000000000006', prescan_data['update_codes'])
+        self.assertIn('9999999999999', prescan_data['create_codes'])
+        self.assertEqual(len(prescan_data['error_rows']), 1)
+        
+        unknown = prescan_data['create_codes']['9999999999999']
+        self.assertEqual(unknown['_csv_brand'], 'NewBrand')
+        self.assertEqual(unknown['_csv_product_name'], 'Unknown')
+        self.assertEqual(unknown['_csv_row'][0], '9999999999999', "Raw cells are kept for the error record")
+        self.assertNotIn('_csv_row', prescan_data['update_codes']['5000000000001'], "Raw CSV row of known products is not kept")
+        self.assertEqual(wizard._count_csv_rows(), 4)
+
+    def test_13_sql_upsert_updates_and_creates(self):
+        """Test that the SQL upsert engine keeps counts and previous_price semantics"""
+        template_si = self._template_supplierinfo('5000000000001', 10.0)
+        rows = [
+            {'ean': '5000000000001', 'price': 8.0, 'stock': 3},
+            {'ean': '5000000000006', 'price': 6.0, 'stock': 4},
+            {'ean': '9999999999999', 'price': 9.0, 'stock': 5},
+        ]
+        mapping = self._mapping()
+        wizard, prescan_data = self._prescan(rows, use_sql_upsert=True)
+        updated = wizard._bulk_update_supplierinfo(prescan_data, mapping)
+        created = wizard._bulk_create_supplierinfo(prescan_data, mapping)
+        
+        self.assertEqual(updated, 2, "Both known products count as updates")
+        self.assertEqual(created, 0, "Unknown EAN cannot be created")
+        self.assertEqual(len(prescan_data['error_rows']), 1)
+        
+        self.assertEqual(template_si.price, 8.0)
+        self.assertEqual(template_si.previous_price, 10.0)
+        self.assertEqual(template_si.supplier_stock, 3.0)
+        self.assertTrue(template_si.last_sync_date)
+        
+        new_si = self._find_supplierinfo(self.products['5000000000006'])
+        self.assertEqual(len(new_si), 1)
+        self.assertEqual(new_si.price, 6.0)
+        self.assertEqual(new_si.previous_price, 0.0)
+
+    def test_14_supplierinfo_map_drives_update(self):
+        """Test that repeated updates resolve against the per-import supplierinfo map"""
+        rows = [
+            {'ean': '5000000000003', 'price': 30.0, 'stock': 1},
+            {'ean': '5000000000004', 'price': 40.0, 'stock': 1},
+        ]
+        mapping = self._mapping()
+        wizard, prescan_data = self._prescan(rows)
+        self.assertEqual(len(prescan_data['supplierinfo_map']), 5, "All 5 templates of supplier A are loaded")
+        
+        self.assertEqual(wizard._bulk_update_supplierinfo(prescan_data, mapping), 2)
+        # Second run resolves against the map: template-level record is written, not duplicated
+        self.assertEqual(wizard._bulk_update_supplierinfo(prescan_data, mapping), 2)
+        
+        template_si = self._find_supplierinfo(self.products['5000000000003'])
+        self.assertEqual(len(template_si), 1)
+        self.assertEqual(template_si.price, 30.0)
+        self.assertEqual(template_si.previous_price, 30.0)
+
+    def test_15_create_step_resolves_batch_once(self):
+        """Test that create candidates are re-resolved per batch, including products created after prescan"""
+        rows = [
+            {'ean': '8000000000001', 'price': 11.0, 'stock': 1},
+            {'ean': '8000000000002', 'price': 12.0, 'stock': 1, 'brand': 'LateBrand'},
+        ]
+        wizard, prescan_data = self._prescan(rows)
+        self.assertEqual(len(prescan_data['create_codes']), 2)
+        
+        late_product = self.env['product.product'].create({
+            'name': 'Late Product',
+            'barcode': '8000000000001',
+        })
+        created = wizard._bulk_create_supplierinfo(prescan_data, self._mapping())
+        
+        self.assertEqual(created, 1)
+        self.assertEqual(len(prescan_data['error_rows']), 1)
+        self.assertEqual(prescan_data['error_rows'][0]['barcode'], '8000000000002')
+        self.assertEqual(prescan_data['error_rows'][0]['brand'], 'LateBrand')
+        self.assertTrue(self._find_supplierinfo(late_product))
+
+    def test_16_compiled_mapping_plan(self):
+        """Test that the compiled plan converts cells by field type without per-cell lookups"""
+        headers = ['EAN', 'Price', 'Stock', 'Delay', 'Unknown']
+        mapping = {
+            'EAN': 'product.barcode',
+            'Price': 'supplierinfo.price',
+            'Delay': 'supplierinfo.delay',
+            'Missing': 'supplierinfo.min_qty',
+            'Unknown': 'other.field',
+        }
+        plan = compile_mapping_plan(self.env, mapping, headers)
+        self.assertEqual([(idx, bucket, fname) for idx, bucket, fname, _conv in plan], [
+            (0, 'product_fields', 'barcode'),
+            (1, 'supplierinfo_fields', 'price'),
+            (3, 'supplierinfo_fields', 'delay'),
+        ])
+        
+        row_data = apply_mapping_plan(plan, [' 5000000000001 ', '12,50', '7', 'x'])
+        self.assertEqual(row_data['product_fields'], {'barcode': '5000000000001'})
+        # Invalid numbers are skipped instead of written as 0
+        self.assertEqual(row_data['supplierinfo_fields'], {'price': 12.5})
+        
+        # Short rows, empty cells and unparsable prices are skipped
+        self.assertEqual(apply_mapping_plan(plan, ['', 'abc'])['supplierinfo_fields'], {})
+        self.assertEqual(apply_mapping_plan(plan, ['', '0', '', '3'])['supplierinfo_fields'], {'price': 0.0, 'delay': 3})
+
+    def test_17_many2one_resolver_is_memoised(self):
+        """Test that many2one cells are resolved once per distinct value"""
+        category = self.env['product.category'].create({'name': 'Resolver Category'})
+        plan = compile_mapping_plan(self.env, {'Cat': 'product.categ_id'}, ['Cat'], self.supplier_a.id)
+        resolver = plan[0][3]
+        self.assertIsInstance(resolver, Many2oneResolver)
+        
+        rows = [['Resolver Category'], ['Resolver Category'], ['Nope'], [str(category.id)]]
+        prefetch_mapping_plan(plan, rows)
+        self.assertEqual(resolver.cache, {'Resolver Category': category.id, 'Nope': False})
+        
+        with self.assertQueryCount(0):
+            values = [apply_mapping_plan(plan, row)['product_fields'].get('categ_id') for row in rows]
+        self.assertEqual(values, [category.id, category.id, False, category.id])
+
+    def test_18_brand_mapping_bulk_lookup(self):
+        """Test that brand mappings resolve in bulk and case-insensitive"""
+        if 'product.brand' not in self.env:
+            self.skipTest('product.brand model not installed')
+        brand = self.env['product.brand'].create({'name': 'Mapped Brand'})
+        BrandMapping = self.env['supplier.brand.mapping']
+        BrandMapping.create({
+            'supplier_id': self.supplier_a.id,
+            'csv_brand_name': 'MAPPED',
+            'odoo_brand_id': brand.id,
+        })
+        
+        result = BrandMapping.get_mapped_brands(self.supplier_a.id, ['mapped', ' Mapped ', 'Other', ''])
+        self.assertEqual(result['mapped'], brand)
+        self.assertEqual(result[' Mapped '], brand)
+        self.assertFalse(result['Other'])
+        self.assertNotIn('', result)
+
+    def test_19_unchanged_rows_skip_write_steps(self):
+        """Test that rows with the same fingerprint as the last import are only touched"""
+        rows = [
+            {'ean': '5000000000006', 'price': 16.0, 'stock': 2},
+            {'ean': '5000000000007', 'price': 17.0, 'stock': 2},
+        ]
+        self._run_import(rows)
+        si_6 = self._find_supplierinfo(self.products['5000000000006'])
+        write_date = si_6.write_date
+        
+        # Same feed again, only row 7 changed
+        rows[1]['price'] = 18.0
+        wizard, prescan_data = self._prescan(rows)
+        self.assertEqual(list(prescan_data['unchanged']), ['5000000000006'])
+        self.assertEqual(list(prescan_data['update_codes']), ['5000000000007'])
+        
+        self.assertEqual(wizard._touch_unchanged_supplierinfo(prescan_data), 1)
+        self.assertEqual(si_6.write_date, write_date)
+        self.assertEqual(si_6.previous_price, 16.0)
+
+    def test_20_write_steps_checkpoint_and_resume(self):
+        """Test that write steps checkpoint per window and resume after last_processed_row"""
+        rows = [
+            {'ean': '5000000000006', 'price': 16.0, 'stock': 1},   # row 2
+            {'ean': '5000000000007', 'price': 17.0, 'stock': 1},   # row 3
+            {'ean': '9999999999999', 'price': 99.0, 'stock': 1},   # row 4
+        ]
+        checkpoints = []
+        wizard, prescan_data = self._prescan(rows)
+        
+        with patch('odoo.addons.product_supplier_sync.models.import_engine.CHECKPOINT_WINDOW_ROWS', 1):
+            updated, created = wizard._run_write_steps(
+                prescan_data, self._mapping(), resume_row=2,
+                on_checkpoint=lambda row, upd, cre: checkpoints.append((row, upd, cre)),
+            )
+        
+        self.assertEqual((updated, created), (1, 0), "Row 2 was committed before the restart")
+        self.assertEqual(checkpoints, [(3, 1, 0), (4, 1, 0)])
+        self.assertEqual(len(prescan_data['error_rows']), 1, "Unknown EAN is still reported")
+        self.assertFalse(self._find_supplierinfo(self.products['5000000000006']))
+
+    def test_21_cleanup_archives_orphans_set_based(self):
+        """Test that cleanup deletes stale lines in bulk and archives only templates left without sellers"""
+        shared = self.products['5000000000001']
+        self.env['product.supplierinfo'].create({
+            'partner_id': self.supplier_b.id,
+            'product_tmpl_id': shared.product_tmpl_id.id,
+            'price': 15.0,
+        })
+        history = self._create_history()
+        wizard, _prescan_data = self._run_import([{'ean': '5000000000003', 'price': 30.0, 'stock': 1}], history=history)
+        cleanup_stats = wizard._cleanup_stale_supplierinfo(history.id)
+        archived_ids = wizard._archive_products_without_suppliers(cleanup_stats['template_ids'])
+        
+        self.assertEqual(cleanup_stats['removed'], 4)
+        self.assertEqual(len(archived_ids), 3)
+        self.assertTrue(shared.product_tmpl_id.active, "Supplier B still sells this product")
+        for ean in ('5000000000002', '5000000000004', '5000000000005'):
+            self.assertFalse(self.products[ean].product_tmpl_id.active)
+        self.assertTrue(self.products['5000000000003'].product_tmpl_id.active)
+        # Scoped: products without suppliers that this import never touched stay as they are
+        for i in range(6, 11):
+            self.assertTrue(self.products[f'500000000000{i:1d}'].product_tmpl_id.active)
+
+    def test_22_run_stamp_drives_cleanup(self):
+        """Test that every touched supplierinfo gets the run stamp and untouched lines are stale"""
+        rows = [
+            {'ean': '5000000000003', 'price': 30.0, 'stock': 1},   # update
+            {'ean': '5000000000006', 'price': 16.0, 'stock': 1},   # create
+        ]
+        self._run_import(rows, history=self._create_history())
+        # Same feed again: rows are unchanged and only get the new stamp
+        second = self._create_history()
+        wizard, prescan_data = self._run_import(rows, history=second)
+        self.assertEqual(len(prescan_data['unchanged']), 2)
+        
+        stamped = self.env['product.supplierinfo'].search([('import_history_id', '=', second.id)])
+        self.assertEqual(
+            set(stamped.mapped('product_tmpl_id.id')),
+            {self.products[ean].product_tmpl_id.id for ean in ('5000000000003', '5000000000006')},
+        )
+        self.assertEqual(wizard._cleanup_stale_supplierinfo(second.id)['removed'], 4, "Products 1, 2, 4 and 5")
+
+    def test_23_error_records_are_written_in_bulk(self):
+        """Test that error rows are copied in batches with the full CSV row as compact JSON"""
+        rows = [{'ean': f'99000000000{i:02d}', 'price': 5.0, 'stock': 1, 'name': f'Nieuw {i}'} for i in range(5)]
+        rows.append({'ean': '', 'price': 1.0, 'stock': 1})
+        history = self._create_history()
+        wizard, prescan_data = self._run_import(rows)
+        
+        with patch('odoo.addons.product_supplier_sync.models.import_engine.ERROR_BATCH_SIZE', 2):
+            created = wizard._create_error_records(history.id, prescan_data['error_rows'])
+        
+        self.assertEqual(created, 6)
+        errors = history.error_line_ids
+        self.assertEqual(len(errors), 6)
+        missing = errors.filtered(lambda e: e.barcode == '9900000000003')
+        self.assertEqual(missing.error_type, 'product_not_found')
+        self.assertEqual(missing.product_name, 'Nieuw 3')
+        self.assertEqual(missing.csv_data, '{"EAN":"9900000000003","SKU":"","Price":"5.0","Stock":"1","Brand":"","Name":"Nieuw 3"}')
+        self.assertEqual(errors.filtered(lambda e: not e.barcode).error_type, 'invalid_data')
+        # ORM defaults and computed fields apply to the raw INSERT, empty cells are NULL
+        self.assertFalse(any(errors.mapped('resolved')))
+        self.assertFalse(missing.brand)
+        self.env.cr.execute("SELECT count(*) FROM supplier_import_error WHERE id IN %s AND brand = ''", (tuple(errors.ids),))
+        self.assertEqual(self.env.cr.fetchone()[0], 0, "Missing values are stored as NULL, not ''")
+
+    def test_24_missing_products_are_deduplicated_across_imports(self):
+        """Test that unknown products are upserted once per supplier and key, counting the imports"""
+        for price in (5.0, 6.0):
+            rows = [
+                {'ean': '9900000000001', 'price': price, 'stock': 1, 'name': 'Nieuw'},
+                {'ean': '9900000000001', 'price': price, 'stock': 1, 'name': 'Nieuw'},  # same feed twice
+                {'ean': '9900000000002', 'price': price, 'stock': 1},
+            ]
+            history = self._create_history()
+            self._run_import(rows, history=history)
+        
+        missing = self.env['supplier.missing.product'].search([('supplier_id', '=', self.supplier_a.id)])
+        self.assertEqual(sorted(missing.mapped('product_key')), ['9900000000001', '9900000000002'])
+        first = missing.filtered(lambda m: m.product_key == '9900000000001')
+        self.assertEqual(first.occurrence_count, 2)
+        self.assertEqual(first.product_name, 'Nieuw')
+        self.assertEqual(first.last_history_id, history)
+        self.assertIn('"Price":"6.0"', first.csv_data, "Latest CSV row is kept")
+        self.assertLessEqual(first.first_seen, first.last_seen)
+        
+        first.action_mark_resolved()
+        self.assertTrue(first.resolved)
+
+    def test_25_resolve_missing_products_and_replay(self):
+        """Test that missing products are resolved set-based once the product exists and replayed as supplierinfo"""
+        rows = [
+            {'ean': '9900000000001', 'price': 7.5, 'stock': 3},
+            {'ean': '9900000000002', 'price': 8.0, 'stock': 1},
+        ]
+        history = self._create_history(self._mapping())
+        self._run_import(rows, history=history)
+        MissingProduct = self.env['supplier.missing.product']
+        
+        product = self.env['product.product'].create({'name': 'Eindelijk', 'barcode': '9900000000001'})
+        result = MissingProduct._cron_resolve_missing_products()
+        
+        self.assertEqual(result, {'resolved': 1, 'errors_resolved': 1, 'replayed': 1})
+        found = MissingProduct.search([('product_key', '=', '9900000000001')])
+        self.assertTrue(found.resolved)
+        self.assertEqual(found.product_id, product)
+        self.assertFalse(MissingProduct.search([('product_key', '=', '9900000000002')]).resolved)
+        self.assertTrue(history.error_line_ids.filtered(lambda e: e.barcode == '9900000000001').resolved)
+        
+        seller = self._find_supplierinfo(product)
+        self.assertEqual(len(seller), 1)
+        self.assertEqual(seller.price, 7.5)
+        self.assertEqual(seller.import_history_id, history)
+
+    def test_26_bulk_product_creation_from_errors(self):
+        """Test that a history run creates its missing products and supplierinfo in batches, one per key"""
+        mapping = dict(self._mapping(), Name='product.name')
+        rows = [{'ean': f'99100000000{i:02d}', 'price': 4.0 + i, 'stock': 2, 'name': f'Nieuw {i}'} for i in range(5)]
+        rows.append({'ean': '9910000000000', 'price': 4.0, 'stock': 2, 'name': 'Nieuw 0'})  # duplicate key
+        history = self._create_history(mapping)
+        existing = self.env['product.product'].create({'name': 'Bestaat al', 'barcode': '9910000000004'})
+        self._run_import(rows, mapping, history)
+        errors = history.error_line_ids
+        self.assertEqual(len(errors), 4, "9910000000004 exists and the duplicate row shares a key")
+        
+        with patch('odoo.addons.product_supplier_sync.models.import_error_extend.PRODUCT_CREATE_BATCH_SIZE', 2):
+            result = errors._create_products_bulk()
+        
+        self.assertEqual(result, {'created': 4, 'linked': 0, 'skipped': 0, 'failed': 0})
+        self.assertTrue(all(errors.mapped('resolved')))
+        product = self.env['product.product'].search([('barcode', '=', '9910000000002')])
+        self.assertEqual(product.name, 'Nieuw 2')
+        self.assertEqual(errors.filtered(lambda e: e.barcode == '9910000000002').product_id, product)
+        seller = product.product_tmpl_id.seller_ids.filtered(lambda s: s.partner_id == self.supplier_a)
+        self.assertEqual(seller.price, 6.0)
+        self.assertEqual(seller.import_history_id, history)
+        self.assertEqual(self.env['product.product'].search_count([('barcode', '=', '9910000000000')]), 1)
+        self.assertTrue(self.env['supplier.missing.product'].search([('product_key', '=', '9910000000002')]).resolved)
+        self.assertTrue(existing.product_tmpl_id.seller_ids, "Existing product was matched by the import itself")
+
+    def test_27_sql_upsert_stages_empty_cells_as_null(self):
+        """Test that empty price cells reach the staging table as NULL (price kept / defaulted)"""
+        template_si = self._template_supplierinfo('5000000000001', 10.0)
+        rows = [
+            {'ean': '5000000000001', 'price': '', 'stock': 3},
+            {'ean': '5000000000006', 'price': '', 'stock': 4},
+            {'ean': '5000000000007', 'price': 7.0, 'stock': ''},
+        ]
+        wizard, prescan_data = self._prescan(rows, use_sql_upsert=True)
+        updated = wizard._bulk_update_supplierinfo(prescan_data, self._mapping())
+        
+        self.assertEqual(updated, 3)
+        self.assertEqual(template_si.price, 10.0, "Empty price cell keeps the existing price")
+        self.assertEqual(template_si.supplier_stock, 3.0)
+        new_si = self._find_supplierinfo(self.products['5000000000006'])
+        self.assertEqual(new_si.price, 0.0)
+        self.assertEqual(new_si.supplier_stock, 4.0)
+
+    def test_28_failed_replay_keeps_missing_product_open(self):
+        """Test that a missing product is only marked resolved after its supplierinfo replay succeeded"""
+        self._run_import([{'ean': '9920000000001', 'price': 3.0, 'stock': 1}], history=self._create_history(self._mapping()))
+        product = self.env['product.product'].create({'name': 'Later', 'barcode': '9920000000001'})
+        MissingProduct = self.env['supplier.missing.product']
+        Engine = type(self.env['supplier.import.engine'])
+        
+        with patch.object(Engine, '_sql_stage_supplierinfo', side_effect=ValueError('boom')):
+            result = MissingProduct._cron_resolve_missing_products()
+        self.assertEqual(result, {'resolved': 0, 'errors_resolved': 1, 'replayed': 0})
+        missing = MissingProduct.search([('product_key', '=', '9920000000001')])
+        self.assertFalse(missing.resolved, "Failed replay leaves the row open for the next run")
+        
+        result = MissingProduct._cron_resolve_missing_products()
+        
+        self.assertEqual(result, {'resolved': 1, 'errors_resolved': 0, 'replayed': 1})
+        self.assertTrue(missing.resolved)
+        self.assertEqual(self._find_supplierinfo(product).price, 3.0)
+
+    def test_29_bulk_product_creation_without_price(self):
+        """Test that products created without a mapped price get no seller"""
+        mapping = dict(self._mapping(), Name='product.name')
+        rows = [
+            {'ean': '9930000000001', 'price': '', 'stock': 2, 'name': 'Zonder prijs'},
+            {'ean': '9930000000002', 'price': 'n.v.t.', 'stock': 2, 'name': 'Ongeldige prijs'},
+        ]
+        history = self._create_history(mapping)
+        self._run_import(rows, mapping, history)
+        
+        result = history.error_line_ids._create_products_bulk()
+        
+        self.assertEqual(result, {'created': 2, 'linked': 0, 'skipped': 0, 'failed': 0})
+        for barcode in ('9930000000001', '9930000000002'):
+            product = self.env['product.product'].search([('barcode', '=', barcode)])
+            self.assertTrue(product)
+            self.assertFalse(product.product_tmpl_id.seller_ids, "No seller with price 0 without a mapped price")
+
+    def test_30_resumed_import_does_not_count_written_rows_as_unchanged(self):
+        """Test that rows updated before a resume are not counted again as unchanged"""
+        rows = [
+            {'ean': '5000000000006', 'price': 16.0, 'stock': 2},
+            {'ean': '5000000000007', 'price': 17.0, 'stock': 2},
+            {'ean': '5000000000008', 'price': 18.0, 'stock': 2},
+        ]
+        wizard = self._create_wizard(rows)
+        history = self._create_history()
+        mapping = self._mapping()
+        
+        with patch('odoo.addons.product_supplier_sync.models.import_engine.CHECKPOINT_WINDOW_ROWS', 1):
+            self.assertIsNone(wizard._run_bulk_import(mapping, history, deadline=1), "Paused after the first window")
+            self.assertEqual((history.last_processed_row, history.updated_count), (2, 1), "Data rows start at row 2")
+            stats, _cleanup_stats, _archived_ids = wizard._run_bulk_import(mapping, history, history.last_processed_row)
+        
+        self.assertEqual((stats['total'], stats['updated'], stats['unchanged']), (3, 3, 0))
+
+    def test_31_replay_never_overwrites_a_newer_import(self):
+        """Test that the resolve cron does not replay an old CSV row over the seller of a newer import"""
+        self._run_import([{'ean': '9940000000001', 'price': 7.5, 'stock': 3}], history=self._create_history(self._mapping()))
+        product = self.env['product.product'].create({'name': 'Nieuwer', 'barcode': '9940000000001'})
+        new_history = self._create_history()
+        self._run_import([{'ean': '9940000000001', 'price': 9.0, 'stock': 3}], history=new_history)
+        
+        result = self.env['supplier.missing.product']._cron_resolve_missing_products()
+        
+        self.assertEqual((result['resolved'], result['replayed']), (1, 0))
+        seller = product.product_tmpl_id.seller_ids.filtered(lambda s: s.partner_id == self.supplier_a)
+        self.assertEqual(len(seller), 1)
+        self.assertEqual(seller.price, 9.0, "Price of the newer import is kept")
+        self.assertEqual(seller.import_history_id, new_history)
+
+    def test_32_failed_supplierinfo_create_is_not_counted(self):
+        """Test that rows whose staged supplierinfo create fails count as errors only"""
+        rows = [
+            {'ean': '5000000000001', 'price': 21.0, 'stock': 2},
+            {'ean': '5000000000006', 'price': 26.0, 'stock': 2},
+        ]
+        # Template-level regel voor product 1 (write), product 6 heeft er geen (staged create)
+        self._template_supplierinfo('5000000000001', 11.0)
+        wizard, prescan_data = self._prescan(rows)
+        
+        with patch.object(type(self.env['product.supplierinfo']), 'create', side_effect=ValueError('boom')):
+            updated_count = wizard._bulk_update_supplierinfo(prescan_data, self._mapping())
+        
+        self.assertEqual(updated_count, 1, "Only the written supplierinfo counts as updated")
+        self.assertEqual([error['row'] for error in prescan_data['error_rows']], [3])
+
+    def test_33_cleanup_removes_lines_not_stamped_by_the_run(self):
+        """Test that cleanup removes the supplierinfo of supplier A that this run did not touch"""
+        rows = [
+            {'ean': '5000000000003', 'price': 30.0, 'stock': 1},
+            {'ean': '5000000000004', 'price': 40.0, 'stock': 1},
+        ]
+        history = self._create_history()
+        wizard, _prescan_data = self._run_import(rows, history=history)
+        
+        cleanup_stats = wizard._cleanup_stale_supplierinfo(history.id)
+        
+        self.assertEqual(cleanup_stats['removed'], 3, "Products 1, 2 and 5 are not stamped by this run")
+
+    def test_34_brand_mapping_cache_is_cleared_on_change(self):
+        """Test that cached brand lookups need no query and see created or removed mappings"""
+        if 'product.brand' not in self.env:
+            self.skipTest('product.brand model not installed')
+        brand = self.env['product.brand'].create({'name': 'Mapped Brand'})
+        BrandMapping = self.env['supplier.brand.mapping']
+        BrandMapping.create({
+            'supplier_id': self.supplier_a.id,
+            'csv_brand_name': 'MAPPED',
+            'odoo_brand_id': brand.id,
+        })
+        BrandMapping.get_mapped_brand(self.supplier_a.id, 'Mapped')
+        
+        # Cached map: no query per lookup
+        with self.assertQueryCount(0):
+            self.assertEqual(BrandMapping.get_mapped_brand(self.supplier_a.id, 'Mapped'), brand)
+        
+        other = self.env['product.brand'].create({'name': 'Other Brand'})
+        mapping = BrandMapping.create({
+            'supplier_id': self.supplier_a.id,
+            'csv_brand_name': 'Other',
+            'odoo_brand_id': other.id,
+        })
+        self.assertEqual(BrandMapping.get_mapped_brand(self.supplier_a.id, 'other'), other)
+        mapping.unlink()
+        self.assertFalse(BrandMapping.get_mapped_brand(self.supplier_a.id, 'other'))
+
+    def test_35_manual_edit_invalidates_fingerprint(self):
+        """Test that a supplierinfo edited by hand is written again by the next identical feed"""
+        rows = [{'ean': '5000000000006', 'price': 16.0, 'stock': 2}]
+        self._run_import(rows)
+        self._find_supplierinfo(self.products['5000000000006']).write({'price': 15.0})
+        
+        _wizard, prescan_data = self._prescan(rows)
+        
+        self.assertIn('5000000000006', prescan_data['update_codes'])
+
+    def test_36_resume_after_last_row_only_reports_errors(self):
+        """Test that resuming after the last row writes nothing but still reports skipped create rows"""
+        rows = [
+            {'ean': '5000000000006', 'price': 16.0, 'stock': 1},   # row 2
+            {'ean': '9999999999999', 'price': 99.0, 'stock': 1},   # row 3
+        ]
+        wizard, prescan_data = self._prescan(rows)
+        
+        self.assertEqual(wizard._run_write_steps(prescan_data, self._mapping(), resume_row=3), (0, 0))
+        self.assertEqual(len(prescan_data['error_rows']), 1)
+
+    def test_37_run_without_stamps_never_wipes_the_supplier(self):
+        """Test that cleanup of a run that stamped nothing removes no supplierinfo"""
+        wizard = self._create_wizard([])
+        
+        self.assertEqual(wizard._cleanup_stale_supplierinfo(self._create_history().id)['removed'], 0)
+
+    def test_38_failed_product_creation_stays_open(self):
+        """Test that error rows of a failed product creation batch stay unresolved"""
+        mapping = dict(self._mapping(), Name='product.name')
+        history = self._create_history(mapping)
+        self._run_import([{'ean': '9930000000003', 'price': 2.5, 'stock': 2, 'name': 'Mislukt'}], mapping, history)
+        errors = history.error_line_ids
+        
+        with patch.object(type(errors), '_create_products_batch', side_effect=ValueError('boom')):
+            result = errors._create_products_bulk()
+        
+        self.assertEqual(result, {'created': 0, 'linked': 0, 'skipped': 0, 'failed': 1})
+        self.assertFalse(errors.resolved, "Failed rows stay open")
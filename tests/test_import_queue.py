@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the background import queue (claiming, scheduling, recovery)
+"""
+from odoo.tests.common import TransactionCase
+from odoo.exceptions import UserError
+from unittest.mock import patch
+import base64
+
+
+class TestImportQueue(TransactionCase):
+    """Test supplier.import.queue processing"""
+
+    def setUp(self):
+        super(TestImportQueue, self).setUp()
+        
+        self.supplier_a = self.env['res.partner'].create({
+            'name': 'Queue Supplier A',
+            'supplier_rank': 1,
+            'is_company': True,
+        })
+        self.supplier_b = self.env['res.partner'].create({
+            'name': 'Queue Supplier B',
+            'supplier_rank': 1,
+            'is_company': True,
+        })
+        self.Queue = self.env['supplier.import.queue']
+        # Commits in queue code would end the test transaction
+        patcher = patch.object(self.env.cr, 'commit', lambda: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _queue(self, supplier, rows=None, **extra):
+        """Helper to queue an import for a supplier"""
+        rows = rows or [('5000000000001', '10.0')]
+        csv_content = 'EAN;Price\n' + ''.join(f'{ean};{price}\n' for ean, price in rows)
+        history = self.env['supplier.import.history'].create({
+            'supplier_id': supplier.id,
+            'import_file_name': 'queue.csv',
+            'state': 'queued',
+            'total_rows': len(rows),
+        })
+        vals = {
+            'history_id': history.id,
+            'supplier_id': supplier.id,
+            'csv_file': base64.b64encode(csv_content.encode('utf-8')),
+            'csv_filename': 'queue.csv',
+            'encoding': 'utf-8',
+            'csv_separator': ';',
+            'mapping': str({'EAN': 'product.barcode', 'Price': 'supplierinfo.price'}),
+        }
+        vals.update(extra)
+        return self.Queue.create(vals)
+
+    def test_01_claim_one_import_per_supplier(self):
+        """Test that claiming respects one running import per supplier"""
+        first_a = self._queue(self.supplier_a)
+        # Andere mapping: wordt niet samengevoegd met first_a
+        second_a = self._queue(self.supplier_a, mapping=str({'EAN': 'product.barcode'}))
+        first_b = self._queue(self.supplier_b)
+        
+        self.assertEqual(self.Queue._claim_next_queue_item(), first_a)
+        self.assertEqual(first_a.state, 'processing')
+        self.assertEqual(first_a.history_id.state, 'running')
+        
+        self.assertEqual(self.Queue._claim_next_queue_item(), first_b, "Supplier A already has a running import")
+        self.assertFalse(self.Queue._claim_next_queue_item())
+        self.assertEqual(second_a.state, 'queued')
+
+    def test_02_claim_respects_global_concurrency(self):
+        """Test that the configured concurrency caps running imports"""
+        self.env['ir.config_parameter'].sudo().set_param('product_supplier_sync.queue_max_concurrency', '1')
+        self._queue(self.supplier_a)
+        self._queue(self.supplier_b)
+        
+        self.assertTrue(self.Queue._claim_next_queue_item())
+        self.assertFalse(self.Queue._claim_next_queue_item())
+
+    def test_03_large_import_runs_as_chunks_and_finalize(self):
+        """Test that a large import is split per key range and finalized once"""
+        eans = ['7000000000001', '7000000000002', '7000000000003']
+        products = self.env['product.product']
+        for ean in eans:
+            products |= self.env['product.product'].create({'name': f'Chunk {ean}', 'barcode': ean})
+        parent = self._queue(self.supplier_a, rows=[(ean, '5.0') for ean in eans] + [('7999999999999', '1.0')])
+        
+        with patch('odoo.addons.product_supplier_sync.models.import_queue.QUEUE_CHUNK_ROWS', 2):
+            for _i in range(6):
+                self.Queue._process_queue()
+        
+        chunks = parent.chunk_ids.filtered(lambda c: c.job_type == 'chunk').sorted(lambda c: c.key_from or '')
+        self.assertEqual(len(chunks), 2)
+        # Chunk keys: unknown EAN, then existing products by template
+        keys = sorted(['7999999999999'] + [f'template:{tmpl_id}' for tmpl_id in products.product_tmpl_id.ids])
+        self.assertEqual((chunks[0].key_from or '', chunks[0].key_to), ('', keys[2]))
+        self.assertEqual(set(parent.chunk_ids.mapped('state')), {'done'})
+        self.assertEqual(parent.state, 'done')
+        
+        history = parent.history_id
+        self.assertEqual(history.state, 'completed_with_errors')
+        self.assertEqual(history.total_rows, 4)
+        self.assertEqual(history.updated_count, 3)
+        self.assertEqual(history.error_count, 1)
+        self.assertEqual(len(history.error_line_ids), 1)
+
+    def test_04_requeue_counts_retry_and_keeps_checkpoint(self):
+        """Test that requeueing increments retry_count and keeps the checkpoint"""
+        item = self._queue(self.supplier_a)
+        item.state = 'failed'
+        item.history_id.write({'state': 'failed', 'last_processed_row': 2500})
+        
+        item.action_requeue()
+        
+        self.assertEqual(item.state, 'queued')
+        self.assertEqual(item.history_id.retry_count, 1)
+        self.assertEqual(item.history_id.last_processed_row, 2500)
+
+    def test_05_time_budget_pauses_and_resumes_import(self):
+        """Test that an import yields after its time slice and continues from the checkpoint"""
+        eans = ['7100000000001', '7100000000002']
+        for ean in eans:
+            self.env['product.product'].create({'name': f'Slice {ean}', 'barcode': ean})
+        item = self._queue(self.supplier_a, rows=[(ean, '3.0') for ean in eans])
+        
+        with patch('odoo.addons.product_supplier_sync.models.import_engine.CHECKPOINT_WINDOW_ROWS', 1):
+            self.assertEqual(self.Queue._claim_next_queue_item(), item)
+            item._execute_queued_import(deadline=1)  # already expired: one window per slice
+            
+            self.assertEqual(item.state, 'queued')
+            self.assertEqual(item.history_id.last_processed_row, 2)
+            self.assertEqual(item.history_id.updated_count, 1)
+            
+            self.Queue._process_queue()
+        
+        self.assertEqual(item.state, 'done')
+        self.assertEqual(item.history_id.updated_count, 2)
+        self.assertEqual(item.history_id.state, 'completed')
+
+    def test_06_enqueue_triggers_queue_cron(self):
+        """Test that enqueueing wakes the queue cron instead of waiting for polling"""
+        cron = self.env.ref('product_supplier_sync.ir_cron_process_import_queue')
+        Trigger = self.env['ir.cron.trigger']
+        before = Trigger.search_count([('cron_id', '=', cron.id)])
+        
+        self._queue(self.supplier_a)
+        
+        self.assertGreater(Trigger.search_count([('cron_id', '=', cron.id)]), before)
+
+    def test_07_fast_lane_and_fair_ordering(self):
+        """Test that small jobs go first and bulk jobs leave the fast lane slot free"""
+        ICP = self.env['ir.config_parameter'].sudo()
+        ICP.set_param('product_supplier_sync.queue_fast_lane_rows', '2')
+        ICP.set_param('product_supplier_sync.queue_max_concurrency', '2')
+        supplier_c = self.env['res.partner'].create({'name': 'Queue Supplier C', 'supplier_rank': 1})
+        big_rows = [(f'72000000000{i:02d}', '1.0') for i in range(5)]
+        
+        big_a = self._queue(self.supplier_a, rows=big_rows)
+        big_b = self._queue(self.supplier_b, rows=big_rows)
+        small_c = self._queue(supplier_c)
+        self.assertEqual((big_a.lane, small_c.lane), ('bulk', 'fast'))
+        
+        self.assertEqual(self.Queue._claim_next_queue_item(), small_c, "Fast lane first")
+        self.assertEqual(self.Queue._claim_next_queue_item(), big_a)
+        self.assertTrue(small_c.started_at)
+        
+        small_c.state = 'done'
+        self.assertFalse(self.Queue._claim_next_queue_item(), "Last slot is reserved for the fast lane")
+        self.assertEqual(big_b.state, 'queued')
+        
+        report = self.Queue._get_wait_time_report()
+        self.assertEqual({(line['supplier_id'], line['lane']) for line in report}, {
+            (self.supplier_a.id, 'bulk'), (supplier_c.id, 'fast'),
+        })
+
+    def test_08_dead_worker_jobs_are_resumed(self):
+        """Test that jobs without a live worker are requeued instead of failed"""
+        import os
+        import socket
+        import subprocess
+        from datetime import timedelta
+        from odoo import fields
+        
+        finished = subprocess.Popen(['true'])
+        finished.wait()
+        now = fields.Datetime.now()
+        host = socket.gethostname()
+        
+        alive = self._queue(self.supplier_a)
+        stale = self._queue(self.supplier_b)
+        dead_pid = self._queue(self.env['res.partner'].create({'name': 'Queue Supplier D', 'supplier_rank': 1}))
+        (alive | stale | dead_pid).write({'state': 'processing', 'worker_host': host})
+        alive.write({'heartbeat_at': now, 'worker_pid': os.getpid()})
+        stale.write({'heartbeat_at': now - timedelta(minutes=10), 'worker_pid': os.getpid()})
+        dead_pid.write({'heartbeat_at': now, 'worker_pid': finished.pid})
+        stale.history_id.last_processed_row = 5000
+        
+        self.Queue._recover_dead_jobs()
+        
+        self.assertEqual(alive.state, 'processing')
+        self.assertEqual(stale.state, 'queued')
+        self.assertEqual(dead_pid.state, 'queued')
+        self.assertEqual(stale.history_id.retry_count, 1)
+        self.assertEqual(stale.history_id.last_processed_row, 5000, "Checkpoint is kept for the resume")
+        
+        # Recovering again (other cron slot) does not count the retry twice
+        self.Queue._recover_dead_jobs()
+        self.assertEqual(stale.history_id.retry_count, 1)
+        
+        with self.assertRaises(UserError):
+            alive.action_requeue()
+        self.assertEqual(alive.state, 'processing')
+
+    def test_09_newer_or_identical_feed_supersedes_queued_job(self):
+        """Test that only the newest payload per supplier and mapping is imported"""
+        older = self._queue(self.supplier_a, rows=[('7300000000001', '1.0')])
+        newer = self._queue(self.supplier_a, rows=[('7300000000001', '2.0')])
+        other_supplier = self._queue(self.supplier_b, rows=[('7300000000001', '1.0')])
+        
+        self.assertEqual(older.state, 'superseded')
+        self.assertEqual(older.superseded_by_id, newer)
+        self.assertFalse(older.payload_id, "Superseded payload is dropped")
+        self.assertEqual(older.history_id.state, 'superseded')
+        self.assertEqual(newer.state, 'queued')
+        self.assertEqual(other_supplier.state, 'queued')
+        self.assertEqual(older.payload_hash, other_supplier.payload_hash)
+        
+        newer.state = 'done'
+        identical = self._queue(self.supplier_a, rows=[('7300000000001', '2.0')])
+        self.assertEqual(identical.state, 'superseded', "Same payload as the last successful import")
+        self.assertEqual(identical.superseded_by_id, newer)
+
+    def test_10_payload_store_dedups_and_releases(self):
+        """Test that payloads are stored once (compressed) and released when a job is done"""
+        Payload = self.env['supplier.import.payload']
+        eans = ['7400000000001', '7400000000002']
+        for ean in eans:
+            self.env['product.product'].create({'name': f'Payload {ean}', 'barcode': ean})
+        rows = [(ean, '4.0') for ean in eans]
+        item_a = self._queue(self.supplier_a, rows=rows)
+        item_b = self._queue(self.supplier_b, rows=rows)
+        
+        payload = item_a.payload_id
+        self.assertTrue(payload)
+        self.assertEqual(item_b.payload_id, payload, "Same content is stored once")
+        self.assertFalse(item_a.csv_file)
+        self.assertEqual(item_a.history_id.payload_id, payload)
+        self.assertEqual(item_a.payload_hash, payload.sha256)
+        with payload._open() as stream:
+            self.assertEqual(stream.read().decode('utf-8'), 'EAN;Price\n' + ''.join(f'{ean};4.0\n' for ean in eans))
+        
+        self.Queue._process_queue()
+        self.Queue._process_queue()
+        
+        self.assertEqual((item_a.state, item_b.state), ('done', 'done'))
+        self.assertFalse(item_a.payload_id | item_b.payload_id, "Done jobs drop their payload reference")
+        self.assertEqual(item_a.history_id.updated_count, 2)
+        self.assertEqual(item_a.history_id.payload_id, payload, "History keeps the reference")
+        
+        payload.last_used = '2000-01-01 00:00:00'
+        Payload._gc_unreferenced_payloads()
+        self.assertFalse(payload.exists())
+        self.assertFalse(item_a.history_id.payload_id)
+
+    def test_11_queue_runs_engine_without_wizard(self):
+        """Test that a queued import runs on the queue record itself, without a temporary wizard"""
+        Wizard = self.env['supplier.direct.import']
+        self.env['product.product'].create({'name': 'Engine product', 'barcode': '7500000000001'})
+        item = self._queue(self.supplier_a, rows=[('7500000000001', '6.0'), ('7599999999999', '1.0')])
+        wizards_before = Wizard.search_count([])
+        
+        self.Queue._process_queue()
+        
+        self.assertEqual(item.state, 'done')
+        self.assertEqual(Wizard.search_count([]), wizards_before)
+        history = item.history_id
+        self.assertEqual(history.state, 'completed_with_errors')
+        self.assertEqual((history.total_rows, history.updated_count, history.error_count), (2, 1, 1))
+        self.assertIn('Aangemaakt', history.summary)
+
+    def test_12_variants_of_one_template_share_a_chunk(self):
+        """Test that chunk boundaries never separate the variants of one template"""
+        attribute = self.env['product.attribute'].create({
+            'name': 'Chunk Maat',
+            'value_ids': [(0, 0, {'name': 'S'}), (0, 0, {'name': 'L'})],
+        })
+        template = self.env['product.template'].create({
+            'name': 'Chunk Variant',
+            'attribute_line_ids': [(0, 0, {'attribute_id': attribute.id, 'value_ids': [(6, 0, attribute.value_ids.ids)]})],
+        })
+        small, large = template.product_variant_ids
+        small.barcode = '7200000000001'
+        large.barcode = '7299999999999'
+        rows = [('7200000000001', '5.0'), ('7250000000000', '1.0'), ('7260000000000', '1.0'), ('7299999999999', '6.0')]
+        parent = self._queue(self.supplier_a, rows=rows)
+        
+        mapping = {'EAN': 'product.barcode', 'Price': 'supplierinfo.price'}
+        self.assertEqual(parent._scan_chunk_keys(mapping), ['7250000000000', '7260000000000', f'template:{template.id}'])
+        
+        with patch('odoo.addons.product_supplier_sync.models.import_queue.QUEUE_CHUNK_ROWS', 1):
+            for _i in range(8):
+                self.Queue._process_queue()
+        
+        self.assertEqual(len(parent.chunk_ids.filtered(lambda c: c.job_type == 'chunk')), 3)
+        self.assertEqual(parent.state, 'done')
+        sellers = template.seller_ids.filtered(lambda s: s.partner_id == self.supplier_a and not s.product_id)
+        self.assertEqual(len(sellers), 1, "One template-level supplierinfo for both variants")
+
+    def test_13_paused_or_split_import_blocks_newer_upload(self):
+        """Test that a newer upload waits while an import of the same supplier is paused or split"""
+        self.env['product.product'].create({'name': 'Pause 1', 'barcode': '7600000000001'})
+        self.env['product.product'].create({'name': 'Pause 2', 'barcode': '7600000000002'})
+        paused = self._queue(self.supplier_a, rows=[('7600000000001', '3.0'), ('7600000000002', '3.0')])
+        
+        with patch('odoo.addons.product_supplier_sync.models.import_engine.CHECKPOINT_WINDOW_ROWS', 1):
+            self.assertEqual(self.Queue._claim_next_queue_item(), paused)
+            paused._execute_queued_import(deadline=1)
+        self.assertEqual(paused.state, 'queued', "Yielded after its first slice")
+        
+        newer = self._queue(self.supplier_a, rows=[('7600000000001', '4.0')])
+        self.assertEqual(newer.state, 'queued', "A started job is not superseded")
+        self.assertEqual(self.Queue._claim_next_queue_item(), paused, "Paused run continues first")
+        self.assertFalse(self.Queue._claim_next_queue_item(), "Newer upload waits for the paused run")
+        
+        paused.state = 'split'
+        self.assertFalse(self.Queue._claim_next_queue_item(), "A split parent blocks the supplier too")
+        paused.state = 'done'
+        self.assertEqual(self.Queue._claim_next_queue_item(), newer)
+
+    def test_14_crashing_job_fails_after_max_recoveries(self):
+        """Test that a job whose worker keeps dying is marked failed instead of requeued forever"""
+        from datetime import timedelta
+        from odoo import fields
+        
+        self.env['ir.config_parameter'].sudo().set_param('product_supplier_sync.queue_max_recoveries', '2')
+        item = self._queue(self.supplier_a)
+        for _attempt in range(2):
+            item.write({'state': 'processing', 'heartbeat_at': fields.Datetime.now() - timedelta(minutes=10)})
+            self.Queue._recover_dead_jobs()
+            self.assertEqual(item.state, 'queued')
+        self.assertEqual(item.recovery_count, 2)
+        
+        item.write({'state': 'processing', 'heartbeat_at': fields.Datetime.now() - timedelta(minutes=10)})
+        self.Queue._recover_dead_jobs()
+        self.assertEqual(item.state, 'failed')
+        self.assertEqual(item.history_id.state, 'failed')
+        
+        item.action_requeue()
+        self.assertEqual((item.state, item.recovery_count), ('queued', 0), "Manual requeue resets the counter")
+
+    def test_15_prescan_resumes_from_cache_across_slices(self):
+        """Test that a prescan interrupted by the time budget continues without rescanning earlier rows"""
+        eans = ['7700000000001', '7700000000002']
+        for ean in eans:
+            self.env['product.product'].create({'name': f'Prescan {ean}', 'barcode': ean})
+        item = self._queue(self.supplier_a, rows=[(ean, '3.0') for ean in eans])
+        
+        Engine = type(self.Queue)
+        prescan_window = Engine._prescan_window
+        scanned_rows = []
+        
+        def spy(record, window, *args):
+            scanned_rows.extend(row_num for row_num, _row in window)
+            return prescan_window(record, window, *args)
+        
+        with patch('odoo.addons.product_supplier_sync.models.import_engine.PRESCAN_WINDOW_SIZE', 1), \
+                patch.object(Engine, '_prescan_window', autospec=True, side_effect=spy):
+            self.assertEqual(self.Queue._claim_next_queue_item(), item)
+            item._execute_queued_import(deadline=1)  # already expired: one prescan window per slice
+            
+            self.assertEqual(item.state, 'queued')
+            self.assertTrue(item.prescan_cache, "Prescan progress kept for the next slice")
+            self.assertEqual(item.history_id.updated_count, 0, "Nothing written before the prescan is complete")
+            
+            self.Queue._process_queue()
+        
+        self.assertEqual(scanned_rows, [2, 3], "Every row is classified once")
+        self.assertEqual(item.state, 'done')
+        self.assertEqual(item.history_id.updated_count, 2)
+        self.assertFalse(item.prescan_cache, "Cache released with the payload")